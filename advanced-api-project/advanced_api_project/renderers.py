@@ -0,0 +1,40 @@
+"""
+JSON renderer backed by orjson, with DRF's stdlib renderer as the fallback.
+
+Compact output matches ``rest_framework.renderers.JSONRenderer`` byte for
+byte: datetimes, Decimals, lazy strings and other non-native types are
+handed to DRF's ``JSONEncoder.default``, and U+2028/U+2029 are escaped the
+same way. The one difference is floats in exponent notation, which orjson
+writes as ``1e16`` where the stdlib writes ``1e+16``.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    OPTIONS = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        # orjson only knows compact or two-space output, so anything else
+        # (the browsable API asks for indent=4) goes through the stdlib.
+        if orjson is None or indent is not None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
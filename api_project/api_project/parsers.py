@@ -0,0 +1,38 @@
+"""
+JSON parser backed by orjson, with DRF's stdlib parser as the fallback.
+
+orjson only reads UTF-8 and rejects NaN/Infinity, which is what DRF does in
+its default strict mode. Bodies orjson cannot handle (other encodings,
+integers wider than 64 bits, invalid JSON) are parsed by ``JSONParser``
+so clients get the same results and error messages as before.
+"""
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson turns integers that do not fit in 64 bits into floats, so bodies
+# with a run of 19+ digits go to the stdlib. Mapping every digit to b'0'
+# and everything else to b' ' makes that check one C-level substring search.
+DIGITS = bytes(ord('0') if chr(b).isdigit() and b < 128 else ord(' ') for b in range(256))
+WIDE_INTEGER = b'0' * 19
+
+
+class ORJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        if WIDE_INTEGER not in body.translate(DIGITS):
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse(io.BytesIO(body), media_type, parser_context)
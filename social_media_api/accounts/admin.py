@@ -1,3 +1,17 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
-# Register your models here.
+from social_media_api.admin_tools import LargeTableAdminMixin
+from .models import User
+
+
+@admin.register(User)
+class UserAdmin(LargeTableAdminMixin, BaseUserAdmin):
+    list_display = ('username', 'email', 'is_staff', 'deleted_at')
+    list_filter = ('is_staff', 'is_active')
+    search_fields = ('^username',)
+    ordering = ('-id',)
+    autocomplete_fields = ('following',)
+    fieldsets = BaseUserAdmin.fieldsets + (
+        ('Profile', {'fields': ('bio', 'profile_picture', 'following', 'deleted_at')}),
+    )
@@ -0,0 +1,96 @@
+"""
+Token authentication with the token -> user lookup cached.
+
+DRF's ``TokenAuthentication`` joins the token and user tables on every
+request. ``CachedTokenAuthentication`` keeps two entries instead, ``token
+key -> user id`` and ``user id -> user``, for ``TIMEOUT`` seconds, so an
+authenticated request reads two cache entries and no rows. A user's entry
+is dropped whenever the user is saved or their follower count is
+recounted, and a token's when the token is deleted (which soft-deleting an
+account does). Only a lookup racing such a change can cache the old
+values, and those expire after ``TIMEOUT``.
+
+That only holds when every process shares ``TOKEN_CACHE['CACHE']``: with a
+per-process cache a deleted token would keep authenticating in the other
+processes until it expired. ``check_configuration()``, run as the accounts
+app loads, refuses ``CachedTokenAuthentication`` on such a cache; the
+settings use DRF's ``TokenAuthentication`` until a shared one is set up.
+
+``request.auth`` is the token key rather than the ``Token``.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+
+from social_media_api.caching import is_process_local
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'TIMEOUT': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_CACHE', {})}
+
+
+def enabled():
+    """Whether ``CachedTokenAuthentication`` is one of the default authentication classes."""
+    return any(issubclass(cls, CachedTokenAuthentication) for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES)
+
+
+def check_configuration():
+    alias = get_config()['CACHE']
+    if enabled() and is_process_local(alias):
+        raise ImproperlyConfigured(
+            f'CachedTokenAuthentication needs a cache shared by every process, and the {alias!r} cache is '
+            'local to each one: deleted tokens would keep working elsewhere. Configure a shared cache '
+            "in TOKEN_CACHE['CACHE'] or use rest_framework.authentication.TokenAuthentication.")
+
+
+def token_key(key):
+    return f'auth:token:{key}'
+
+
+def user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def cache_tokens(tokens):
+    """Cache ``tokens`` (with their users selected) and return the keys written."""
+    config = get_config()
+    entries = {}
+    for token in tokens:
+        entries[token_key(token.key)] = token.user_id
+        entries[user_key(token.user_id)] = token.user
+    caches[config['CACHE']].set_many(entries, config['TIMEOUT'])
+    return list(entries)
+
+
+def forget_tokens(keys):
+    caches[get_config()['CACHE']].delete_many([token_key(key) for key in keys])
+
+
+def forget_users(user_ids):
+    caches[get_config()['CACHE']].delete_many([user_key(user_id) for user_id in user_ids])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cache = caches[get_config()['CACHE']]
+        user_id = cache.get(token_key(key))
+        user = cache.get(user_key(user_id)) if user_id is not None else None
+        if user is None:
+            token = Token.objects.select_related('user').filter(key=key).first()
+            if token is None:
+                raise AuthenticationFailed(_('Invalid token.'))
+            cache_tokens([token])
+            user = token.user
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, key
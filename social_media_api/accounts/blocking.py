@@ -0,0 +1,186 @@
+"""
+Hiding the content of blocked and muted users.
+
+A viewer does not see posts or comments by users they blocked or muted, or
+by users who blocked them. Excluding that set in SQL would add an anti-join
+to every feed and comment query, although almost every author on a page is
+not in it. Instead each viewer has a Bloom filter of the authors hidden from
+them, kept in the cache: authors the filter rules out (nearly all of them)
+cost a few hashes, and only the few it flags are confirmed with one indexed
+query against the block and mute tables, so a false positive never hides
+anything.
+
+The filter is sized for ``ERROR_RATE`` false positives at twice the number
+of hidden authors it was built with. Once a new block or mute commits, the
+cached filters it affects are dropped and rebuilt from the database on the
+next read; adding to them in place, or before the commit, could leave a
+filter a concurrent reader built without the new row cached for
+``TIMEOUT``. Bloom filters cannot forget, so removals only count as stale
+bits, which at worst cost a confirming query; the filter is rebuilt once it
+is half stale, or after ``TIMEOUT`` seconds.
+
+Those deletions only reach the other processes through a shared cache. With
+a per-process one (``LocMemCache``) the filter is built from the database
+for every request instead, as a new block would otherwise leave the blocked
+author visible in the other processes for up to ``TIMEOUT``.
+"""
+import hashlib
+import math
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from social_media_api.caching import is_process_local
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'ERROR_RATE': 0.01,
+    'MIN_CAPACITY': 64,
+    'TIMEOUT': 3600,
+}
+
+_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'HIDDEN_AUTHORS', {})}
+
+
+def is_cached():
+    return not is_process_local(get_config()['CACHE'])
+
+
+class BloomFilter:
+    """Bloom filter over integer ids in a ``bytearray``, with double hashing."""
+
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+        self.count = count
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.to_bytes(8, 'little', signed=True), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def nbytes(self):
+        return len(self.bits)
+
+
+def hidden_author_ids(user_id, among=None):
+    """
+    The exact set of authors hidden from ``user_id``, optionally only
+    those in ``among``: one query over the block and mute tables.
+    """
+    User = get_user_model()
+    Blocked, Muted = User.blocked.through, User.muted.through
+    blocked = Blocked.objects.filter(from_user_id=user_id)
+    muted = Muted.objects.filter(from_user_id=user_id)
+    blocked_by = Blocked.objects.filter(to_user_id=user_id)
+    if among is not None:
+        among = list(among)
+        blocked = blocked.filter(to_user_id__in=among)
+        muted = muted.filter(to_user_id__in=among)
+        blocked_by = blocked_by.filter(from_user_id__in=among)
+    return set(blocked.values_list('to_user_id', flat=True).union(
+        muted.values_list('to_user_id', flat=True),
+        blocked_by.values_list('from_user_id', flat=True)))
+
+
+class HiddenAuthors:
+    """The authors hidden from one viewer: a Bloom filter plus exact confirmation."""
+
+    def __init__(self, user_id, bloom):
+        self.user_id = user_id
+        self.bloom = bloom
+
+    def __bool__(self):
+        return self.bloom.count > 0
+
+    def hidden(self, author_ids):
+        """Which of ``author_ids`` are hidden from the viewer."""
+        if not self:
+            return set()
+        bloom = self.bloom
+        candidates = {author_id for author_id in set(author_ids) if author_id in bloom}
+        if not candidates:
+            return set()
+        return hidden_author_ids(self.user_id, among=candidates)
+
+    def exclude(self, items, author_id):
+        """``items`` without those whose ``author_id(item)`` is hidden."""
+        items = list(items)
+        hidden = self.hidden(author_id(item) for item in items)
+        if not hidden:
+            return items
+        return [item for item in items if author_id(item) not in hidden]
+
+
+def filter_key(user_id):
+    return f'hidden-authors:{user_id}'
+
+
+def _state(bloom, stale=0):
+    return {'capacity': bloom.capacity, 'error_rate': bloom.error_rate, 'bits': bytes(bloom.bits),
+            'count': bloom.count, 'stale': stale}
+
+
+def _load(state):
+    return BloomFilter(state['capacity'], state['error_rate'], state['bits'], state['count'])
+
+
+def build(user_id):
+    """Build the filter for ``user_id`` from the database, caching it when the cache is shared."""
+    config = get_config()
+    ids = hidden_author_ids(user_id)
+    bloom = BloomFilter(max(config['MIN_CAPACITY'], 2 * len(ids)), config['ERROR_RATE'])
+    for author_id in ids:
+        bloom.add(author_id)
+    if is_cached():
+        caches[config['CACHE']].set(filter_key(user_id), _state(bloom), config['TIMEOUT'])
+    return bloom
+
+
+def get_hidden_authors(user):
+    """``HiddenAuthors`` for an authenticated user, ``None`` otherwise."""
+    if user is None or not user.is_authenticated:
+        return None
+    state = caches[get_config()['CACHE']].get(filter_key(user.pk)) if is_cached() else None
+    bloom = _load(state) if state is not None else build(user.pk)
+    return HiddenAuthors(user.pk, bloom)
+
+
+def forget_filters(user_ids):
+    caches[get_config()['CACHE']].delete_many([filter_key(user_id) for user_id in user_ids])
+
+
+def record_removed(user_id, count):
+    """Note ``count`` authors no longer hidden; rebuild once half the filter is stale."""
+    config = get_config()
+    cache = caches[config['CACHE']]
+    with _lock:
+        state = cache.get(filter_key(user_id))
+        if state is None:
+            return
+        stale = state['stale'] + count
+        if 2 * stale >= state['count']:
+            cache.delete(filter_key(user_id))
+            return
+        cache.set(filter_key(user_id), {**state, 'stale': stale}, config['TIMEOUT'])
@@ -0,0 +1,66 @@
+"""
+Cached follow adjacency: the ids of the users each user follows.
+
+Reading a feed starts with the reader's follows. ``following_ids()``
+serves them from the cache as a flat ``array`` (8 bytes an id), loading
+any number of missing users with one query in ``load_following()``. The
+``m2m_changed`` handler in ``accounts.signals`` drops a user's entry when
+their follows change; purging an account drops its followers' entries.
+
+Those deletions only reach the other processes through a shared cache. With
+a per-process one (``LocMemCache``) follows are read from the database on
+every call instead, as an unfollow would otherwise linger elsewhere for up
+to ``TIMEOUT``.
+"""
+from array import array
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from social_media_api.caching import is_process_local
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'TIMEOUT': 3600,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'FOLLOW_GRAPH', {})}
+
+
+def is_cached():
+    return not is_process_local(get_config()['CACHE'])
+
+
+def following_key(user_id):
+    return f'graph:following:{user_id}'
+
+
+def load_following(user_ids):
+    """``{user_id: array of followed ids}`` for ``user_ids``, loading the missing ones in one query."""
+    config = get_config()
+    cache = caches[config['CACHE']]
+    use_cache = is_cached()
+    cached = cache.get_many([following_key(user_id) for user_id in user_ids]) if use_cache else {}
+    result = {user_id: cached[following_key(user_id)] for user_id in user_ids if following_key(user_id) in cached}
+    missing = [user_id for user_id in user_ids if user_id not in result]
+    if missing:
+        loaded = {user_id: array('q') for user_id in missing}
+        Follow = get_user_model().following.through
+        rows = Follow.objects.filter(from_user_id__in=missing).order_by('from_user_id', 'to_user_id')
+        for from_user_id, to_user_id in rows.values_list('from_user_id', 'to_user_id'):
+            loaded[from_user_id].append(to_user_id)
+        if use_cache:
+            cache.set_many({following_key(user_id): ids for user_id, ids in loaded.items()}, config['TIMEOUT'])
+        result.update(loaded)
+    return result
+
+
+def following_ids(user_id):
+    return load_following([user_id])[user_id]
+
+
+def forget_following(user_ids):
+    caches[get_config()['CACHE']].delete_many([following_key(user_id) for user_id in user_ids])
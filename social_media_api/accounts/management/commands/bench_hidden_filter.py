@@ -0,0 +1,44 @@
+import random
+import sys
+
+from django.core.management.base import BaseCommand
+
+from accounts.blocking import DEFAULTS, BloomFilter, HiddenAuthors
+from posts.benchmarking import timed
+
+
+class Command(BaseCommand):
+    help = 'Memory, false positive rate and lookup cost of the hidden-author Bloom filter.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,10000,100000')
+        parser.add_argument('--probes', type=int, default=200_000)
+        parser.add_argument('--error-rate', type=float, default=DEFAULTS['ERROR_RATE'])
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        self.stdout.write(f'{"hidden":>8}{"filter B":>10}{"set B":>11}{"hashes":>8}'
+                          f'{"fp rate":>9}{"expected":>10}{"us/check":>10}{"fp full":>9}')
+        for size in (int(value) for value in options['sizes'].split(',')):
+            members = set(rng.sample(range(1, 10 ** 9), size))
+            # Sized like accounts.blocking.build(): twice the current count.
+            bloom = BloomFilter(max(DEFAULTS['MIN_CAPACITY'], 2 * size), options['error_rate'])
+            for member in members:
+                bloom.add(member)
+            assert all(member in bloom for member in members)
+            probes = rng.sample(range(10 ** 9, 2 * 10 ** 9), options['probes'])
+            false_positives = sum(probe in bloom for probe in probes)
+            expected = (1 - (1 - 1 / bloom.size) ** (bloom.hashes * bloom.count)) ** bloom.hashes
+            set_bytes = sys.getsizeof(members) + sum(sys.getsizeof(member) for member in members)
+            # A page of authors the filter rules out, which never reaches the database.
+            page = [probe for probe in probes if probe not in bloom][:20]
+            hidden = HiddenAuthors(0, bloom)
+            per_check = timed(lambda: hidden.hidden(page), repeat=200) * 1000 / len(page)
+            # The worst case before a rebuild: incremental adds filled it up.
+            for member in rng.sample(range(1, 10 ** 9), bloom.capacity - bloom.count):
+                bloom.add(member)
+            full = sum(probe in bloom for probe in probes)
+            self.stdout.write(
+                f'{size:>8}{bloom.nbytes():>10}{set_bytes:>11}{bloom.hashes:>8}'
+                f'{false_positives / len(probes):>9.4f}{expected:>10.4f}{per_check:>10.2f}'
+                f'{full / len(probes):>9.4f}')
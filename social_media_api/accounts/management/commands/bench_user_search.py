@@ -0,0 +1,48 @@
+import random
+import string
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from accounts.search import normalize, search_users
+from posts.benchmarking import scratch_data, timed
+
+FIRST_NAMES = ['Ana', 'John', 'Joanna', 'Mohamed', 'Li', 'Amara', 'Jose', 'Chen', 'Olga', 'Kwame']
+LAST_NAMES = ['Smith', 'Okafor', 'García', 'Nguyen', 'Müller', 'Kowalski', 'Tanaka', 'Mensah']
+
+
+class Command(BaseCommand):
+    help = 'Time /api/accounts/search/ prefix lookups against many users (in a rolled back transaction).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200_000)
+        parser.add_argument('--prefixes', default='a,jo,jos,mu,user12,user1234,zzz')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        rng = random.Random(1)
+        with scratch_data():
+            rows = []
+            for i in range(options['users']):
+                username = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8))) + str(i)
+                if i % 10 == 0:
+                    username = f'user{i}'
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                rows.append(User(
+                    username=username, first_name=first, last_name=last, password='!',
+                    username_search=normalize(username), name_search=normalize(f'{first} {last}'),
+                    follower_count=int(rng.paretovariate(1.2)) - 1))
+                if len(rows) == 10_000:
+                    User.objects.bulk_create(rows)
+                    rows = []
+            User.objects.bulk_create(rows)
+            self.stdout.write(f'{options["users"]} users')
+            self.stdout.write(f'{"prefix":<12}{"first ms":>10}{"cached ms":>11}  top result')
+            for prefix in options['prefixes'].split(','):
+                cache.delete_many([f'user-search:10:{normalize(prefix)}'])
+                first = timed(lambda: search_users(prefix), repeat=1)
+                warm = timed(lambda: search_users(prefix))
+                top = search_users(prefix)
+                label = f'{top[0].username} ({top[0].follower_count})' if top else '-'
+                self.stdout.write(f'{prefix:<12}{first:>10.2f}{warm:>11.2f}  {label}')
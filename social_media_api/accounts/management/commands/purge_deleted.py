@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.purge import purge_user
+from posts.models import Post
+from posts.purge import DEFAULT_CHUNK_SIZE, purge_post
+
+
+class Command(BaseCommand):
+    help = 'Purge soft-deleted users and posts in small committed chunks. Safe to re-run after an interruption.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between chunks to give other writers the lock.')
+
+    def handle(self, *args, **options):
+        def progress(label, deleted):
+            self.stdout.write(f'  {label}: {deleted} deleted')
+
+        kwargs = {'chunk_size': options['chunk_size'], 'pause': options['pause'], 'progress': progress}
+        for user_id in list(get_user_model().objects.filter(deleted_at__isnull=False).values_list('pk', flat=True)):
+            self.stdout.write(f'Purging user {user_id}')
+            purge_user(user_id, **kwargs)
+        for post_id in list(Post.objects.filter(deleted_at__isnull=False).values_list('pk', flat=True)):
+            self.stdout.write(f'Purging post {post_id}')
+            purge_post(post_id, **kwargs)
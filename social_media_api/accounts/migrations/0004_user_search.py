@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:54
+
+import unicodedata
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').casefold().strip()
+
+
+def backfill(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    db = schema_editor.connection.alias
+    counts = dict(
+        User.following.through.objects.using(db).values('to_user_id').annotate(total=Count('from_user_id'))
+        .values_list('to_user_id', 'total'))
+    batch = []
+    for user in User.objects.using(db).only('username', 'first_name', 'last_name').iterator(chunk_size=2000):
+        user.username_search = normalize(user.username)
+        user.name_search = normalize(f'{user.first_name} {user.last_name}')
+        user.follower_count = counts.get(user.pk, 0)
+        batch.append(user)
+        if len(batch) == 2000:
+            User.objects.using(db).bulk_update(batch, ['username_search', 'name_search', 'follower_count'])
+            batch = []
+    User.objects.using(db).bulk_update(batch, ['username_search', 'name_search', 'follower_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='follower_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='name_search',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=301),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='username_search',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
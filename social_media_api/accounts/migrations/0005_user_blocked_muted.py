@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='blocked',
+            field=models.ManyToManyField(blank=True, related_name='blocked_by', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='muted',
+            field=models.ManyToManyField(blank=True, related_name='muted_by', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
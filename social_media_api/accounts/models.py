@@ -2,8 +2,30 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.conf import settings
 
+from .search import normalize
+
+
 # Create your models here.
 class User(AbstractUser):
     bio = models.TextField(blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
-    following = models.ManyToManyField('self', symmetrical=False, related_name='followers', blank=True)
\ No newline at end of file
+    following = models.ManyToManyField('self', symmetrical=False, related_name='followers', blank=True)
+    # Users whose content this user does not see; blocking also works the
+    # other way round. See accounts.blocking.
+    blocked = models.ManyToManyField('self', symmetrical=False, related_name='blocked_by', blank=True)
+    muted = models.ManyToManyField('self', symmetrical=False, related_name='muted_by', blank=True)
+    # Set when the account is deleted; its content is purged in the background.
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Normalized copies of the username and display name for prefix search,
+    # and the number of followers, kept up to date by accounts.signals.
+    username_search = models.CharField(max_length=150, db_index=True, editable=False, default='')
+    name_search = models.CharField(max_length=301, db_index=True, editable=False, default='')
+    follower_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.username_search = normalize(self.username)
+        self.name_search = normalize(self.get_full_name())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'username', 'first_name', 'last_name'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'username_search', 'name_search'}
+        super().save(*args, **kwargs)
@@ -0,0 +1,52 @@
+"""
+Soft deletion and chunked background purging of user accounts.
+
+A deleted user is deactivated and hidden at once (posts and comments of
+users with ``deleted_at`` set are filtered out by ``visible()``). Their
+comments, comments on their posts, posts, follow edges and token are then
+removed in small, separately committed chunks, and finally the user row.
+The follower counts of the users they followed are recounted at the end.
+"""
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from posts.models import ArchivedComment, ArchivedPost, Attachment, Comment, Post, PostRevision
+from posts.purge import DEFAULT_CHUNK_SIZE, delete_in_chunks
+from .graph import forget_following
+from .search import refresh_follower_counts
+
+User = get_user_model()
+
+
+def soft_delete_user(user):
+    User.objects.filter(pk=user.pk).update(deleted_at=timezone.now(), is_active=False)
+    Token.objects.filter(user=user).delete()
+
+
+def purge_user(user_id, chunk_size=DEFAULT_CHUNK_SIZE, pause=0, progress=None):
+    """Remove everything a soft-deleted user owns, then the user."""
+    Follow = User.following.through
+    followed = list(Follow.objects.filter(from_user_id=user_id).values_list('to_user_id', flat=True))
+    followers = list(Follow.objects.filter(to_user_id=user_id).values_list('from_user_id', flat=True))
+    steps = [
+        Comment.objects.filter(author_id=user_id),
+        Comment.objects.filter(post__author_id=user_id),
+        PostRevision.objects.filter(post__author_id=user_id),
+        Attachment.objects.filter(post_id__in=Post.objects.filter(author_id=user_id).values('pk')),
+        Attachment.objects.filter(post_id__in=ArchivedPost.objects.filter(author_id=user_id).values('pk')),
+        Post.objects.filter(author_id=user_id),
+        ArchivedComment.objects.filter(author_id=user_id),
+        ArchivedComment.objects.filter(post__author_id=user_id),
+        ArchivedPost.objects.filter(author_id=user_id),
+        Follow.objects.filter(from_user_id=user_id),
+        Follow.objects.filter(to_user_id=user_id),
+        Token.objects.filter(user_id=user_id),
+        User.objects.filter(pk=user_id, deleted_at__isnull=False),
+    ]
+    deleted = sum(delete_in_chunks(queryset, chunk_size, pause, progress) for queryset in steps)
+    for start in range(0, len(followed), chunk_size):
+        refresh_follower_counts(followed[start:start + chunk_size])
+    # Deleting the follow rows directly sends no m2m_changed.
+    forget_following(followers)
+    return deleted
@@ -0,0 +1,101 @@
+"""
+Prefix search over usernames and display names.
+
+``User.username_search`` and ``User.name_search`` hold NFKC case-folded
+copies of the username and the full name, so a prefix becomes a range on an
+ordinary index (``column >= 'jo' AND column < 'jo' || U+10FFFF``) on any
+database. Matches are ranked by the denormalized ``follower_count``.
+
+Ranking a narrow prefix means sorting a handful of rows. A broad one such as
+``a`` can match a large share of all users, so once a prefix has more than
+``CANDIDATES`` matches, users are instead read from the ``follower_count``
+index, most followed first, until enough of them match; if that takes more
+than ``WALK_BUDGET`` rows the matches are sorted after all. Either way the
+ranked ids of a broad prefix are cached for ``BROAD_PREFIX_TIMEOUT`` seconds.
+"""
+import unicodedata
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .authentication import forget_users
+
+PREFIX_UPPER_BOUND = '\U0010ffff'
+CANDIDATES = 500
+WALK_BUDGET = 20000
+BROAD_PREFIX_TIMEOUT = 60
+RANKING = ('-follower_count', '-pk')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').casefold().strip()
+
+
+def _matching(prefix):
+    # Only the two ranges, so the database can OR the two indexes; adding
+    # ``deleted_at IS NULL`` here makes SQLite pick that index instead.
+    upper = prefix + PREFIX_UPPER_BOUND
+    return get_user_model().objects.filter(
+        Q(username_search__gte=prefix, username_search__lt=upper)
+        | Q(name_search__gte=prefix, name_search__lt=upper))
+
+
+def _walk_by_followers(prefix, limit):
+    rows = get_user_model().objects.order_by(*RANKING).values_list(
+        'pk', 'username_search', 'name_search', 'deleted_at', 'is_active')
+    ids = []
+    for pk, username, name, deleted_at, is_active in rows[:WALK_BUDGET].iterator(chunk_size=2000):
+        if (username.startswith(prefix) or name.startswith(prefix)) and deleted_at is None and is_active:
+            ids.append(pk)
+            if len(ids) == limit:
+                return ids
+    return None
+
+
+def _ranked_ids(prefix, limit):
+    ids = _walk_by_followers(prefix, limit)
+    if ids is None:
+        ids = list(_matching(prefix).filter(deleted_at__isnull=True, is_active=True)
+                   .order_by(*RANKING).values_list('pk', flat=True)[:limit])
+    return ids
+
+
+def search_users(term, limit=10):
+    """Up to ``limit`` users whose username or name starts with ``term``, most followed first."""
+    prefix = normalize(term)
+    if not prefix:
+        return []
+    User = get_user_model()
+    candidates = list(_matching(prefix).values_list('pk', flat=True)[:CANDIDATES + 1])
+    if len(candidates) <= CANDIDATES:
+        return list(User.objects.filter(pk__in=candidates, deleted_at__isnull=True, is_active=True)
+                    .order_by(*RANKING)[:limit])
+    key = f'user-search:{limit}:{prefix}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = _ranked_ids(prefix, limit)
+        cache.set(key, ids, BROAD_PREFIX_TIMEOUT)
+    users = User.objects.in_bulk(ids)
+    return [users[pk] for pk in ids if pk in users]
+
+
+def shift_follower_counts(user_ids, delta):
+    """Add ``delta`` to the ``follower_count`` of ``user_ids`` without recounting."""
+    user_ids = list(user_ids)
+    get_user_model().objects.filter(pk__in=user_ids).update(follower_count=F('follower_count') + delta)
+    forget_users(user_ids)
+
+
+def refresh_follower_counts(user_ids):
+    """Recount ``follower_count`` for the given users from the follow table."""
+    user_ids = list(user_ids)
+    User = get_user_model()
+    Follow = User.following.through
+    followers = Follow.objects.filter(to_user_id=OuterRef('pk')).values('to_user_id').annotate(
+        total=Count('from_user_id')).values('total')
+    User.objects.filter(pk__in=user_ids).update(
+        follower_count=Coalesce(Subquery(followers), 0))
+    # Cached copies of these users (see accounts.authentication) are stale now.
+    forget_users(user_ids)
@@ -16,3 +16,18 @@ class RegisterSerializer(serializers.Serializer):
         return user
 
 
+class UserSerializer(serializers.ModelSerializer):
+    followers_count = serializers.IntegerField(read_only=True)
+    following_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'bio', 'profile_picture', 'followers_count', 'following_count']
+
+
+class UserSearchSerializer(serializers.ModelSerializer):
+    display_name = serializers.CharField(source='get_full_name', read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'display_name', 'follower_count']
@@ -0,0 +1,106 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_tokens, forget_users
+from .blocking import forget_filters, record_removed
+from .graph import forget_following
+from .search import refresh_follower_counts, shift_follower_counts
+
+User = get_user_model()
+
+
+@receiver(m2m_changed, sender=User.following.through)
+def count_followers(sender, instance, action, reverse, pk_set, **kwargs):
+    # ``user.following.add(...)`` adds one follower to each user in pk_set;
+    # ``user.followers.add(...)`` adds len(pk_set) to the instance. pk_set
+    # only holds new rows for add(), but every pk passed for remove(), so the
+    # rows that exist are read first. clear() recounts.
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_follows = list(instance.following.values_list('pk', flat=True))
+    elif action == 'pre_remove':
+        rows = sender.objects.filter(**{'to_user_id' if reverse else 'from_user_id': instance.pk,
+                                        'from_user_id__in' if reverse else 'to_user_id__in': pk_set})
+        instance._removed_follows = list(rows.values_list('from_user_id' if reverse else 'to_user_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        changed = pk_set if action == 'post_add' else instance.__dict__.pop('_removed_follows', [])
+        delta = 1 if action == 'post_add' else -1
+        if not changed:
+            return
+        if reverse:
+            shift_follower_counts([instance.pk], delta * len(changed))
+        else:
+            shift_follower_counts(changed, delta)
+    elif action == 'post_clear':
+        if reverse:
+            refresh_follower_counts([instance.pk])
+        else:
+            refresh_follower_counts(instance.__dict__.pop('_cleared_follows', []))
+
+
+@receiver(m2m_changed, sender=User.following.through)
+def forget_follow_sets(sender, instance, action, reverse, pk_set, **kwargs):
+    # The cached follows of whoever followed or unfollowed.
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            forget_following([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_followers = list(instance.followers.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        forget_following(instance.__dict__.pop('_cleared_followers', []))
+    elif action in ('post_add', 'post_remove'):
+        forget_following(pk_set)
+
+
+@receiver(post_save, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_users([instance.pk])
+
+
+@receiver(post_delete, sender=Token)
+def forget_cached_token(sender, instance, **kwargs):
+    forget_tokens([instance.key])
+
+
+def _hidden_changes(instance, reverse, pk_set, mutual):
+    # ``(viewer, author_ids)`` pairs for the filters an m2m change touches.
+    # A block hides each side from the other; a mute only hides the muted
+    # user from the one who muted them.
+    if reverse:
+        changes = [(pk, [instance.pk]) for pk in pk_set]
+        if mutual:
+            changes.append((instance.pk, list(pk_set)))
+    else:
+        changes = [(instance.pk, list(pk_set))]
+        if mutual:
+            changes += [(pk, [instance.pk]) for pk in pk_set]
+    return changes
+
+
+def _update_hidden(instance, action, reverse, pk_set, mutual, related):
+    if action == 'pre_clear':
+        instance._cleared_hidden = set(getattr(instance, related).values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_hidden', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
+    changes = _hidden_changes(instance, reverse, pk_set, mutual)
+    if action == 'post_add':
+        transaction.on_commit(lambda: forget_filters([viewer for viewer, _ in changes]))
+    else:
+        transaction.on_commit(lambda: [record_removed(viewer, len(author_ids)) for viewer, author_ids in changes])
+
+
+@receiver(m2m_changed, sender=User.blocked.through)
+def update_hidden_on_block(sender, instance, action, reverse, pk_set, **kwargs):
+    _update_hidden(instance, action, reverse, pk_set, True, 'blocked_by' if reverse else 'blocked')
+
+
+@receiver(m2m_changed, sender=User.muted.through)
+def update_hidden_on_mute(sender, instance, action, reverse, pk_set, **kwargs):
+    _update_hidden(instance, action, reverse, pk_set, False, 'muted_by' if reverse else 'muted')
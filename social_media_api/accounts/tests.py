@@ -1,3 +1,437 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from posts.archive import archive_old_posts
+from posts.models import ArchivedComment, ArchivedPost, Comment, Post
+from social_media_api.throttling import reset_store
+from . import blocking, graph, search
+from .authentication import CachedTokenAuthentication, check_configuration
+from .purge import purge_user, soft_delete_user
+
+User = get_user_model()
+
+# A cache every process sees, as the token and follow caches require.
+SHARED_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'social-media-api-test-cache'),
+    'OPTIONS': {'MAX_ENTRIES': 100_000},
+}}
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class UserBatchTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.carol = User.objects.create_user('carol', password='pw')
+        self.alice.following.add(self.bob, self.carol)
+        self.carol.following.add(self.bob)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_returns_users_in_requested_order_with_missing_ids(self):
+        ids = f'{self.bob.pk},999,{self.alice.pk}'
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/accounts/users/', {'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['username'] for user in response.data['results']], ['bob', 'alice'])
+        self.assertEqual(response.data['results'][0]['followers_count'], 2)
+        self.assertEqual(response.data['results'][1]['following_count'], 2)
+        self.assertEqual(response.data['missing'], [999])
+
+    def test_counts_followers_and_follows_without_joining_both(self):
+        self.bob.following.add(self.alice, self.carol)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/accounts/users/', {'ids': str(self.bob.pk)})
+        self.assertEqual(response.data['results'][0]['followers_count'], 2)
+        self.assertEqual(response.data['results'][0]['following_count'], 2)
+        self.assertNotIn('DISTINCT', queries[0]['sql'])
+
+    def test_rejects_invalid_and_oversized_batches(self):
+        self.assertEqual(self.client.get('/api/accounts/users/', {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/accounts/users/').status_code, 400)
+        too_many = ','.join(str(i) for i in range(1, 102))
+        self.assertEqual(self.client.get('/api/accounts/users/', {'ids': too_many}).status_code, 400)
+        for ids in ('0', '-1', str(2 ** 63), '99999999999999999999'):
+            response = self.client.get('/api/accounts/users/', {'ids': ids})
+            self.assertEqual(response.status_code, 400, ids)
+            self.assertIn('ids', response.data)
+        self.assertEqual(self.client.get('/api/accounts/users/', {'ids': str(2 ** 63 - 1)}).status_code, 200)
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get('/api/accounts/users/', {'ids': '1'}).status_code, 401)
+
+
+class AccountDeletionTests(TestCase):
+    def setUp(self):
+        self.doomed = User.objects.create_user('doomed', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.doomed.following.add(self.other)
+        self.other.following.add(self.doomed)
+        Token.objects.create(user=self.doomed)
+        own = [Post.objects.create(author=self.doomed, title=f'p{i}', content='x') for i in range(5)]
+        self.kept = Post.objects.create(author=self.other, title='kept', content='x')
+        for post in own:
+            Comment.objects.create(post=post, author=self.other, content='on doomed post')
+        Comment.objects.create(post=self.kept, author=self.doomed, content='by doomed')
+        self.kept_comment = Comment.objects.create(post=self.kept, author=self.other, content='kept')
+
+    def test_soft_delete_hides_content_immediately(self):
+        soft_delete_user(self.doomed)
+        self.assertEqual(list(Post.objects.visible()), [self.kept])
+        self.assertEqual(list(Comment.objects.visible()), [self.kept_comment])
+        self.assertFalse(Token.objects.filter(user=self.doomed).exists())
+        self.assertEqual(Post.objects.count(), 6)
+
+    def test_purge_removes_everything_in_chunks(self):
+        soft_delete_user(self.doomed)
+        chunks = []
+        purge_user(self.doomed.pk, chunk_size=2, progress=lambda label, deleted: chunks.append(label))
+        self.assertFalse(User.objects.filter(pk=self.doomed.pk).exists())
+        self.assertEqual(list(Post.objects.all()), [self.kept])
+        self.assertEqual(list(Comment.objects.all()), [self.kept_comment])
+        self.assertEqual(self.other.following.count(), 0)
+        self.assertEqual(self.other.followers.count(), 0)
+        self.assertEqual(chunks.count('posts.Post'), 3)
+
+    def test_purge_recounts_followers(self):
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.follower_count, 1)
+        soft_delete_user(self.doomed)
+        purge_user(self.doomed.pk)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.follower_count, 0)
+
+    def test_purge_removes_archived_content(self):
+        archive_old_posts(days=-1)
+        soft_delete_user(self.doomed)
+        purge_user(self.doomed.pk)
+        self.assertEqual(list(ArchivedPost.objects.values_list('title', flat=True)), ['kept'])
+        self.assertEqual(list(ArchivedComment.objects.values_list('content', flat=True)), ['kept'])
+
+    def test_purge_skips_users_that_are_not_soft_deleted(self):
+        purge_user(self.other.pk)
+        self.assertTrue(User.objects.filter(pk=self.other.pk).exists())
+
+    @override_settings(PURGE_IN_BACKGROUND=False)
+    def test_delete_account_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.doomed)
+        self.assertEqual(client.delete('/api/accounts/me/').status_code, 204)
+        self.assertFalse(User.objects.filter(pk=self.doomed.pk).exists())
+
+    def test_purge_deleted_command_resumes_pending_work(self):
+        soft_delete_user(self.doomed)
+        out = StringIO()
+        call_command('purge_deleted', chunk_size=3, stdout=out)
+        self.assertIn(f'Purging user {self.doomed.pk}', out.getvalue())
+        self.assertFalse(User.objects.filter(pk=self.doomed.pk).exists())
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {'login': '2/min', 'register': '1/hour'},
+})
+class AuthThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_store()
+        self.addCleanup(reset_store)
+        User.objects.create_user('alice', password='secret-pw')
+
+    def test_login_is_throttled_per_client(self):
+        credentials = {'username': 'alice', 'password': 'secret-pw'}
+        codes = [self.client.post('/api/accounts/login/', credentials).status_code for _ in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+        other_client = self.client_class(REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other_client.post('/api/accounts/login/', credentials).status_code, 200)
+
+    def test_register_is_throttled(self):
+        data = {'username': 'bob', 'email': 'bob@example.com', 'password': 'secret-pw'}
+        first = self.client.post('/api/accounts/register/', data)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data['token'], Token.objects.get(user__username='bob').key)
+        second = self.client.post('/api/accounts/register/', {**data, 'username': 'carol'})
+        self.assertEqual(second.status_code, 429)
+        self.assertIn('Retry-After', second)
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_store()
+        self.addCleanup(reset_store)
+        self.client = APIClient()
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        self.client.force_authenticate(self.viewer)
+        self.joan = User.objects.create_user('joan', password='pw', first_name='Joan', last_name='Miró')
+        self.jo = User.objects.create_user('Jo_dev', password='pw')
+        self.ana = User.objects.create_user('ana', password='pw', first_name='Johanna', last_name='Ek')
+        self.fans = [User.objects.create_user(f'fan{i}', password='pw') for i in range(3)]
+
+    def search(self, q, **params):
+        response = self.client.get('/api/accounts/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['results']]
+
+    def test_follower_count_follows_the_follow_table(self):
+        for fan in self.fans:
+            fan.following.add(self.jo)
+        self.ana.followers.add(*self.fans[:2])
+        self.fans[0].following.remove(self.jo, self.joan)
+        self.fans[1].following.clear()
+        counts = dict(User.objects.values_list('username', 'follower_count'))
+        self.assertEqual((counts['Jo_dev'], counts['ana'], counts['joan']), (1, 1, 0))
+        self.jo.followers.remove(*self.fans)
+        self.jo.followers.add(self.ana, self.joan)
+        self.jo.refresh_from_db()
+        self.assertEqual(self.jo.follower_count, 2)
+
+    def test_follows_shift_the_count_without_recounting(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.fans[0].following.add(self.jo)
+            self.fans[0].following.remove(self.jo)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_matches_username_and_name_prefixes_ranked_by_followers(self):
+        for fan in self.fans:
+            fan.following.add(self.jo)
+        self.fans[0].following.add(self.ana)
+        self.assertEqual(self.search('JO'), ['Jo_dev', 'ana', 'joan'])
+        self.assertEqual(self.search('joan'), ['joan'])
+        self.assertEqual(self.search('joan mi'), ['joan'])
+        self.assertEqual(self.search('jo', limit=1), ['Jo_dev'])
+        self.assertEqual(self.search('x'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_renames_are_searchable(self):
+        self.jo.username = 'Zed'
+        self.jo.save(update_fields=['username'])
+        self.assertEqual(self.search('ze'), ['Zed'])
+        self.assertNotIn('Zed', self.search('jo'))
+
+    def test_hides_deleted_users(self):
+        soft_delete_user(self.joan)
+        self.assertEqual(self.search('joan'), [])
+
+    def test_broad_prefixes_are_ranked_from_the_cache(self):
+        self.fans[2].followers.add(self.viewer)
+        original = search.CANDIDATES
+        search.CANDIDATES = 2
+        self.addCleanup(setattr, search, 'CANDIDATES', original)
+        self.assertEqual(self.search('fan', limit=2), ['fan2', 'fan1'])
+        self.fans[1].followers.add(self.viewer, self.joan)
+        self.assertEqual(self.search('fan', limit=2), ['fan2', 'fan1'])
+        cache.clear()
+        self.assertEqual(self.search('fan', limit=2), ['fan1', 'fan2'])
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'search': '2/min'}})
+    def test_is_throttled(self):
+        codes = [self.client.get('/api/accounts/search/', {'q': q}).status_code for q in ('j', 'jo', 'joa')]
+        self.assertEqual(codes, [200, 200, 429])
+
+    def test_validates_limit(self):
+        self.assertEqual(self.client.get('/api/accounts/search/', {'q': 'a', 'limit': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/accounts/search/', {'q': 'a', 'limit': 50}).status_code, 400)
+        self.assertEqual(APIClient().get('/api/accounts/search/', {'q': 'a'}).status_code, 401)
+
+
+class BloomFilterTests(TestCase):
+    def test_has_no_false_negatives_and_few_false_positives(self):
+        bloom = blocking.BloomFilter(1000, 0.01)
+        for item in range(0, 2000, 2):
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in range(0, 2000, 2)))
+        false_positives = sum(item in bloom for item in range(1, 200001, 2))
+        self.assertLess(false_positives / 100000, 0.02)
+
+    def test_survives_a_round_trip_through_the_cache(self):
+        bloom = blocking.BloomFilter(64, 0.01)
+        bloom.add(7)
+        copy = blocking._load(blocking._state(bloom))
+        self.assertIn(7, copy)
+        self.assertEqual(copy.count, 1)
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class BlockMuteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.carol = User.objects.create_user('carol', password='pw')
+        self.alice.following.add(self.bob, self.carol)
+        self.bob.following.add(self.alice)
+        self.post = Post.objects.create(author=self.alice, title='Hello', content='x')
+        self.bob_post = Post.objects.create(author=self.bob, title='From bob', content='x')
+        self.carol_post = Post.objects.create(author=self.carol, title='From carol', content='x')
+        for author in (self.alice, self.bob, self.carol):
+            Comment.objects.create(post=self.post, author=author, content=author.username)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def comment_authors(self, comments):
+        return sorted(comment['content'] for comment in comments)
+
+    def test_block_drops_follows_and_prevents_following_back(self):
+        response = self.client.post(f'/api/accounts/block/{self.bob.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.alice.following.filter(pk=self.bob.pk).exists())
+        self.assertFalse(self.bob.following.filter(pk=self.alice.pk).exists())
+        bob_client = APIClient()
+        bob_client.force_authenticate(self.bob)
+        self.assertEqual(bob_client.post(f'/api/accounts/follow/{self.alice.pk}/').status_code, 403)
+        self.assertEqual(self.client.post(f'/api/accounts/block/{self.alice.pk}/').status_code, 400)
+        self.assertEqual(self.client.post('/api/accounts/block/999/').status_code, 404)
+
+    def test_blocked_and_blocking_users_comments_are_left_out(self):
+        self.client.post(f'/api/accounts/block/{self.bob.pk}/')
+        expected = ['alice', 'carol']
+        self.assertEqual(self.comment_authors(self.client.get('/api/comments/').data), expected)
+        self.assertEqual(self.comment_authors(self.client.get(f'/api/posts/{self.post.pk}/').data['comments']), expected)
+        threads = self.client.get(f'/api/posts/{self.post.pk}/comments/').data['results']
+        self.assertEqual(self.comment_authors(threads), expected)
+        listed = {post['id']: post for post in self.client.get('/api/posts/').data['results']}
+        self.assertEqual(self.comment_authors(listed[self.post.pk]['comments']), expected)
+        streamed = json.loads(b''.join(self.client.get('/api/posts/', {'stream': 1}).streaming_content))
+        listed = {post['id']: post for post in streamed['results']}
+        self.assertEqual(self.comment_authors(listed[self.post.pk]['comments']), expected)
+        # Blocking hides the blocker from the blocked user too.
+        bob_client = APIClient()
+        bob_client.force_authenticate(self.bob)
+        self.assertEqual(self.comment_authors(bob_client.get('/api/comments/').data), ['bob', 'carol'])
+
+    def test_muted_followees_leave_the_feed_until_unmuted(self):
+        self.client.get('/api/feed/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/accounts/mute/{self.carol.pk}/').status_code, 200)
+        titles = [post['title'] for post in self.client.get('/api/feed/').data]
+        self.assertEqual(titles, ['From bob'])
+        self.assertEqual(self.comment_authors(self.client.get('/api/comments/').data), ['alice', 'bob'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/accounts/unmute/{self.carol.pk}/')
+        titles = [post['title'] for post in self.client.get('/api/feed/').data]
+        self.assertEqual(titles, ['From carol', 'From bob'])
+
+    def test_new_blocks_drop_the_cached_filter_once_committed(self):
+        blocking.build(self.alice.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.muted.add(self.carol)
+            self.bob.blocked.add(self.alice)
+            # A filter a reader builds before the commit must not survive it.
+            blocking.build(self.alice.pk)
+            self.assertIsNotNone(cache.get(blocking.filter_key(self.alice.pk)))
+        self.assertIsNone(cache.get(blocking.filter_key(self.alice.pk)))
+        hidden = blocking.get_hidden_authors(self.alice)
+        self.assertEqual(hidden.bloom.count, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(hidden.hidden([self.alice.pk]), set())
+        self.assertEqual(hidden.hidden([self.alice.pk, self.bob.pk, self.carol.pk]), {self.bob.pk, self.carol.pk})
+
+    def test_removals_count_as_stale_until_half_the_filter_is(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.muted.add(self.bob, self.carol)
+        blocking.build(self.alice.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.muted.remove(self.carol)
+        self.assertIsNone(cache.get(blocking.filter_key(self.alice.pk)))
+        self.assertEqual(blocking.get_hidden_authors(self.alice).bloom.count, 1)
+
+    def test_filters_are_not_cached_per_process(self):
+        with override_settings(CACHES=LOCAL_CACHES):
+            blocking.get_hidden_authors(self.alice)
+            self.assertIsNone(cache.get(blocking.filter_key(self.alice.pk)))
+            self.bob.blocked.add(self.alice)
+            self.assertEqual(blocking.get_hidden_authors(self.alice).hidden([self.bob.pk]), {self.bob.pk})
+
+    def test_users_without_hidden_authors_skip_the_check(self):
+        blocking.build(self.alice.pk)
+        hidden = blocking.get_hidden_authors(self.alice)
+        self.assertFalse(hidden)
+        with self.assertNumQueries(0):
+            self.assertEqual(hidden.hidden([self.bob.pk]), set())
+
+
+@override_settings(CACHES=SHARED_CACHES, REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': ['accounts.authentication.CachedTokenAuthentication'],
+})
+class CachedLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.carol = User.objects.create_user('carol', password='pw')
+        self.token = Token.objects.get_or_create(user=self.alice)[0]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.token.key)
+
+    def test_token_lookup_is_cached(self):
+        self.assertEqual(self.authenticate(), (self.alice, self.token.key))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate()[0], self.alice)
+
+    def test_deactivating_the_user_or_deleting_the_token_takes_effect(self):
+        self.authenticate()
+        self.alice.is_active = False
+        self.alice.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.alice.is_active = True
+        self.alice.save()
+        self.authenticate()
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_refuses_a_per_process_cache(self):
+        check_configuration()
+        with override_settings(CACHES=LOCAL_CACHES):
+            with self.assertRaises(ImproperlyConfigured):
+                check_configuration()
+            with override_settings(REST_FRAMEWORK=settings.REST_FRAMEWORK | {
+                    'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.TokenAuthentication']}):
+                check_configuration()
+
+    def test_follows_are_not_cached_per_process(self):
+        with override_settings(CACHES=LOCAL_CACHES):
+            graph.following_ids(self.alice.pk)
+            self.alice.following.add(self.bob)
+            self.assertEqual(list(graph.following_ids(self.alice.pk)), [self.bob.pk])
+            self.assertIsNone(cache.get(graph.following_key(self.alice.pk)))
+
+    def test_follow_changes_drop_the_cached_follow_sets(self):
+        self.alice.following.add(self.bob)
+        self.carol.following.add(self.bob)
+        self.assertEqual(list(graph.following_ids(self.alice.pk)), [self.bob.pk])
+        graph.following_ids(self.carol.pk)
+        with self.assertNumQueries(0):
+            graph.following_ids(self.alice.pk)
+        self.alice.following.add(self.carol)
+        self.assertEqual(sorted(graph.following_ids(self.alice.pk)), [self.bob.pk, self.carol.pk])
+        self.bob.followers.clear()
+        self.assertEqual(list(graph.following_ids(self.alice.pk)), [self.carol.pk])
+        self.assertEqual(list(graph.following_ids(self.carol.pk)), [])
+
+    def test_login_records_last_login(self):
+        response = self.client.post('/api/accounts/login/', {'username': 'bob', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+        self.bob.refresh_from_db()
+        self.assertIsNotNone(self.bob.last_login)
@@ -1,10 +1,20 @@
 from django.urls import path
 from .views import RegisterView, LoginView
-from .views import FollowView, UnfollowView
+from .views import FollowView, UnfollowView, UserList, DeleteAccountView, UserSearchView
+from .views import BlockView, UnblockView, MuteView, UnmuteView
+from posts.views import AuthorPostsView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('follow/<int:user_id>/', FollowView.as_view(), name='follow'),
     path('unfollow/<int:user_id>/', UnfollowView.as_view(), name='unfollow'),
+    path('block/<int:user_id>/', BlockView.as_view(), name='block'),
+    path('unblock/<int:user_id>/', UnblockView.as_view(), name='unblock'),
+    path('mute/<int:user_id>/', MuteView.as_view(), name='mute'),
+    path('unmute/<int:user_id>/', UnmuteView.as_view(), name='unmute'),
+    path('<int:user_id>/posts/', AuthorPostsView.as_view(), name='author-posts'),
+    path('users/', UserList.as_view(), name='user-batch'),
+    path('me/', DeleteAccountView.as_view(), name='delete-account'),
+    path('search/', UserSearchView.as_view(), name='user-search'),
 ]
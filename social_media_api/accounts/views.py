@@ -5,30 +5,47 @@ from rest_framework.views import APIView
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import get_user_model
-from .serializers import RegisterSerializer
+from django.contrib.auth.models import update_last_login
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .purge import purge_user, soft_delete_user
+from .search import search_users
+from .serializers import RegisterSerializer, UserSearchSerializer, UserSerializer
+from outbox.relay import publish
+from posts.purge import run_in_background
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import generics
 from rest_framework import permissions
-from .models import CustomUser
+from rest_framework.exceptions import ValidationError
+from social_media_api.batch import in_requested_order, parse_ids
+from social_media_api.throttling import LoginThrottle, RegisterThrottle, SearchThrottle
 
 User = get_user_model()
 
 # Create your views here.
 class RegisterView(APIView):
+    throttle_classes = [RegisterThrottle]
+
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
-            user, token = serializer.save()
+            user = serializer.save()
+            token = Token.objects.get(user=user)
+            update_last_login(None, user)
             return Response({'token': token.key}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class LoginView(ObtainAuthToken):
+    throttle_classes = [LoginThrottle]
+
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data,
                                            context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
+        update_last_login(None, user)
         return Response({
             'token': token.key,
             'user_id': user.pk,
@@ -43,7 +60,13 @@ class FollowView(APIView):
             user_to_follow = User.objects.get(id=user_id)
             if user_to_follow == request.user:
                 return Response({'error': 'You cannot follow yourself'}, status=status.HTTP_400_BAD_REQUEST)
-            request.user.following.add(user_to_follow)
+            if User.blocked.through.objects.filter(
+                    Q(from_user=request.user, to_user=user_to_follow)
+                    | Q(from_user=user_to_follow, to_user=request.user)).exists():
+                return Response({'error': 'You cannot follow this user'}, status=status.HTTP_403_FORBIDDEN)
+            with transaction.atomic():
+                request.user.following.add(user_to_follow)
+                publish('user.followed', {'follower': request.user.pk, 'followed': user_to_follow.pk})
             return Response(status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
@@ -54,12 +77,126 @@ class UnfollowView(APIView):
     def post(self, request, user_id):
         try:
             user_to_unfollow = User.objects.get(id=user_id)
-            request.user.following.remove(user_to_unfollow)
+            with transaction.atomic():
+                request.user.following.remove(user_to_unfollow)
+                publish('user.unfollowed', {'follower': request.user.pk, 'followed': user_to_unfollow.pk})
+            return Response(status=status.HTTP_200_OK)
+        except User.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+class BlockView(APIView):
+    """
+    ``POST /api/accounts/block/<id>/``: hide each user's content from the
+    other and drop the follows between them.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, user_id):
+        try:
+            user_to_block = User.objects.get(id=user_id)
+            if user_to_block == request.user:
+                return Response({'error': 'You cannot block yourself'}, status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                request.user.blocked.add(user_to_block)
+                for follower, followed in [(request.user, user_to_block), (user_to_block, request.user)]:
+                    if follower.following.filter(pk=followed.pk).exists():
+                        follower.following.remove(followed)
+                        publish('user.unfollowed', {'follower': follower.pk, 'followed': followed.pk})
+            return Response(status=status.HTTP_200_OK)
+        except User.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+class UnblockView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, user_id):
+        try:
+            request.user.blocked.remove(User.objects.get(id=user_id))
             return Response(status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+class MuteView(APIView):
+    """``POST /api/accounts/mute/<id>/``: hide a user's content without them knowing."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, user_id):
+        try:
+            user_to_mute = User.objects.get(id=user_id)
+            if user_to_mute == request.user:
+                return Response({'error': 'You cannot mute yourself'}, status=status.HTTP_400_BAD_REQUEST)
+            request.user.muted.add(user_to_mute)
+            return Response(status=status.HTTP_200_OK)
+        except User.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+class UnmuteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, user_id):
+        try:
+            request.user.muted.remove(User.objects.get(id=user_id))
+            return Response(status=status.HTTP_200_OK)
+        except User.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+class DeleteAccountView(APIView):
+    """
+    ``DELETE /api/accounts/me/``: hide the account and its content at once
+    and purge it in the background.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request):
+        soft_delete_user(request.user)
+        run_in_background(purge_user, request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class UserList(generics.GenericAPIView):
+    """
+    ``GET /api/accounts/users/?ids=3,1,2``: the requested users in the
+    requested order with their follower counts, fetched in one query, plus
+    the ids that do not exist.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    queryset = User.objects.all()
+    serializer_class = UserSerializer
+
+    def get_queryset(self):
+        # Joining both follow tables would multiply each user's rows by
+        # followers x following; the follower count is kept on the row.
+        following = User.following.through.objects.filter(from_user_id=OuterRef('pk')).values(
+            'from_user_id').annotate(total=Count('to_user_id')).values('total')
+        return super().get_queryset().annotate(
+            followers_count=F('follower_count'),
+            following_count=Coalesce(Subquery(following), 0),
+        )
+
+    def get(self, request):
+        ids = parse_ids(request.query_params.get('ids', ''))
+        users, missing = in_requested_order(
+            self.get_queryset().filter(id__in=ids, deleted_at__isnull=True), ids, key=lambda user: user.pk)
+        serializer = self.get_serializer(users, many=True)
+        return Response({'results': serializer.data, 'missing': missing})
+
+class UserSearchView(generics.GenericAPIView):
+    """
+    ``GET /api/accounts/search/?q=jo``: up to ``limit`` (default 10, at most
+    20) users whose username or display name starts with ``q``, ignoring
+    case, most followed first.
+    """
     permission_classes = [permissions.IsAuthenticated]
-    queryset = CustomUser.objects.all()
-    serializer_class = RegisterSerializer
+    # Autocomplete calls this on every keystroke.
+    throttle_classes = [SearchThrottle]
+    serializer_class = UserSearchSerializer
+    max_limit = 20
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        if not 1 <= limit <= self.max_limit:
+            raise ValidationError({'limit': f'Must be between 1 and {self.max_limit}.'})
+        users = search_users(request.query_params.get('q', ''), limit)
+        return Response({'results': self.get_serializer(users, many=True).data})
@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import OutboxEvent
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'created_at', 'available_at', 'attempts')
+    list_filter = ('topic',)
+    readonly_fields = ('topic', 'payload', 'created_at', 'attempts', 'done', 'last_error')
+    ordering = ('id',)
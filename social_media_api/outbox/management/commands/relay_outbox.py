@@ -0,0 +1,29 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from outbox.relay import get_relay
+
+
+class Command(BaseCommand):
+    help = 'Deliver outbox events to their consumers, reporting backlog and lag.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due.')
+        parser.add_argument('--report-every', type=float, default=60.0,
+                            help='Seconds between metric reports while running.')
+
+    def handle(self, *args, once=False, report_every=60.0, **options):
+        relay = get_relay()
+        if once:
+            relay.drain()
+            self.stdout.write(json.dumps(relay.metrics()))
+            return
+        next_report = 0.0
+        while True:
+            relay.drain()
+            if time.monotonic() >= next_report:
+                self.stdout.write(json.dumps(relay.metrics()))
+                next_report = time.monotonic() + report_every
+            time.sleep(relay.poll_interval)
@@ -0,0 +1,26 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OutboxEvent(models.Model):
+    """
+    A domain event written in the same transaction as the change it
+    describes, waiting for the relay to hand it to its consumers.
+    """
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+    # When the relay may pick the event up: now for new events, the end of
+    # the lease while a relay holds it, the backoff after a failure.
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    # Consumers that already succeeded, skipped when the event is retried.
+    done = models.JSONField(default=list)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['available_at', 'id'])]
+
+    def __str__(self):
+        return f'{self.topic} #{self.pk}'
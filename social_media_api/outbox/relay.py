@@ -0,0 +1,275 @@
+"""
+Transactional outbox.
+
+Work that follows a write (pushing a new post to open feed streams,
+counting its hashtags, reacting to a follow) used to run in an
+``on_commit`` callback on the request thread, and was lost if the process
+died between the commit and the callback. Instead ``publish()`` inserts an
+``OutboxEvent`` in the same transaction as the change, so the event exists
+exactly when the change does, and the request pays for that one INSERT.
+
+``Relay`` drains the table oldest first, ``BATCH_SIZE`` events at a time.
+Claiming a batch only moves its ``available_at`` forward by ``LEASE``
+seconds in a short transaction (``SELECT ... FOR UPDATE SKIP LOCKED`` where
+the database has it), so relays in several processes can run side by side
+and an event held by a relay that died is picked up again once its lease
+runs out. Each consumer runs in its own transaction; an event is deleted
+once all its consumers succeeded. A failing consumer is retried with
+exponential backoff, up to ``MAX_ATTEMPTS`` times, without re-running the
+consumers that already succeeded.
+
+Delivery is at least once: a relay that dies after a consumer finished but
+before the event was deleted delivers it again, so consumers must be
+idempotent. ``deliver_once()`` helps where the work is not naturally so.
+
+``OUTBOX['RELAY']`` picks who drains the table:
+
+* ``'thread'``: a daemon thread in each process, started by its first
+  publish, woken after every commit that published something, and polling
+  every ``POLL_INTERVAL`` seconds;
+* ``'inline'``: the committing thread drains right after the commit (tests);
+* ``'external'``: only ``manage.py relay_outbox``.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'RELAY': 'thread',
+    'BATCH_SIZE': 100,
+    'LEASE': 30,
+    'POLL_INTERVAL': 1.0,
+    'RETRY_DELAY': 1.0,
+    'MAX_RETRY_DELAY': 3600,
+    'MAX_ATTEMPTS': 10,
+}
+
+_consumers = {}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OUTBOX', {})}
+
+
+def consumer(topic):
+    """Register ``func(event)`` to receive the events published on ``topic``."""
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        _consumers.setdefault(topic, {})[name] = func
+        return func
+    return register
+
+
+def consumers_for(topic):
+    return _consumers.get(topic, {})
+
+
+def publish(topic, payload, using='default'):
+    """
+    Record an event in the current transaction. Call it inside the
+    ``transaction.atomic()`` block that makes the change, so that one is
+    never committed without the other.
+    """
+    event = OutboxEvent.objects.using(using).create(topic=topic, payload=payload)
+    transaction.on_commit(wake, using=using)
+    return event
+
+
+def deliver_once(event, name, func, timeout=86400):
+    """
+    Run ``func()`` unless it already succeeded for ``(event, name)`` within
+    ``timeout`` seconds, for consumers whose work is not idempotent. The
+    mark is only set once ``func()`` returns, so work that failed is retried;
+    a relay that dies between the two runs it again.
+    """
+    key = f'outbox:{event.pk}:{name}'
+    if cache.get(key) is not None:
+        return
+    func()
+    cache.set(key, 1, timeout)
+
+
+class Relay:
+    def __init__(self, batch_size=100, lease=30, poll_interval=1.0, retry_delay=1.0,
+                 max_retry_delay=3600, max_attempts=10):
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.delivered = 0
+        self.failures = 0
+        self.batches = 0
+        self.last_lag = None
+        self.last_drain_at = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+
+    def claim(self):
+        """Lease the next batch of due events to this relay and return them."""
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(available_at__lte=now, attempts__lt=self.max_attempts)
+                .order_by('available_at', 'id').values_list('id', flat=True)[:self.batch_size])
+            if ids:
+                OutboxEvent.objects.filter(id__in=ids).update(available_at=now + timedelta(seconds=self.lease))
+        return list(OutboxEvent.objects.filter(id__in=ids).order_by('id')) if ids else []
+
+    def deliver(self, event):
+        """Run the consumers ``event`` still needs; True when none failed."""
+        failed = None
+        for name, func in consumers_for(event.topic).items():
+            if name in event.done:
+                continue
+            try:
+                with transaction.atomic():
+                    func(event)
+            except Exception as exc:
+                logger.exception('Outbox consumer %s failed on event %s', name, event.pk)
+                failed = f'{name}: {exc!r}'
+                self.failures += 1
+                continue
+            event.done.append(name)
+        if failed is None:
+            return True
+        event.attempts += 1
+        delay = min(self.retry_delay * 2 ** (event.attempts - 1), self.max_retry_delay)
+        event.available_at = timezone.now() + timedelta(seconds=delay)
+        event.last_error = failed
+        event.save(update_fields=['attempts', 'available_at', 'done', 'last_error'])
+        if event.attempts >= self.max_attempts:
+            logger.error('Outbox event %s gave up after %s attempts', event.pk, event.attempts)
+        return False
+
+    def run_batch(self):
+        """Claim and deliver one batch; returns how many events it held."""
+        events = self.claim()
+        if not events:
+            return 0
+        delivered = [event.pk for event in events if self.deliver(event)]
+        if delivered:
+            OutboxEvent.objects.filter(id__in=delivered).delete()
+        now = timezone.now()
+        self.delivered += len(delivered)
+        self.batches += 1
+        self.last_lag = (now - events[0].created_at).total_seconds()
+        self.last_drain_at = now
+        return len(events)
+
+    def drain(self):
+        """Deliver batches until nothing is due. Returns the number of events handled."""
+        handled = 0
+        # One drain at a time per relay; a wake during a drain is picked up
+        # by the loop's next claim.
+        with self._drain_lock:
+            while True:
+                count = self.run_batch()
+                handled += count
+                if count < self.batch_size:
+                    return handled
+
+    def metrics(self):
+        """
+        Backlog and lag: ``lag_seconds`` is the age of the oldest event still
+        due, ``last_batch_lag_seconds`` how old the oldest event of the last
+        delivered batch was when it was delivered.
+        """
+        now = timezone.now()
+        pending = OutboxEvent.objects.filter(attempts__lt=self.max_attempts).aggregate(
+            count=Count('id'), oldest=Min('created_at'))
+        return {
+            'pending': pending['count'],
+            'dead': OutboxEvent.objects.filter(attempts__gte=self.max_attempts).count(),
+            'lag_seconds': (now - pending['oldest']).total_seconds() if pending['oldest'] else 0.0,
+            'last_batch_lag_seconds': self.last_lag,
+            'delivered': self.delivered,
+            'consumer_failures': self.failures,
+            'batches': self.batches,
+            'last_drain_at': self.last_drain_at.isoformat() if self.last_drain_at else None,
+        }
+
+    def notify(self):
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self.run_forever, name='outbox-relay', daemon=True)
+                    self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join()
+
+    def run_forever(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.drain()
+                except Exception:
+                    logger.exception('Outbox relay failed; retrying')
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            connection.close()
+
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def get_relay():
+    global _relay
+    if _relay is None:
+        with _relay_lock:
+            if _relay is None:
+                config = get_config()
+                _relay = Relay(
+                    batch_size=config['BATCH_SIZE'],
+                    lease=config['LEASE'],
+                    poll_interval=config['POLL_INTERVAL'],
+                    retry_delay=config['RETRY_DELAY'],
+                    max_retry_delay=config['MAX_RETRY_DELAY'],
+                    max_attempts=config['MAX_ATTEMPTS'],
+                )
+    return _relay
+
+
+def reset_relay():
+    global _relay
+    with _relay_lock:
+        relay, _relay = _relay, None
+    if relay is not None:
+        relay.stop()
+
+
+def wake():
+    """Called after a commit that published events."""
+    mode = get_config()['RELAY']
+    if mode == 'inline':
+        get_relay().drain()
+    elif mode == 'thread':
+        get_relay().start().notify()
@@ -0,0 +1,157 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from posts.models import Post
+from .models import OutboxEvent
+from .relay import Relay, consumer, consumers_for, deliver_once, publish
+
+User = get_user_model()
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.fail = set()
+        self.relay = Relay(batch_size=2, retry_delay=10, max_attempts=2)
+        for name in ('first', 'second'):
+            self.register(name)
+
+    def register(self, name):
+        def handle(event):
+            self.calls.append((name, event.payload['n']))
+            if name in self.fail:
+                raise RuntimeError(name)
+        handle.__qualname__ = name
+        consumer('test.event')(handle)
+        self.addCleanup(consumers_for('test.event').clear)
+
+    def test_event_commits_with_the_change(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            publish('test.event', {'n': 1})
+            raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+        with self.captureOnCommitCallbacks() as callbacks:
+            publish('test.event', {'n': 2})
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(OutboxEvent.objects.get().payload, {'n': 2})
+
+    def test_creating_a_post_costs_one_insert(self):
+        author = User.objects.create_user('author', password='pw')
+        client = APIClient()
+        client.force_authenticate(author)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = client.post('/api/posts/', {'title': 'Hi #there', 'content': 'x'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(callbacks), 1)
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.topic, event.payload), ('post.created', {'id': response.data['id'], 'author': author.pk}))
+
+    def test_follow_publishes_an_event(self):
+        alice, bob = User.objects.create_user('alice', password='pw'), User.objects.create_user('bob', password='pw')
+        client = APIClient()
+        client.force_authenticate(alice)
+        client.post(f'/api/accounts/follow/{bob.pk}/')
+        client.post(f'/api/accounts/unfollow/{bob.pk}/')
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('id').values_list('topic', 'payload')),
+            [('user.followed', {'follower': alice.pk, 'followed': bob.pk}),
+             ('user.unfollowed', {'follower': alice.pk, 'followed': bob.pk})])
+
+    def test_block_publishes_the_unfollows_it_causes(self):
+        alice, bob = User.objects.create_user('alice', password='pw'), User.objects.create_user('bob', password='pw')
+        bob.following.add(alice)
+        client = APIClient()
+        client.force_authenticate(alice)
+        client.post(f'/api/accounts/block/{bob.pk}/')
+        self.assertEqual(list(OutboxEvent.objects.values_list('topic', 'payload')),
+                         [('user.unfollowed', {'follower': bob.pk, 'followed': alice.pk})])
+
+    def test_deliver_once_marks_only_work_that_succeeded(self):
+        cache.clear()
+        publish('test.event', {'n': 1})
+        event = OutboxEvent.objects.get()
+        work = mock.Mock(side_effect=[RuntimeError, None, None])
+        with self.assertRaises(RuntimeError):
+            deliver_once(event, 'work', work)
+        deliver_once(event, 'work', work)
+        deliver_once(event, 'work', work)
+        self.assertEqual(work.call_count, 2)
+
+    def test_drains_in_batches_and_deletes_delivered_events(self):
+        for n in range(5):
+            publish('test.event', {'n': n})
+        self.assertEqual(self.relay.drain(), 5)
+        self.assertEqual([n for name, n in self.calls if name == 'first'], [0, 1, 2, 3, 4])
+        self.assertFalse(OutboxEvent.objects.exists())
+        metrics = self.relay.metrics()
+        self.assertEqual((metrics['pending'], metrics['delivered'], metrics['batches']), (0, 5, 3))
+        self.assertGreaterEqual(metrics['last_batch_lag_seconds'], 0)
+
+    def test_failed_consumer_is_retried_alone_with_backoff(self):
+        publish('test.event', {'n': 1})
+        self.fail.add('second')
+        with self.assertLogs('outbox.relay', 'ERROR'):
+            self.relay.drain()
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.attempts, event.done), (1, [f'{__name__}.first']))
+        self.assertIn('RuntimeError', event.last_error)
+        self.assertGreater(event.available_at, timezone.now() + timedelta(seconds=9))
+        self.assertEqual(self.relay.drain(), 0)
+
+        self.fail.clear()
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.relay.drain()
+        self.assertEqual(self.calls, [('first', 1), ('second', 1), ('second', 1)])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_gives_up_after_max_attempts(self):
+        publish('test.event', {'n': 1})
+        self.fail.add('first')
+        with self.assertLogs('outbox.relay', 'ERROR') as logs:
+            for _ in range(3):
+                OutboxEvent.objects.update(available_at=timezone.now())
+                self.relay.drain()
+        self.assertIn('gave up after 2 attempts', logs.output[-1])
+        self.assertEqual(OutboxEvent.objects.get().attempts, 2)
+        metrics = self.relay.metrics()
+        self.assertEqual((metrics['pending'], metrics['dead'], metrics['consumer_failures']), (0, 1, 2))
+
+    def test_claimed_events_are_leased(self):
+        publish('test.event', {'n': 1})
+        self.assertEqual(len(self.relay.claim()), 1)
+        self.assertEqual(self.relay.claim(), [])
+        later = timezone.now() + timedelta(seconds=self.relay.lease + 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(len(self.relay.claim()), 1)
+
+    def test_metrics_report_lag_of_oldest_pending_event(self):
+        publish('test.event', {'n': 1})
+        OutboxEvent.objects.update(created_at=timezone.now() - timedelta(seconds=30))
+        self.assertGreaterEqual(self.relay.metrics()['lag_seconds'], 30)
+
+    @override_settings(OUTBOX={'RELAY': 'inline'})
+    def test_post_consumers_run_after_commit(self):
+        author = User.objects.create_user('author', password='pw')
+        with mock.patch('posts.consumers.get_tracker') as tracker, \
+                mock.patch('posts.consumers.get_backend') as backend, \
+                self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=author, title='t', content='#Django')
+        tracker.return_value.record.assert_called_once_with(['django'])
+        backend.return_value.publish.assert_called_once_with(author.pk, post.pk, {'id': post.pk, 'author': author.pk})
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_metrics_endpoint_is_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('user', password='pw'))
+        self.assertEqual(client.get('/api/outbox/metrics/').status_code, 403)
+        client.force_authenticate(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = client.get('/api/outbox/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('lag_seconds', response.data)
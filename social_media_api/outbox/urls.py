@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .views import OutboxMetricsView
+
+urlpatterns = [
+    path('metrics/', OutboxMetricsView.as_view(), name='outbox-metrics'),
+]
@@ -0,0 +1,13 @@
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .relay import get_relay
+
+
+class OutboxMetricsView(APIView):
+    """``GET /api/outbox/metrics/``: backlog and lag of this process's relay (staff only)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_relay().metrics())
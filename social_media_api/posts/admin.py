@@ -1,3 +1,29 @@
 from django.contrib import admin
+from django.db.models import Prefetch
 
-# Register your models here.
+from social_media_api.admin_tools import LargeTableAdminMixin
+from .models import Post, Comment
+
+
+@admin.register(Post)
+class PostAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'author', 'created_at', 'deleted_at')
+    list_select_related = ('author',)
+    search_fields = ('^title',)
+    autocomplete_fields = ('author',)
+    ordering = ('-id',)
+
+
+@admin.register(Comment)
+class CommentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'post', 'author', 'created_at')
+    list_select_related = ('author',)
+    search_fields = ('^author__username',)
+    autocomplete_fields = ('post', 'author')
+    ordering = ('-id',)
+
+    def get_queryset(self, request):
+        # Joining posts before the ORDER BY makes SQLite sort every matching
+        # row with its post attached; fetch the titles for the page instead.
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('post', queryset=Post.objects.only('id', 'title')))
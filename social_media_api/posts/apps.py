@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posts'
+
+    def ready(self):
+        import posts.consumers
+        import posts.signals
+        from .feeds import check_configuration
+        check_configuration()
@@ -0,0 +1,83 @@
+"""
+Moves old posts and their comments from the hot tables into
+``ArchivedPost``/``ArchivedComment``.
+
+Each batch is copied and deleted in one transaction, so the job can be
+stopped at any point and simply run again. A batch holds the SQLite write
+lock while it runs, so it is bounded by comments as well as posts: it stops
+before the post whose comments would take it past ``max_comments``. A
+post with more comments than that is moved in a batch of its own.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .feeds import forget_authors
+from .models import ArchivedComment, ArchivedPost, Comment, Post, PostRevision
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_COMMENTS = 5000
+
+POST_COLUMNS = ('id', 'author_id', 'title', 'content', 'image_count', 'created_at', 'updated_at')
+COMMENT_COLUMNS = ('id', 'post_id', 'author_id', 'parent_id', 'path', 'depth', 'content', 'created_at', 'updated_at')
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = getattr(settings, 'POST_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE, max_comments=DEFAULT_MAX_COMMENTS):
+    """
+    Archive up to ``batch_size`` of the oldest posts created before
+    ``cutoff``, and only as many as keep their comments within
+    ``max_comments``. Returns the number of posts moved.
+    """
+    with transaction.atomic():
+        posts = list(
+            Post.objects.filter(created_at__lt=cutoff, deleted_at__isnull=True)
+            .order_by('pk').values(*POST_COLUMNS)[:batch_size]
+        )
+        if not posts:
+            return 0
+        counts = dict(
+            Comment.objects.filter(post_id__in=[post['id'] for post in posts]).order_by()
+            .values('post_id').annotate(count=Count('pk')).values_list('post_id', 'count')
+        )
+        total = 0
+        for taken, post in enumerate(posts):
+            total += counts.get(post['id'], 0)
+            if taken and total > max_comments:
+                del posts[taken:]
+                break
+        ids = [post['id'] for post in posts]
+        comments = Comment.objects.filter(post_id__in=ids)
+        ArchivedPost.objects.bulk_create(ArchivedPost(**post) for post in posts)
+        ArchivedComment.objects.bulk_create(
+            (ArchivedComment(**comment) for comment in comments.values(*COMMENT_COLUMNS)),
+            batch_size=batch_size,
+        )
+        comments.delete()
+        # Revision history is not kept for archived posts.
+        PostRevision.objects.filter(post_id__in=ids).delete()
+        Post.objects.filter(pk__in=ids).delete()
+    forget_authors({post['author_id'] for post in posts})
+    return len(posts)
+
+
+def archive_old_posts(days=None, batch_size=DEFAULT_BATCH_SIZE, max_comments=DEFAULT_MAX_COMMENTS, progress=None):
+    """Archive every post older than ``days``; returns the number moved."""
+    cutoff = archive_cutoff(days)
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size, max_comments)
+        if not moved:
+            return total
+        total += moved
+        if progress is not None:
+            progress(total)
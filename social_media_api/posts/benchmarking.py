@@ -0,0 +1,95 @@
+"""Helpers shared by the ``bench_*`` management commands."""
+import importlib
+import inspect
+import math
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from .compression import search_text
+from .models import Post, Comment
+
+LOREM = (
+    'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua. '
+)
+
+
+@contextmanager
+def scratch_data():
+    """Run the block in a transaction that is always rolled back."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def seed(users=20, posts=200, comments=5, content_length=800):
+    """Bulk create a small social graph and return the created users."""
+    User = get_user_model()
+    created = User.objects.bulk_create(
+        User(username=f'bench{i}', password='!') for i in range(users))
+    for user in created:
+        user.following.set(other for other in created if other != user)
+    body = (LOREM * (content_length // len(LOREM) + 1))[:content_length]
+    post_rows = Post.objects.bulk_create(
+        Post(author=created[i % users], title=f'Post {i}', content=body, content_search=search_text(body))
+        for i in range(posts))
+    Comment.objects.bulk_create(
+        Comment(post=post, author=created[(post.pk + j) % users], content=body[:160])
+        for post in post_rows for j in range(comments))
+    return created
+
+
+def corpus(count, rng, median=600):
+    """
+    ``count`` texts of log-normally distributed length (``median`` bytes,
+    a long tail into the tens of kilobytes), cut from the docstrings of the
+    standard library: real prose with code, names and punctuation, unlike
+    ``LOREM``, which compresses far better than anything users write.
+    """
+    texts = []
+    for module in sorted(sys.stdlib_module_names):
+        if module.startswith('_') or module in ('antigravity', 'this', 'idlelib', 'tkinter', 'turtle'):
+            continue
+        try:
+            imported = importlib.import_module(module)
+        except Exception:
+            continue
+        for _, member in inspect.getmembers(imported):
+            doc = getattr(member, '__doc__', None)
+            if isinstance(doc, str) and len(doc) > 200:
+                texts.append(inspect.cleandoc(doc))
+    source = '\n\n'.join(dict.fromkeys(texts))
+    output = []
+    for _ in range(count):
+        length = min(int(rng.lognormvariate(math.log(median), 1.0)), 60_000, len(source))
+        start = rng.randrange(len(source) - length + 1)
+        output.append(source[start:start + length])
+    return output
+
+
+@contextmanager
+def count_queries():
+    """Yield a list that collects the SQL run inside the block."""
+    statements = []
+
+    def record(execute, sql, params, many, context):
+        statements.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        yield statements
+
+
+def timed(func, repeat=20):
+    """Median wall time of ``func()`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
@@ -0,0 +1,95 @@
+"""
+Write-combining for comment creation.
+
+When a post goes viral, many requests insert comments at once. Each one on
+its own is a write transaction, and on SQLite those queue for the single
+write lock, every one paying for its own commit, until some give up with
+"database is locked". ``create_comment()`` instead hands the unsaved
+comment to a ``BulkWriteQueue`` that gathers whatever arrives within
+``MAX_DELAY`` seconds (up to ``MAX_BATCH`` comments) and inserts it with one
+``bulk_create`` in one transaction. Each caller waits for its batch to
+commit and gets its own comment back with its id set.
+
+A caller that is already inside a transaction writes directly: the queue
+uses its own connection, which could not see that transaction's rows and
+would commit independently of it.
+
+A comment still queued after ``TIMEOUT`` seconds is withdrawn and the
+request answered with 503 and ``Retry-After``, so a retry cannot duplicate
+it. One the writer has already taken is waited for however long its batch
+takes, since only the batch decides whether it is stored.
+"""
+import threading
+from concurrent import futures
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from social_media_api.write_queue import BulkWriteQueue
+from .models import Comment
+
+DEFAULTS = {
+    'COMBINE': True,
+    'MAX_BATCH': 200,
+    'MAX_DELAY': 0.003,
+    'TIMEOUT': 10,
+}
+
+
+class CommentWritesBacklogged(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many comments are being written. Try again shortly.'
+    default_code = 'backlogged'
+    # Sent as Retry-After by DRF's exception handler.
+    wait = 1
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'COMMENT_WRITES', {})}
+
+
+def insert_comments(comments, using='default'):
+    return Comment.objects.db_manager(using).bulk_create(comments)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_comment_queue(using='default'):
+    with _queues_lock:
+        if using not in _queues:
+            config = get_config()
+            _queues[using] = BulkWriteQueue(
+                partial(insert_comments, using=using),
+                max_batch=config['MAX_BATCH'], max_delay=config['MAX_DELAY'], using=using)
+        return _queues[using]
+
+
+def reset_comment_queues():
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+    for queue in queues:
+        queue.close()
+
+
+def create_comment(using='default', **fields):
+    """Create and return a comment, combined with concurrent creates where possible."""
+    comment = Comment(**fields)
+    config = get_config()
+    if not config['COMBINE'] or transaction.get_connection(using).in_atomic_block:
+        comment.save(using=using)
+        return comment
+    comment.place_in_thread()
+    future = get_comment_queue(using).submit(comment)
+    try:
+        return future.result(config['TIMEOUT'])
+    except futures.TimeoutError:
+        if future.cancel():
+            raise CommentWritesBacklogged()
+        # The writer has it and always resolves the future once the batch ends.
+        return future.result()
@@ -0,0 +1,195 @@
+"""
+Compressed storage for long text.
+
+``CompressedTextField`` behaves like a ``TextField`` in Python but stores
+bytes: texts of at least ``MIN_SIZE`` UTF-8 bytes are compressed with zstd
+(when the ``zstandard`` package is installed) or zlib, and kept that way
+only when it saves space. The first byte says how a value was stored:
+
+* ``RAW``: UTF-8, for short or incompressible texts;
+* ``ZLIB``/``ZSTD``: compressed on its own;
+* ``ZLIB_DICT``/``ZSTD_DICT``: compressed with a shared dictionary, whose
+  ``CompressionDictionary`` id follows as four bytes.
+
+Posts are short enough that much of what makes them compressible is shared
+vocabulary rather than repetition within one post. ``manage.py
+train_compression_dictionary`` builds a dictionary from stored posts and
+comments; new values are compressed with the newest one (per process,
+picked up on restart or by ``reset_dictionaries()``), and old values keep
+the id of the one they were written with. Dictionaries must never be
+deleted while rows use them.
+
+Compressed columns cannot be searched with SQL, so searchable fields get a
+plain derived column; see ``search_text()``.
+"""
+import re
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+WORD = re.compile(r'\w+')
+
+RAW, ZLIB, ZLIB_DICT, ZSTD, ZSTD_DICT = b'\x00', b'\x01', b'\x02', b'\x03', b'\x04'
+
+DEFAULTS = {
+    'ALGORITHM': None,
+    'MIN_SIZE': 256,
+    'ZLIB_LEVEL': 6,
+    'ZSTD_LEVEL': 3,
+    'USE_DICTIONARY': True,
+}
+
+_dictionaries = {}
+_current = []
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'COMPRESSED_TEXT', {})}
+    if config['ALGORITHM'] is None:
+        config['ALGORITHM'] = 'zstd' if zstandard is not None else 'zlib'
+    if config['ALGORITHM'] == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured("COMPRESSED_TEXT['ALGORITHM'] = 'zstd' needs the zstandard package.")
+    return config
+
+
+def search_words(text):
+    """The distinct case-folded words of ``text``, in order."""
+    return list(dict.fromkeys(WORD.findall(text.casefold())))
+
+
+def search_text(text):
+    """
+    The plain derived column for ``text``: its distinct words, without
+    punctuation. A word is contained in it exactly when it is contained in
+    ``text`` (ignoring case), so ``icontains`` lookups for terms split with
+    ``search_words()`` match the same rows as on the text itself.
+    """
+    return ' '.join(search_words(text))
+
+
+def _dictionary(dictionary_id):
+    if dictionary_id not in _dictionaries:
+        from .models import CompressionDictionary
+        row = CompressionDictionary.objects.get(pk=dictionary_id)
+        _dictionaries[dictionary_id] = (row.algorithm, bytes(row.data))
+    return _dictionaries[dictionary_id]
+
+
+def current_dictionary(algorithm):
+    """``(id, data)`` of the newest dictionary for ``algorithm``, or ``None``."""
+    if not _current:
+        from .models import CompressionDictionary
+        _current.append({
+            row.algorithm: (row.pk, bytes(row.data))
+            for row in CompressionDictionary.objects.order_by('pk')
+        })
+    return _current[0].get(algorithm)
+
+
+def reset_dictionaries():
+    _dictionaries.clear()
+    _current.clear()
+
+
+def _zstd_dict(data):
+    return zstandard.ZstdCompressionDict(data)
+
+
+def compress(text):
+    """The stored form of ``text``."""
+    raw = text.encode()
+    config = get_config()
+    if len(raw) < config['MIN_SIZE']:
+        return RAW + raw
+    algorithm = config['ALGORITHM']
+    dictionary = current_dictionary(algorithm) if config['USE_DICTIONARY'] else None
+    if algorithm == 'zstd':
+        if dictionary is None:
+            packed = ZSTD + zstandard.ZstdCompressor(level=config['ZSTD_LEVEL']).compress(raw)
+        else:
+            compressor = zstandard.ZstdCompressor(level=config['ZSTD_LEVEL'], dict_data=_zstd_dict(dictionary[1]))
+            packed = ZSTD_DICT + dictionary[0].to_bytes(4, 'little') + compressor.compress(raw)
+    elif dictionary is None:
+        packed = ZLIB + zlib.compress(raw, config['ZLIB_LEVEL'])
+    else:
+        compressor = zlib.compressobj(config['ZLIB_LEVEL'], zdict=dictionary[1])
+        packed = ZLIB_DICT + dictionary[0].to_bytes(4, 'little') + compressor.compress(raw) + compressor.flush()
+    return packed if len(packed) < len(raw) + 1 else RAW + raw
+
+
+def decompress(value):
+    """The text stored as ``value``."""
+    value = bytes(value)
+    tag, body = value[:1], value[1:]
+    if tag == RAW:
+        raw = body
+    elif tag == ZLIB:
+        raw = zlib.decompress(body)
+    elif tag == ZLIB_DICT:
+        _, data = _dictionary(int.from_bytes(body[:4], 'little'))
+        decompressor = zlib.decompressobj(zdict=data)
+        raw = decompressor.decompress(body[4:]) + decompressor.flush()
+    elif tag in (ZSTD, ZSTD_DICT):
+        if zstandard is None:
+            raise ImproperlyConfigured('Reading zstd-compressed text needs the zstandard package.')
+        if tag == ZSTD:
+            raw = zstandard.ZstdDecompressor().decompress(body)
+        else:
+            _, data = _dictionary(int.from_bytes(body[:4], 'little'))
+            raw = zstandard.ZstdDecompressor(dict_data=_zstd_dict(data)).decompress(body[4:])
+    else:
+        raise ValueError(f'Unknown compressed text format {tag!r}.')
+    return raw.decode()
+
+
+def train_dictionary(samples, size, algorithm):
+    """
+    Build a dictionary of about ``size`` bytes from ``samples`` (texts).
+    zstd trains its own; for zlib the dictionary is the most valuable
+    words and word pairs, the most valuable last, where zlib finds them
+    at the shortest distance.
+    """
+    if algorithm == 'zstd':
+        return zstandard.train_dictionary(size, [sample.encode() for sample in samples]).as_bytes()
+    counts = Counter()
+    for sample in samples:
+        words = sample.split()
+        counts.update(words)
+        counts.update(' '.join(pair) for pair in zip(words, words[1:]))
+    chosen, total = [], 0
+    for phrase, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        length = len(phrase.encode()) + 1
+        if total + length > size:
+            continue
+        chosen.append(phrase)
+        total += length
+    return ' '.join(reversed(chosen)).encode()
+
+
+class CompressedTextField(models.TextField):
+    """A ``TextField`` stored compressed; see the module docstring."""
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            # Rows written before the column was compressed.
+            return value
+        return decompress(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = self.get_prep_value(value) if not prepared else value
+        if value is None:
+            return None
+        return connection.Database.Binary(compress(value))
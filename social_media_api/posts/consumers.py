@@ -0,0 +1,38 @@
+"""Outbox consumers for post and follow events, registered in ``PostsConfig.ready``."""
+from outbox.relay import consumer, deliver_once
+from . import feeds
+from .models import Post
+from .pubsub import get_backend
+from .trending import extract_hashtags, get_tracker
+
+
+@consumer('post.created')
+def push_to_feed_streams(event):
+    post_id, author_id = event.payload['id'], event.payload['author']
+    deliver_once(event, 'feed', lambda: get_backend().publish(author_id, post_id, {'id': post_id, 'author': author_id}))
+
+
+@consumer('post.created')
+def count_hashtags(event):
+    post = Post.objects.filter(pk=event.payload['id']).values('title', 'content').first()
+    if post is None:
+        return
+    tags = extract_hashtags(post['title'], post['content'])
+    if tags:
+        deliver_once(event, 'hashtags', lambda: get_tracker().record(tags))
+
+
+@consumer('post.created')
+def add_to_feed_lists(event):
+    # Idempotent: a post already in a list is not added again.
+    post = Post.objects.filter(pk=event.payload['id']).values('created_at', 'author__follower_count').first()
+    if post is not None:
+        feeds.record_post(event.payload['id'], event.payload['author'], post['created_at'],
+                          post['author__follower_count'])
+
+
+@consumer('user.followed')
+@consumer('user.unfollowed')
+def update_inbox(event):
+    # Idempotent and order-insensitive: the follow table decides.
+    feeds.sync_inbox(event.payload['follower'], event.payload['followed'])
@@ -0,0 +1,213 @@
+"""
+Read-only serializers that build list responses straight from ``.values()``
+rows.
+
+``ModelSerializer`` instantiates a model per row and dispatches
+``to_representation`` through every field. For list pages we know the
+shape up front, so the accessors for a given field selection are compiled
+once into plain ``row -> value`` callables. The output must match
+``PostSerializer``/``CommentSerializer`` exactly; see ``FastSerializerParityTests``.
+
+Attached images come from one query per page (or streamed batch) that has
+any, through ``posts.images.attached_images``.
+
+Comments by authors hidden from the viewer (see ``accounts.blocking``) are
+left out, as ``CommentListSerializer`` does.
+
+``stream()`` produces the same items already encoded, a few posts and one
+comment at a time, for responses that must not hold a whole page in memory.
+"""
+import datetime
+from collections import defaultdict
+from itertools import islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+
+from accounts.blocking import get_hidden_authors
+from .images import attached_images
+from .models import Comment
+from .serializers import CommentSerializer, PostSerializer, SparseSpec
+
+
+def _datetime_accessor(column):
+    # Mirrors rest_framework.fields.DateTimeField.to_representation with the
+    # default ISO_8601 format.
+    get = itemgetter(column)
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def access(row):
+        value = get(row)
+        if not value:
+            return None
+        if tz is not None:
+            value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+        elif timezone.is_aware(value):
+            value = timezone.make_naive(value, datetime.timezone.utc)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    return access
+
+
+def _expanded_author_accessor(prefix):
+    get = itemgetter(prefix + '_id', prefix + '__username')
+
+    def access(row):
+        author_id, username = get(row)
+        return {'id': author_id, 'username': username}
+
+    return access
+
+
+class _Plan:
+    """Values columns and ``(name, accessor)`` pairs for one field selection."""
+
+    def __init__(self, serializer_class, spec, extra_columns=()):
+        model = serializer_class.Meta.model
+        self.columns = list(extra_columns)
+        self.accessors = []
+        self.nested = None
+        self.images = False
+        for name in serializer_class.Meta.fields:
+            declared = serializer_class._declared_fields.get(name)
+            if not spec.wants(name) or (declared is not None and declared.write_only):
+                continue
+            if name == 'images':
+                self.images = True
+                self.columns.append('image_count')
+                self.accessors.append((name, None))
+                continue
+            if name == 'comments':
+                self.nested = (name, _Plan(CommentSerializer, spec.child(name), extra_columns=['post_id', 'author_id']))
+                self.accessors.append((name, None))
+                continue
+            field = model._meta.get_field(name)
+            if isinstance(field, models.ForeignKey):
+                if name == 'author' and spec.expands('author'):
+                    self.columns += [field.attname, name + '__username']
+                    self.accessors.append((name, _expanded_author_accessor(name)))
+                    continue
+                column = field.attname
+            else:
+                column = name
+            self.columns.append(column)
+            if isinstance(field, models.DateTimeField):
+                self.accessors.append((name, _datetime_accessor(column)))
+            else:
+                self.accessors.append((name, itemgetter(column)))
+        self.columns = list(dict.fromkeys([*self.columns, 'id']))
+
+
+class FastPostSerializer:
+    """
+    Serializes post list pages like ``PostSerializer(many=True)``, honouring
+    the same ``?fields=``/``?expand=`` selection.
+
+    ``rows(queryset)`` turns a filtered, ordered post queryset into a values
+    queryset that can be paginated; ``serialize(rows)`` renders a page.
+    """
+
+    serializer_class = PostSerializer
+    stream_batch_size = 20
+
+    def __init__(self, spec=None, hidden=None):
+        self.plan = _Plan(self.serializer_class, spec or SparseSpec())
+        self.hidden = hidden
+
+    @classmethod
+    def for_request(cls, request):
+        return cls(SparseSpec.from_request(request), get_hidden_authors(request.user))
+
+    def rows(self, queryset):
+        return queryset.prefetch_related(None).values(*self.plan.columns)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        nested = {}
+        if self.plan.nested:
+            nested['comments'] = self._comments(rows)
+        if self.plan.images:
+            nested['images'] = self._images(rows)
+        output = []
+        for row in rows:
+            item = {}
+            for name, access in self.plan.accessors:
+                item[name] = nested[name].get(row['id'], []) if access is None else access(row)
+            output.append(item)
+        return output
+
+    def _images(self, rows):
+        ids = [row['id'] for row in rows if row['image_count']]
+        return attached_images(ids) if ids else {}
+
+    def _comments(self, rows):
+        plan = self.plan.nested[1]
+        grouped = defaultdict(list)
+        comments = list(Comment.objects.visible().filter(
+            post__in=[row['id'] for row in rows]).order_by('pk').values(*plan.columns))
+        hidden = self.hidden.hidden(row['author_id'] for row in comments) if self.hidden else ()
+        for row in comments:
+            if row['author_id'] in hidden:
+                continue
+            grouped[row['post_id']].append({name: access(row) for name, access in plan.accessors})
+        return grouped
+
+    def stream(self, rows, encode):
+        """
+        Yield the JSON array elements of ``serialize(rows)``, comma separated
+        and encoded with ``encode(value) -> bytes``, in pieces.
+
+        Posts are read off the cursor ``stream_batch_size`` at a time and
+        each batch's comments come from one query ordered like the batch, so
+        only one batch of post rows and one comment are held at once.
+        """
+        plan = self.plan
+        keys = [encode(name) + b':' for name, _ in plan.accessors]
+        rows = rows.iterator(chunk_size=self.stream_batch_size)
+        first = True
+        while batch := list(islice(rows, self.stream_batch_size)):
+            comments = self._comment_stream(batch) if plan.nested else None
+            pending = next(comments, None) if comments is not None else None
+            images = self._images(batch) if plan.images else None
+            for row in batch:
+                pieces = [] if first else [b',']
+                first = False
+                for index, (key, (name, access)) in enumerate(zip(keys, plan.accessors)):
+                    pieces += [b'{' if index == 0 else b',', key]
+                    if access is not None:
+                        pieces.append(encode(access(row)))
+                        continue
+                    if name == 'images':
+                        pieces.append(encode(images.get(row['id'], [])))
+                        continue
+                    yield b''.join(pieces)
+                    pieces = []
+                    yield b'['
+                    separator = b''
+                    while pending is not None and pending[0] == row['id']:
+                        yield separator + encode(pending[1])
+                        separator = b','
+                        pending = next(comments, None)
+                    yield b']'
+                pieces.append(b'}' if keys else b'{}')
+                yield b''.join(pieces)
+
+    def _comment_stream(self, batch):
+        plan = self.plan.nested[1]
+        ids = [row['id'] for row in batch]
+        position = Case(*(When(post_id=pk, then=Value(index)) for index, pk in enumerate(ids)),
+                        output_field=IntegerField())
+        queryset = Comment.objects.visible().filter(post__in=ids)
+        hidden = ()
+        if self.hidden:
+            hidden = self.hidden.hidden(queryset.values_list('author_id', flat=True).distinct())
+        for row in queryset.order_by(position, 'pk').values(*plan.columns).iterator(chunk_size=100):
+            if row['author_id'] in hidden:
+                continue
+            yield row['post_id'], {name: access(row) for name, access in plan.accessors}
@@ -0,0 +1,402 @@
+"""
+Pull-model feed assembly.
+
+The SQL feed joins the follow table with posts and sorts every matching
+post on each request. With ``FEED['ENGINE'] = 'merge'`` the feed is merged
+from cached lists instead:
+
+* every author has a list of their ``AUTHOR_LIST_SIZE`` most recent
+  ``(created_at, post_id, author_id)`` entries, newest first, built with one
+  windowed query for all the authors missing from the cache and kept
+  current by the ``post.created`` outbox consumer;
+* a page is a ``heapq.merge`` of the followed authors' lists from the
+  cursor on, so it costs O(page size * log k) after one ``get_many`` for
+  the k lists, and the posts on it are hydrated with one ``id__in`` query.
+
+Fan-out on write is expensive for authors with many followers, but cheap
+and fast to read for everyone else. With ``PUSH_BELOW`` set, authors with
+fewer followers than that push their new posts into each follower's cached
+inbox, a merged list of those authors' posts. Everyone else is always
+pulled, so a feed merges one inbox with the lists of the popular authors it
+follows. An inbox records which authors it covers; authors followed since
+it was built are pulled alongside it until it is rebuilt, and posts by
+authors no longer followed are skipped.
+
+Lists only hold recent posts. Once a page reaches the oldest entry of a
+list that was cut short, older posts are read with the SQL query instead.
+
+The same author lists back ``GET /api/accounts/<id>/posts/`` through
+``author_entries()``, so they are kept current whichever engine is on.
+
+Lists and inboxes are updated by whichever process's relay delivers the
+``post.created`` event, so the other processes only see the update through
+a shared cache. ``check_configuration()`` refuses the merged feed on a
+per-process cache (``LocMemCache``), and author timelines then read the
+index instead. ``TIMEOUT`` bounds how long an update missed some other way
+(an eviction racing it) can last.
+"""
+import heapq
+import threading
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import chain
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from accounts.graph import following_ids
+from social_media_api.caching import is_process_local
+from .models import Post
+
+DEFAULTS = {
+    'ENGINE': 'sql',
+    'CACHE': 'default',
+    'AUTHOR_LIST_SIZE': 200,
+    'INBOX_SIZE': 800,
+    'PUSH_BELOW': None,
+    'TIMEOUT': 600,
+}
+
+# Rows read at a time once a page goes past the cached lists.
+FALLBACK_CHUNK = 100
+# Authors per query when loading many users' feeds at once.
+LOAD_CHUNK = 500
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# What a cursor may hold: a time datetime can represent and a 64-bit id.
+MIN_MICROS = (datetime.min.replace(tzinfo=dt_timezone.utc) - EPOCH) // timedelta(microseconds=1)
+MAX_MICROS = (datetime.max.replace(tzinfo=dt_timezone.utc) - EPOCH) // timedelta(microseconds=1)
+MAX_POST_ID = 2 ** 63 - 1
+
+_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'FEED', {})}
+
+
+def is_cached():
+    return not is_process_local(get_config()['CACHE'])
+
+
+def check_configuration():
+    config = get_config()
+    if config['ENGINE'] == 'merge' and not is_cached():
+        raise ImproperlyConfigured(
+            f"FEED['ENGINE'] = 'merge' needs a cache shared by every process, and the {config['CACHE']!r} "
+            "cache is local to each one: new posts would only reach the lists of the process that "
+            "relayed them. Configure a shared cache in FEED['CACHE'] or use the 'sql' engine.")
+
+
+def to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def encode_cursor(key):
+    return f'{key[0]}.{key[1]}'
+
+
+def decode_cursor(value):
+    """``(micros, post_id)`` from ``encode_cursor()``; ``ValueError`` if malformed."""
+    micros, post_id = value.split('.')
+    micros, post_id = int(micros), int(post_id)
+    if not MIN_MICROS <= micros <= MAX_MICROS or not 0 <= post_id <= MAX_POST_ID:
+        raise ValueError(f'Cursor out of range: {value}')
+    return micros, post_id
+
+
+def author_key(author_id):
+    return f'feed:author:{author_id}'
+
+
+def inbox_key(user_id):
+    return f'feed:inbox:{user_id}'
+
+
+def _entry(row):
+    created_at, post_id, author_id = row
+    return to_micros(created_at), post_id, author_id
+
+
+class Source:
+    """
+    ``(micros, post_id, author_id)`` entries sorted newest first, flattened
+    into an ``array`` so a cached list unpickles with one copy and only the
+    entries a page reads become tuples. ``horizon`` is the key of the oldest
+    entry when older ones were left out, ``None`` when nothing was.
+    """
+
+    def __init__(self, flat, horizon=None):
+        self.flat = flat
+        self.horizon = horizon
+
+    def __len__(self):
+        return len(self.flat) // 3
+
+    def __getitem__(self, index):
+        flat, start = self.flat, 3 * index
+        return flat[start], flat[start + 1], flat[start + 2]
+
+    def entries(self):
+        return [self[index] for index in range(len(self))]
+
+    def after(self, cursor):
+        """Yield the entries strictly older than ``cursor``."""
+        low, high = 0, len(self)
+        if cursor is not None:
+            while low < high:
+                middle = (low + high) // 2
+                if self[middle][:2] < cursor:
+                    high = middle
+                else:
+                    low = middle + 1
+        for index in range(low, len(self)):
+            yield self[index]
+
+
+def _state(entries, size, horizon=None):
+    # Cut a newest-first list to ``size``, moving the horizon up if needed.
+    if len(entries) > size:
+        entries = entries[:size]
+        horizon = max(horizon, entries[-1][:2]) if horizon else entries[-1][:2]
+    return {'entries': array('q', chain.from_iterable(entries)), 'horizon': horizon}
+
+
+def _insert(entries, entry):
+    # Newest first; True when ``entry`` was not there yet.
+    if any(existing[1] == entry[1] for existing in entries):
+        return False
+    index = next((i for i, existing in enumerate(entries) if existing < entry), len(entries))
+    entries.insert(index, entry)
+    return True
+
+
+def author_lists(author_ids):
+    """``{author_id: Source}`` for ``author_ids``, building the missing lists in one query."""
+    config = get_config()
+    cache = caches[config['CACHE']]
+    size = config['AUTHOR_LIST_SIZE']
+    cached = cache.get_many([author_key(author_id) for author_id in author_ids])
+    lists = {}
+    missing = []
+    for author_id in author_ids:
+        state = cached.get(author_key(author_id))
+        if state is None:
+            missing.append(author_id)
+        else:
+            lists[author_id] = state
+    if missing:
+        # One more row than the list holds tells whether it was cut short.
+        rows = (Post.objects.visible().filter(author_id__in=missing)
+                .annotate(rank=Window(RowNumber(), partition_by=F('author_id'),
+                                      order_by=[F('created_at').desc(), F('id').desc()]))
+                .filter(rank__lte=size + 1).order_by('author_id', '-created_at', '-id')
+                .values_list('created_at', 'id', 'author_id'))
+        built = {author_id: [] for author_id in missing}
+        for row in rows:
+            built[row[2]].append(_entry(row))
+        fresh = {author_id: _state(entries, size) for author_id, entries in built.items()}
+        cache.set_many({author_key(author_id): state for author_id, state in fresh.items()}, config['TIMEOUT'])
+        lists.update(fresh)
+    return {author_id: Source(state['entries'], state['horizon']) for author_id, state in lists.items()}
+
+
+def _inbox(user_id, author_ids):
+    """The user's inbox ``(covered authors, Source)``, built from ``author_ids`` if missing."""
+    config = get_config()
+    cache = caches[config['CACHE']]
+    state = cache.get(inbox_key(user_id))
+    if state is None:
+        sources = author_lists(author_ids).values()
+        horizons = [source.horizon for source in sources if source.horizon is not None]
+        entries = list(heapq.merge(*(source.after(None) for source in sources), reverse=True))
+        state = {'authors': set(author_ids),
+                 **_state(entries, config['INBOX_SIZE'], max(horizons) if horizons else None)}
+        cache.set(inbox_key(user_id), state, config['TIMEOUT'])
+    return state['authors'], Source(state['entries'], state['horizon'])
+
+
+def load_feeds(following):
+    """
+    Load what the feeds of several users read, given ``{user_id: followed
+    ids}``: the followed authors' lists and, with ``PUSH_BELOW`` set, each
+    user's inbox. Returns the cache keys of both.
+    """
+    config = get_config()
+    authors = sorted(set().union(*following.values()))
+    for start in range(0, len(authors), LOAD_CHUNK):
+        author_lists(authors[start:start + LOAD_CHUNK])
+    keys = [author_key(author_id) for author_id in authors]
+    if config['PUSH_BELOW'] is not None:
+        counts = {}
+        for start in range(0, len(authors), LOAD_CHUNK):
+            counts.update(get_user_model().objects.filter(pk__in=authors[start:start + LOAD_CHUNK])
+                          .values_list('pk', 'follower_count'))
+        for user_id, author_ids in following.items():
+            _inbox(user_id, [author_id for author_id in author_ids
+                             if counts.get(author_id, 0) < config['PUSH_BELOW']])
+            keys.append(inbox_key(user_id))
+    return keys
+
+
+def record_post(post_id, author_id, created_at, follower_count):
+    """Add a new post to its author's cached list and, for pushed authors, to cached inboxes."""
+    config = get_config()
+    cache = caches[config['CACHE']]
+    entry = (to_micros(created_at), post_id, author_id)
+    with _lock:
+        state = cache.get(author_key(author_id))
+        if state is not None:
+            entries = Source(state['entries']).entries()
+            if _insert(entries, entry):
+                cache.set(author_key(author_id), _state(
+                    entries, config['AUTHOR_LIST_SIZE'], state['horizon']), config['TIMEOUT'])
+    if config['PUSH_BELOW'] is None or follower_count >= config['PUSH_BELOW']:
+        return
+    Follow = get_user_model().following.through
+    followers = Follow.objects.filter(to_user_id=author_id).values_list('from_user_id', flat=True)
+    with _lock:
+        inboxes = cache.get_many([inbox_key(user_id) for user_id in followers])
+        updated = {}
+        for key, state in inboxes.items():
+            # An inbox built without this author pulls their list instead.
+            if author_id not in state['authors']:
+                continue
+            entries = Source(state['entries']).entries()
+            if _insert(entries, entry):
+                updated[key] = {**state, **_state(entries, config['INBOX_SIZE'], state['horizon'])}
+        if updated:
+            cache.set_many(updated, config['TIMEOUT'])
+
+
+def sync_inbox(user_id, author_id):
+    """
+    Bring ``user_id``'s cached inbox in line with whether they follow
+    ``author_id``: merge a newly followed pushed author's list into it, or
+    drop an author no longer followed. Until then the feed pulls the new
+    author's list and skips the old one's posts.
+    """
+    config = get_config()
+    if config['PUSH_BELOW'] is None:
+        return
+    cache = caches[config['CACHE']]
+    author = (get_user_model().objects.filter(pk=author_id, followers=user_id)
+              .values_list('follower_count', flat=True).first())
+    pushed = author is not None and author < config['PUSH_BELOW']
+    source = author_lists([author_id])[author_id] if pushed else None
+    with _lock:
+        state = cache.get(inbox_key(user_id))
+        if state is None or pushed == (author_id in state['authors']):
+            return
+        entries = Source(state['entries']).entries()
+        if pushed:
+            horizons = [horizon for horizon in (state['horizon'], source.horizon) if horizon is not None]
+            entries = list(heapq.merge(entries, source.entries(), reverse=True))
+            state = {'authors': state['authors'] | {author_id},
+                     **_state(entries, config['INBOX_SIZE'], max(horizons) if horizons else None)}
+        else:
+            state = {'authors': state['authors'] - {author_id},
+                     **_state([entry for entry in entries if entry[2] != author_id], config['INBOX_SIZE'],
+                              state['horizon'])}
+        cache.set(inbox_key(user_id), state, config['TIMEOUT'])
+
+
+def forget_post(post_id, author_id):
+    """Drop a deleted post from its author's list. Inboxes skip it when hydrating."""
+    config = get_config()
+    cache = caches[config['CACHE']]
+    with _lock:
+        state = cache.get(author_key(author_id))
+        if state is None:
+            return
+        entries = Source(state['entries']).entries()
+        kept = [entry for entry in entries if entry[1] != post_id]
+        if len(kept) != len(entries):
+            cache.set(author_key(author_id), {
+                'entries': array('q', chain.from_iterable(kept)), 'horizon': state['horizon']}, config['TIMEOUT'])
+
+
+def forget_authors(author_ids):
+    """Drop the cached lists of ``author_ids``, e.g. after their posts were archived."""
+    config = get_config()
+    caches[config['CACHE']].delete_many([author_key(author_id) for author_id in author_ids])
+
+
+def _older_posts(author_ids, before):
+    # The SQL feed from ``before`` on, read lazily in chunks; a single
+    # author's posts come off the (author, created_at, id) index.
+    queryset = Post.objects.visible().filter(author_id__in=author_ids).order_by('-created_at', '-id')
+    while True:
+        chunk = queryset
+        if before is not None:
+            created_at = from_micros(before[0])
+            chunk = chunk.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=before[1]))
+        rows = [_entry(row) for row in chunk.values_list('created_at', 'id', 'author_id')[:FALLBACK_CHUNK]]
+        yield from rows
+        if len(rows) < FALLBACK_CHUNK:
+            return
+        before = rows[-1][:2]
+
+
+def merged_entries(sources, author_ids, cursor=None):
+    """
+    Yield the entries of ``sources`` by ``author_ids``, newest first and
+    from after ``cursor``, continuing with the SQL query past the oldest
+    entry of any source that was cut short.
+    """
+    horizons = [source.horizon for source in sources if source.horizon is not None]
+    horizon = max(horizons) if horizons else None
+    last = cursor
+    previous = None
+    for entry in heapq.merge(*(source.after(cursor) for source in sources), reverse=True):
+        if horizon is not None and entry[:2] < horizon:
+            break
+        # A post can be both in an inbox and pulled while its author
+        # changes sides; duplicates are adjacent.
+        if entry[1] == previous or entry[2] not in author_ids:
+            continue
+        previous = entry[1]
+        last = entry[:2]
+        yield entry
+    if horizon is not None:
+        yield from _older_posts(list(author_ids), last)
+
+
+def author_entries(author_id, cursor=None):
+    """Yield ``(micros, post_id, author_id)`` for one author's posts, newest first."""
+    if not is_cached():
+        return _older_posts([author_id], cursor)
+    return merged_entries([author_lists([author_id])[author_id]], {author_id}, cursor)
+
+
+def feed_entries(user, cursor=None, hidden=None):
+    """
+    Yield ``(micros, post_id, author_id)`` for ``user``'s feed, newest
+    first, from after ``cursor``.
+    """
+    config = get_config()
+    push_below = config['PUSH_BELOW']
+    if push_below is None:
+        # Pulling needs the followed ids only, and those are cached.
+        following = dict.fromkeys(following_ids(user.pk))
+    else:
+        following = dict(user.following.values_list('pk', 'follower_count'))
+    if hidden:
+        for author_id in hidden.hidden(following):
+            del following[author_id]
+    if push_below is None:
+        sources = list(author_lists(list(following)).values())
+    else:
+        pushed = [author_id for author_id, count in following.items() if count < push_below]
+        covered, inbox = _inbox(user.pk, pushed)
+        pulled = [author_id for author_id, count in following.items()
+                  if count >= push_below or author_id not in covered]
+        sources = [inbox, *author_lists(pulled).values()]
+    return merged_entries(sources, following, cursor)
@@ -0,0 +1,303 @@
+"""
+Image attachments for posts.
+
+``POST /api/images/`` only does what has to happen on the request: it
+hashes the upload, reads the image header (format, size, EXIF orientation)
+and stores the original. Everything slow (decoding, resizing, re-encoding
+and the blurhash placeholder) runs afterwards in a pool of ``WORKERS``
+threads; Pillow releases the GIL while it decodes, resamples and encodes,
+so the threads do run in parallel. Clients poll ``GET /api/images/<id>/``
+or just attach the id to a post right away, which shows the image once
+its ``status`` is ``ready``.
+
+Images are stored once per distinct content: an upload whose SHA-256
+matches an existing image returns that image (and its variants, which are
+not rendered again) and adds the user to its ``uploaders``, the users who
+may attach it.
+
+Each image is re-encoded as WebP at every width in ``WIDTHS`` below its
+own, plus its own width when that is smaller than the largest, with the
+metadata (GPS position included) stripped. Serialized images carry a
+``srcset`` of those variants so clients download the smallest one that
+fills the space they have, a ``src`` for clients without ``srcset``, and a
+blurhash to draw until the image arrives.
+
+Images a process never got to (it was restarted with work queued) stay
+``pending``; ``manage.py process_images`` renders them.
+"""
+import hashlib
+import logging
+import math
+import posixpath
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from PIL import ExifTags, ImageOps, UnidentifiedImageError
+from PIL import Image as PILImage
+from rest_framework.exceptions import ValidationError
+
+from .models import Attachment, Image, Post
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WORKERS': 2,
+    'WIDTHS': (320, 640, 1080, 1920),
+    'DEFAULT_WIDTH': 640,
+    'QUALITY': 80,
+    'MAX_SIZE': 20 * 1024 * 1024,
+    'MAX_PIXELS': 50_000_000,
+    'PER_POST': 4,
+}
+
+# Accepted formats and the extension their originals are stored with.
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+# EXIF orientations that turn the image by 90 degrees.
+TRANSPOSED = {5, 6, 7, 8}
+
+_pool = []
+_pool_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'IMAGES', {})}
+
+
+def _inspect(file, config):
+    # Reads the header only; returns the format and the size as displayed.
+    try:
+        with PILImage.open(file) as picture:
+            format_, (width, height) = picture.format, picture.size
+            orientation = picture.getexif().get(ExifTags.Base.Orientation, 1)
+    except (UnidentifiedImageError, OSError, PILImage.DecompressionBombError):
+        raise ValidationError({'image': 'The upload is not an image.'})
+    if format_ not in FORMATS:
+        raise ValidationError({'image': f'{format_} images are not supported.'})
+    if width * height > config['MAX_PIXELS']:
+        raise ValidationError({'image': f'Images are limited to {config["MAX_PIXELS"]} pixels.'})
+    if orientation in TRANSPOSED:
+        width, height = height, width
+    return format_, width, height
+
+
+def accept_upload(user, upload):
+    """
+    Store ``upload`` (an ``UploadedFile``) unless an image with the same
+    content exists, queue it for processing once the transaction commits,
+    and let ``user`` attach it. Returns ``(image, created)``.
+    """
+    config = get_config()
+    if upload.size > config['MAX_SIZE']:
+        raise ValidationError({'image': f'Images are limited to {config["MAX_SIZE"]} bytes.'})
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    sha256 = digest.hexdigest()
+    image = Image.objects.filter(sha256=sha256).first()
+    created = False
+    if image is None:
+        upload.seek(0)
+        format_, width, height = _inspect(upload, config)
+        upload.seek(0)
+        image = Image(sha256=sha256, width=width, height=height)
+        image.original.save(f'original.{FORMATS[format_]}', upload, save=False)
+        try:
+            with transaction.atomic():
+                image.save()
+        except IntegrityError:
+            # The same file was uploaded concurrently; keep the other copy.
+            image.original.delete(save=False)
+            image = Image.objects.get(sha256=sha256)
+        else:
+            created = True
+            transaction.on_commit(lambda: submit(image.pk))
+    image.uploaders.add(user)
+    return image, created
+
+
+def variant_widths(width, widths):
+    """The widths to render an image ``width`` pixels wide at, smallest first."""
+    return sorted({min(width, target) for target in widths})
+
+
+def variant_name(image, width):
+    return posixpath.join(posixpath.dirname(image.original.name), f'{width}.webp')
+
+
+def _render(image, config):
+    # Returns the variant sizes and the blurhash.
+    with default_storage.open(image.original.name, 'rb') as file, PILImage.open(file) as source:
+        transposed = source.getexif().get(ExifTags.Base.Orientation, 1) in TRANSPOSED
+        width, height = (source.height, source.width) if transposed else source.size
+        widths = variant_widths(width, config['WIDTHS'])
+        largest = (widths[-1], max(1, round(height * widths[-1] / width)))
+        # JPEGs decode straight at 1/2, 1/4 or 1/8 of their size when that
+        # is still at least as large as the largest variant.
+        source.draft('RGB', largest[::-1] if transposed else largest)
+        picture = ImageOps.exif_transpose(source)
+        has_alpha = 'A' in picture.getbands() or 'transparency' in picture.info
+        picture = picture.convert('RGBA' if has_alpha else 'RGB')
+    sizes = []
+    # Largest first, each variant resampled from the one before it.
+    for target in reversed(widths):
+        size = (target, max(1, round(height * target / width)))
+        picture = picture.resize(size, PILImage.LANCZOS, reducing_gap=3.0)
+        buffer = BytesIO()
+        picture.save(buffer, 'WEBP', quality=config['QUALITY'])
+        name = variant_name(image, target)
+        default_storage.delete(name)
+        default_storage.save(name, ContentFile(buffer.getvalue()))
+        sizes.append(list(size))
+    return sizes[::-1], blurhash(picture)
+
+
+def process_image(image_id):
+    """Render the variants and blurhash of a pending image."""
+    image = Image.objects.filter(pk=image_id, status=Image.PENDING).first()
+    if image is None:
+        return
+    try:
+        variants, placeholder = _render(image, get_config())
+    except Exception:
+        logger.exception('Processing image %s failed.', image_id)
+        Image.objects.filter(pk=image_id).update(status=Image.FAILED, processed_at=timezone.now())
+        return
+    Image.objects.filter(pk=image_id).update(
+        status=Image.READY, variants=variants, blurhash=placeholder, processed_at=timezone.now())
+
+
+def get_pool():
+    if not _pool:
+        with _pool_lock:
+            if not _pool:
+                _pool.append(ThreadPoolExecutor(get_config()['WORKERS'], thread_name_prefix='images'))
+    return _pool[0]
+
+
+def reset_pool():
+    with _pool_lock:
+        if _pool:
+            _pool.pop().shutdown(wait=True)
+
+
+def _process_in_worker(image_id):
+    try:
+        process_image(image_id)
+    finally:
+        connection.close()
+
+
+def submit(image_id):
+    """Process an image in the worker pool, or right away when ``WORKERS`` is 0 (as in tests)."""
+    if not get_config()['WORKERS']:
+        process_image(image_id)
+        return None
+    return get_pool().submit(_process_in_worker, image_id)
+
+
+def attach_images(post, image_ids):
+    """Make ``image_ids`` the images of ``post``, in that order."""
+    Attachment.objects.filter(post_id=post.pk).delete()
+    Attachment.objects.bulk_create(
+        Attachment(post_id=post.pk, image_id=image_id, position=position)
+        for position, image_id in enumerate(image_ids))
+    Post.objects.filter(pk=post.pk).update(image_count=len(image_ids))
+    post.image_count = len(image_ids)
+
+
+def image_data(image):
+    """How an attached image is serialized."""
+    src, srcset = None, ''
+    if image.status == Image.READY:
+        urls = [(default_storage.url(variant_name(image, width)), width) for width, _ in image.variants]
+        srcset = ', '.join(f'{url} {width}w' for url, width in urls)
+        # The largest variant up to DEFAULT_WIDTH, or the smallest.
+        default_width = get_config()['DEFAULT_WIDTH']
+        src = next((url for url, width in reversed(urls) if width <= default_width), urls[0][0])
+    return {
+        'id': image.pk,
+        'status': image.status,
+        'width': image.width,
+        'height': image.height,
+        'blurhash': image.blurhash,
+        'src': src,
+        'srcset': srcset,
+    }
+
+
+def attached_images(post_ids):
+    """``{post_id: [image_data(), ...]}`` for the posts that have images, in one query."""
+    grouped = defaultdict(list)
+    attachments = (Attachment.objects.filter(post_id__in=post_ids)
+                   .select_related('image').order_by('post_id', 'position'))
+    for attachment in attachments:
+        grouped[attachment.post_id].append(image_data(attachment.image))
+    return grouped
+
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _base83(value, length):
+    return ''.join(_BASE83[value // 83 ** (length - 1 - i) % 83] for i in range(length))
+
+
+def _to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(picture, x_components=4, y_components=3):
+    """
+    The blurhash (https://blurha.sh) of a Pillow image: a few DCT
+    components of its colours, base83 encoded in 20-30 characters. It is
+    computed from a 32 pixel thumbnail, which looks the same when blurred.
+    """
+    small = picture.convert('RGB')
+    small.thumbnail((32, 32))
+    width, height = small.size
+    linear = [tuple(_to_linear(channel) for channel in pixel) for pixel in small.getdata()]
+    factors = []
+    for j in range(y_components):
+        rows = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            columns = [math.cos(math.pi * i * x / width) for x in range(width)]
+            red = green = blue = 0.0
+            for y in range(height):
+                for x in range(width):
+                    basis = rows[y] * columns[x]
+                    r, g, b = linear[y * width + x]
+                    red += basis * r
+                    green += basis * g
+                    blue += basis * b
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            factors.append((red * scale, green * scale, blue * scale))
+    dc, ac = factors[0], factors[1:]
+    result = _base83(x_components - 1 + (y_components - 1) * 9, 1)
+    maximum = 1.0
+    if ac:
+        quantised = max(0, min(82, math.floor(max(abs(value) for factor in ac for value in factor) * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+        result += _base83(quantised, 1)
+    else:
+        result += _base83(0, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (max(0, min(18, math.floor(math.copysign(abs(value / maximum) ** 0.5, value) * 9 + 9.5)))
+                   for value in factor)
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
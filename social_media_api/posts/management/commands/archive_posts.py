@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts.archive import DEFAULT_BATCH_SIZE, DEFAULT_MAX_COMMENTS, archive_old_posts
+
+
+class Command(BaseCommand):
+    help = 'Move posts older than POST_ARCHIVE_AFTER_DAYS (and their comments) into the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive posts older than this many days (default: POST_ARCHIVE_AFTER_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--max-comments', type=int, default=DEFAULT_MAX_COMMENTS,
+                            help='Stop a batch before it moves more comments than this.')
+
+    def handle(self, *args, **options):
+        total = archive_old_posts(
+            days=options['days'],
+            batch_size=options['batch_size'],
+            max_comments=options['max_comments'],
+            progress=lambda moved: self.stdout.write(f'  {moved} posts archived'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} posts.'))
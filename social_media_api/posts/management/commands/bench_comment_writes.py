@@ -0,0 +1,83 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from posts.comment_writes import create_comment, reset_comment_queues
+from posts.models import Comment, Post
+
+BODY = 'Great post! ' * 10
+
+
+class Command(BaseCommand):
+    help = 'Concurrent comments on one post, each in its own transaction and combined into bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=500)
+        parser.add_argument('--clients', type=int, default=50)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{options["comments"]} comments on one post from {options["clients"]} threads')
+        self.stdout.write(f'{"scenario":<12}{"seconds":>9}{"comments/s":>12}{"errors":>8}'
+                          f'{"p50 ms":>9}{"p99 ms":>9}')
+        with tempfile.TemporaryDirectory() as directory:
+            for index, (label, combine) in enumerate([('one by one', False), ('combined', True)]):
+                alias = f'bench_comments_{index}'
+                connections.settings[alias] = {
+                    **connections.settings['default'], 'NAME': os.path.join(directory, f'{alias}.sqlite3')}
+                call_command('migrate', database=alias, verbosity=0)
+                author = get_user_model().objects.db_manager(alias).create(username='author')
+                post = Post.objects.db_manager(alias).create(author=author, title='Viral', content='x')
+                connections[alias].close()
+                elapsed, latencies, errors = self._run(alias, author, post, combine, options)
+                reset_comment_queues()
+                stored = Comment.objects.using(alias).filter(post=post).count()
+                connections[alias].close()
+                assert stored == len(latencies), (stored, len(latencies))
+                latencies.sort()
+                self.stdout.write(
+                    f'{label:<12}{elapsed:>9.2f}{len(latencies) / elapsed:>12.0f}{errors:>8}'
+                    f'{statistics.median(latencies):>9.1f}{latencies[int(len(latencies) * 0.99)]:>9.1f}')
+
+    def _run(self, alias, author, post, combine, options):
+        clients = options['clients']
+        per_client = options['comments'] // clients
+        latencies, errors = [], []
+        lock = threading.Lock()
+        start = threading.Barrier(clients + 1)
+
+        def client():
+            local, failed = [], 0
+            try:
+                start.wait()
+                for _ in range(per_client):
+                    began = time.perf_counter()
+                    try:
+                        if combine:
+                            create_comment(using=alias, post=post, author=author, content=BODY)
+                        else:
+                            Comment(post=post, author=author, content=BODY).save(using=alias)
+                    except OperationalError:
+                        failed += 1
+                        continue
+                    local.append((time.perf_counter() - began) * 1000)
+            finally:
+                connections[alias].close()
+                with lock:
+                    latencies.extend(local)
+                    errors.append(failed)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - began, latencies, sum(errors)
@@ -0,0 +1,69 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from posts.benchmarking import corpus, scratch_data, timed
+from posts.compression import reset_dictionaries, search_text, train_dictionary, zstandard
+from posts.models import CompressionDictionary, Post
+
+
+class Command(BaseCommand):
+    help = 'Storage size and read/write latency of post content, plain and compressed (in a rolled back transaction).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--page-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        texts = corpus(options['posts'], rng)
+        training = corpus(2000, random.Random(2))
+        raw = sum(len(text.encode()) for text in texts)
+        self.stdout.write(f'{len(texts)} posts from stdlib docstrings, {raw / 1e6:.1f}MB, '
+                          f'median {sorted(len(text) for text in texts)[len(texts) // 2]} bytes')
+        modes = [
+            ('plain', 'zlib', False, 10 ** 9),
+            ('zlib', 'zlib', False, 256),
+            ('zlib + dictionary', 'zlib', True, 256),
+        ]
+        if zstandard is not None:
+            modes += [('zstd', 'zstd', False, 256), ('zstd + dictionary', 'zstd', True, 256)]
+        self.stdout.write(f'{"storage":<20}{"content MB":>11}{"ratio":>7}{"search MB":>10}'
+                          f'{"total":>7}{"write us":>10}{"read ms":>9}')
+        for label, algorithm, use_dictionary, min_size in modes:
+            settings = {'ALGORITHM': algorithm, 'USE_DICTIONARY': use_dictionary, 'MIN_SIZE': min_size}
+            with scratch_data(), override_settings(COMPRESSED_TEXT=settings):
+                reset_dictionaries()
+                if use_dictionary:
+                    CompressionDictionary.objects.create(
+                        algorithm=algorithm, samples=len(training),
+                        data=train_dictionary(training, 32 * 1024 if algorithm == 'zlib' else 110 * 1024, algorithm))
+                self.run_mode(label, texts, raw, options['page_size'])
+            reset_dictionaries()
+
+    def run_mode(self, label, texts, raw, page_size):
+        author = get_user_model().objects.create(username='compression-bench', password='!')
+        posts = [Post(author=author, title='t', content=text, content_search=search_text(text)) for text in texts]
+
+        def save_each():
+            # One save() per post, as the API writes them.
+            for post in posts[:200]:
+                post.save()
+
+        write = timed(save_each, repeat=1)
+        Post.objects.bulk_create(posts[200:])
+        ids = [post.pk for post in posts]
+        pages = [ids[start:start + page_size] for start in range(0, len(ids), page_size)]
+        page_iter = iter(pages * 10)
+        read = timed(lambda: list(Post.objects.filter(pk__in=next(page_iter)).values_list('content', flat=True)),
+                     repeat=min(200, len(pages)))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT SUM(LENGTH(content)), SUM(LENGTH(content_search)) FROM posts_post WHERE author_id = %s',
+                [author.pk])
+            content, search = cursor.fetchone()
+        self.stdout.write(f'{label:<20}{content / 1e6:>11.2f}{content / raw:>7.2f}{search / 1e6:>10.2f}'
+                          f'{(content + search) / raw:>7.2f}{write * 1000 / 200:>10.0f}{read:>9.2f}')
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from posts.benchmarking import scratch_data, seed, timed
+from posts.fast_serializers import FastPostSerializer
+from posts.models import Post
+from posts.serializers import PostSerializer, SparseSpec
+from posts.views import sparse_posts
+
+
+class Command(BaseCommand):
+    help = 'Time PostSerializer against FastPostSerializer for one page of posts with comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--comments', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        with scratch_data():
+            seed(posts=page_size, comments=options['comments'])
+            queryset = Post.objects.order_by('-created_at')
+            spec = SparseSpec()
+            fast = FastPostSerializer(spec)
+
+            def model_serializer():
+                return PostSerializer(sparse_posts(queryset, spec)[:page_size], many=True).data
+
+            def fast_serializer():
+                return fast.serialize(fast.rows(queryset)[:page_size])
+
+            assert model_serializer() == fast_serializer()
+            slow_ms = timed(model_serializer, options['repeat'])
+            fast_ms = timed(fast_serializer, options['repeat'])
+        self.stdout.write(f'{page_size} posts x {options["comments"]} comments per page (fetch + serialize)')
+        self.stdout.write(f'PostSerializer      {slow_ms:8.2f} ms')
+        self.stdout.write(f'FastPostSerializer  {fast_ms:8.2f} ms')
+        self.stdout.write(f'speedup             {slow_ms / fast_ms:8.1f}x')
@@ -0,0 +1,68 @@
+import random
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from posts import feeds
+from posts.benchmarking import count_queries, scratch_data, timed
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Time the first feed pages with the SQL feed and the merged feed (in a rolled back transaction).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=2000)
+        parser.add_argument('--posts', type=int, default=200_000)
+        parser.add_argument('--following', type=int, default=500)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--pages', type=int, default=3)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        rng = random.Random(1)
+        with scratch_data():
+            authors = User.objects.bulk_create(
+                User(username=f'feed{i}', password='!', follower_count=int(rng.paretovariate(1.0) * 10))
+                for i in range(options['authors']))
+            reader = User.objects.create(username='feed-reader', password='!')
+            reader.following.set(rng.sample(authors, options['following']))
+            rows = []
+            for i in range(options['posts']):
+                rows.append(Post(author=rng.choice(authors), title=f'Post {i}', content='x'))
+                if len(rows) == 10_000:
+                    Post.objects.bulk_create(rows)
+                    rows = []
+            Post.objects.bulk_create(rows)
+            self.stdout.write(f'{options["posts"]} posts by {options["authors"]} authors; '
+                              f'the reader follows {options["following"]}')
+            size, pages = options['page_size'], options['pages']
+
+            def sql_feed():
+                queryset = Post.objects.visible().filter(author__in=reader.following.all()).order_by('-created_at', '-id')
+                return [list(queryset.values_list('id', flat=True)[page * size:(page + 1) * size])
+                        for page in range(pages)]
+
+            def merged_feed():
+                entries = feeds.feed_entries(reader)
+                return [[entry[1] for entry in islice(entries, size)] for _ in range(pages)]
+
+            self.stdout.write(f'{"engine":<22}{"cold ms":>9}{"warm ms":>9}{"queries":>9}')
+            self.report('sql', sql_feed)
+            expected = sql_feed()
+            for label, push_below in [('merge (pull)', None), ('merge (hybrid, <50)', 50)]:
+                with override_settings(FEED={'ENGINE': 'merge', 'PUSH_BELOW': push_below}):
+                    caches[feeds.get_config()['CACHE']].clear()
+                    assert merged_feed() == expected, label
+                    caches[feeds.get_config()['CACHE']].clear()
+                    self.report(label, merged_feed)
+
+    def report(self, label, func):
+        cold = timed(func, repeat=1)
+        with count_queries() as statements:
+            func()
+        warm = timed(func)
+        self.stdout.write(f'{label:<22}{cold:>9.1f}{warm:>9.1f}{len(statements):>9}')
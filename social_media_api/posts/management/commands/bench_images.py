@@ -0,0 +1,67 @@
+import io
+import random
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image as PILImage
+from PIL import ImageFilter
+
+from posts import images
+from posts.benchmarking import scratch_data
+from posts.models import Image
+
+
+def photo(rng, size):
+    # Smooth gradients with blurred noise on top: a JPEG about as large as
+    # a phone photo of the same size.
+    base = PILImage.linear_gradient('L').resize(size).rotate(rng.randrange(360))
+    channels = [PILImage.blend(base, PILImage.effect_noise(size, 60).filter(ImageFilter.GaussianBlur(1)), 0.5)
+                for _ in range(3)]
+    buffer = io.BytesIO()
+    PILImage.merge('RGB', channels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Upload latency, rendering throughput per pool size, and bytes served for post images (rolled back).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=12)
+        parser.add_argument('--width', type=int, default=4000)
+        parser.add_argument('--height', type=int, default=3000)
+        parser.add_argument('--workers', default='1,2,4')
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        files = [photo(rng, (options['width'], options['height'])) for _ in range(options['images'])]
+        average = sum(len(data) for data in files) / len(files)
+        self.stdout.write(f'{len(files)} JPEGs of {options["width"]}x{options["height"]}, '
+                          f'{average / 1e6:.1f}MB on average')
+        self.stdout.write(f'{"workers":>8}{"accept ms":>11}{"render ms":>11}{"images/s":>10}')
+        for workers in (int(value) for value in options['workers'].split(',')):
+            with tempfile.TemporaryDirectory() as media, scratch_data(), \
+                    override_settings(MEDIA_ROOT=media, IMAGES={'WORKERS': workers}):
+                user = get_user_model().objects.create(username='image-bench', password='!')
+                start = time.perf_counter()
+                accepted = [images.accept_upload(user, SimpleUploadedFile('photo.jpg', data))[0] for data in files]
+                accept = (time.perf_counter() - start) * 1000 / len(files)
+                # The rows are not committed here, so the pool's connections
+                # would not see them; time the rendering alone.
+                start = time.perf_counter()
+                list(images.get_pool().map(
+                    lambda image: images._render(image, images.get_config()), accepted))
+                elapsed = time.perf_counter() - start
+                images.reset_pool()
+                self.stdout.write(f'{workers:>8}{accept:>11.1f}{elapsed * 1000 / len(files):>11.0f}'
+                                  f'{len(files) / elapsed:>10.1f}')
+                images.process_image(accepted[0].pk)
+                image = Image.objects.get(pk=accepted[0].pk)
+                sizes = ', '.join(f'{width}w {default_storage.size(images.variant_name(image, width)) / 1e3:.0f}KB'
+                                  for width, _ in image.variants)
+        self.stdout.write(f'bytes per variant ({len(files[0]) / 1e3:.0f}KB as uploaded): {sizes}; '
+                          f'blurhash {image.blurhash}')
@@ -0,0 +1,54 @@
+import io
+import json
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from posts.benchmarking import scratch_data, seed, timed
+from posts.fast_serializers import FastPostSerializer
+from posts.models import Post
+from social_media_api.parsers import ORJSONParser
+from social_media_api.renderers import ORJSONRenderer
+
+
+def _book_list(count):
+    # Same shape as advanced-api-project's AuthorSerializer with nested books.
+    return [
+        {'id': i, 'name': f'Author {i}', 'books': [
+            {'id': i * 10 + j, 'title': f'Book {i}-{j}', 'publication_year': 1950 + j, 'author': i}
+            for j in range(10)
+        ]}
+        for i in range(count)
+    ]
+
+
+def _stream(body):
+    return io.BytesIO(body)
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF JSONRenderer/JSONParser with the orjson renderer/parser on feed and book payloads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with scratch_data():
+            seed(posts=100, comments=5)
+            serializer = FastPostSerializer()
+            feed_page = {'count': 100, 'next': None, 'previous': None,
+                         'results': serializer.serialize(serializer.rows(Post.objects.order_by('-id')))}
+        payloads = [('feed page (100 posts)', feed_page), ('book list (100 authors)', _book_list(100))]
+        self.stdout.write(f'{"payload":<26}{"bytes":>9}{"encode std":>12}{"orjson":>9}'
+                          f'{"decode std":>12}{"orjson":>9}  (ms)')
+        for label, payload in payloads:
+            body = JSONRenderer().render(payload)
+            assert ORJSONRenderer().render(payload) == body
+            encode_std = timed(lambda: JSONRenderer().render(payload), options['repeat'])
+            encode_fast = timed(lambda: ORJSONRenderer().render(payload), options['repeat'])
+            decode_std = timed(lambda: JSONParser().parse(_stream(body), None, {}), options['repeat'])
+            decode_fast = timed(lambda: ORJSONParser().parse(_stream(body), None, {}), options['repeat'])
+            assert json.loads(body) == ORJSONParser().parse(_stream(body), None, {})
+            self.stdout.write(f'{label:<26}{len(body):>9}{encode_std:>12.3f}{encode_fast:>9.3f}'
+                              f'{decode_std:>12.3f}{decode_fast:>9.3f}')
@@ -0,0 +1,83 @@
+import random
+import time
+import zlib
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.db.models.functions import Length
+
+from posts.benchmarking import scratch_data, timed
+from posts.models import Post, PostRevision
+from posts.revisions import reconstruct, record_revision
+
+WORDS = ('time person year way day thing man world life hand part child eye woman place work week case '
+         'point government company number group problem fact be have do say get make go know take see '
+         'come think look want give use find tell ask work seem feel try leave call good new first last '
+         'long great little own other old right big high different small large next early young').split()
+
+
+def _sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(6, 18))
+    return ' '.join(words).capitalize() + '.'
+
+
+def _edit(rng, sentences):
+    """Fix a word, or rewrite, insert or drop a sentence."""
+    index = rng.randrange(len(sentences))
+    choice = rng.random()
+    if choice < 0.4:
+        words = sentences[index][:-1].split(' ')
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+        sentences[index] = ' '.join(words) + '.'
+    elif choice < 0.7:
+        sentences[index] = _sentence(rng)
+    elif choice < 0.9 or len(sentences) < 5:
+        sentences.insert(index, _sentence(rng))
+    else:
+        del sentences[index]
+
+
+class Command(BaseCommand):
+    help = 'Compare revision storage as reverse diffs with full copies, and time rebuilding old revisions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sentences', type=int, default=60)
+        parser.add_argument('--edits', type=int, default=200)
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        sentences = [_sentence(rng) for _ in range(options['sentences'])]
+        with scratch_data():
+            author = get_user_model().objects.create_user('bench-editor', password='!')
+            post = Post.objects.create(author=author, title='Bench', content=' '.join(sentences))
+            versions = [post.content]
+            record_seconds = 0.0
+            for _ in range(options['edits']):
+                old_content = post.content
+                _edit(rng, sentences)
+                post.content = ' '.join(sentences)
+                post.save()
+                start = time.perf_counter()
+                record_revision(post, post.title, old_content, author)
+                record_seconds += time.perf_counter() - start
+                versions.append(post.content)
+
+            history = versions[:-1]
+            full = sum(len(text.encode()) for text in history)
+            full_zlib = sum(len(zlib.compress(text.encode())) for text in history)
+            stored = PostRevision.objects.filter(post=post).aggregate(total=Sum(Length('delta')))['total']
+            compressed = PostRevision.objects.filter(post=post, compressed=True).count()
+            for number in (1, len(history) // 2, len(history)):
+                assert reconstruct(post, number)[1] == history[number - 1]
+            oldest_ms = timed(lambda: reconstruct(post, 1))
+            worst_ms = max(timed(lambda: reconstruct(post, number), 5) for number in range(1, 17))
+
+        self.stdout.write(f'{options["edits"]} edits of a {len(versions[0])} character post')
+        self.stdout.write(f'full copies            {full:>10} bytes')
+        self.stdout.write(f'full copies, zlib      {full_zlib:>10} bytes')
+        self.stdout.write(f'reverse diffs          {stored:>10} bytes ({compressed} rows compressed)')
+        self.stdout.write(f'saving vs full copies  {full / stored:>10.1f}x')
+        self.stdout.write(f'record one revision    {record_seconds / options["edits"] * 1000:>10.2f} ms')
+        self.stdout.write(f'rebuild revision 1     {oldest_ms:>10.2f} ms')
+        self.stdout.write(f'rebuild, worst case    {worst_ms:>10.2f} ms')
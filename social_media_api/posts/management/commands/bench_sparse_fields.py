@@ -0,0 +1,36 @@
+import warnings
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from posts.benchmarking import count_queries, scratch_data, seed, timed
+
+CASES = [
+    ('full', {}),
+    ('id,title,author', {'fields': 'id,title,author'}),
+    ('+ expand=author', {'fields': 'id,title,author', 'expand': 'author'}),
+    ('+ comments.id', {'fields': 'id,title,author,comments.id'}),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and latency of the post list with and without ?fields=/?expand=.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=300)
+        parser.add_argument('--comments', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        warnings.filterwarnings('ignore', message='Pagination may yield inconsistent results')
+        with scratch_data():
+            seed(posts=options['posts'], comments=options['comments'])
+            client = APIClient(SERVER_NAME='localhost')
+            self.stdout.write(f'{"case":<20}{"bytes":>10}{"queries":>9}{"median ms":>11}')
+            for label, params in CASES:
+                params = {'page_size': 100, **params}
+                with count_queries() as queries:
+                    response = client.get('/api/posts/', params)
+                elapsed = timed(lambda: client.get('/api/posts/', params), options['repeat'])
+                self.stdout.write(
+                    f'{label:<20}{len(response.content):>10}{len(queries):>9}{elapsed:>11.2f}')
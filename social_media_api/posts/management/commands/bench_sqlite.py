@@ -0,0 +1,92 @@
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+BODY = 'x' * 200
+
+
+def _register(alias, path, options):
+    connections.settings[alias] = {**connections.settings['default'], 'NAME': path, 'OPTIONS': options}
+    with connections[alias].cursor() as cursor:
+        cursor.execute('CREATE TABLE bench_item (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'author INTEGER NOT NULL, body TEXT NOT NULL)')
+        cursor.execute('CREATE INDEX bench_item_author ON bench_item (author)')
+    connections[alias].close()
+
+
+def _write(alias, author):
+    # Read-then-write, the shape of get_or_create() and most update views.
+    with transaction.atomic(using=alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM bench_item WHERE author = %s', [author])
+            cursor.execute('INSERT INTO bench_item (author, body) VALUES (%s, %s)', [author, BODY])
+
+
+def _read(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT id, body FROM bench_item ORDER BY id DESC LIMIT 20')
+        cursor.fetchall()
+
+
+class Command(BaseCommand):
+    help = 'Mixed read/write load against SQLite with default settings and with the tuned OPTIONS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=3)
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        tuned = settings.DATABASES['default']['OPTIONS']
+        scenarios = [
+            ('default', {'timeout': 1}),
+            ('WAL + IMMEDIATE', tuned),
+        ]
+        self.stdout.write(f'{options["writers"]} writers, {options["readers"]} readers, '
+                          f'{options["seconds"]}s per scenario')
+        self.stdout.write(f'{"scenario":<22}{"writes/s":>10}{"write err":>11}{"reads/s":>10}{"read err":>10}')
+        with tempfile.TemporaryDirectory() as directory:
+            for index, (label, db_options) in enumerate(scenarios):
+                alias = f'bench_{index}'
+                _register(alias, os.path.join(directory, f'{alias}.sqlite3'), db_options)
+                counts = self._run(alias, options)
+                seconds = options['seconds']
+                self.stdout.write(
+                    f'{label:<22}{counts["write"] / seconds:>10.0f}{counts["write_error"]:>11}'
+                    f'{counts["read"] / seconds:>10.0f}{counts["read_error"]:>10}')
+
+    def _run(self, alias, options):
+        counts = Counter()
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def worker(kind, number):
+            local = Counter()
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        if kind == 'read':
+                            _read(alias)
+                        else:
+                            _write(alias, number)
+                        local[kind] += 1
+                    except OperationalError:
+                        local[f'{kind}_error'] += 1
+            finally:
+                connections[alias].close()
+                with lock:
+                    counts.update(local)
+
+        threads = [threading.Thread(target=worker, args=('write', i)) for i in range(options['writers'])]
+        threads += [threading.Thread(target=worker, args=('read', i)) for i in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts
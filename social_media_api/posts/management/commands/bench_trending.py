@@ -0,0 +1,57 @@
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from posts.trending import CountMinSketch, TopK
+
+
+def _zipf_stream(events, vocabulary, exponent, seed):
+    rng = random.Random(seed)
+    weights = [1 / (rank ** exponent) for rank in range(1, vocabulary + 1)]
+    return rng.choices([f'tag{rank}' for rank in range(vocabulary)], weights, k=events)
+
+
+class Command(BaseCommand):
+    help = 'Compare the count-min sketch + top-k heap with exact counting on a Zipf hashtag stream.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=200_000)
+        parser.add_argument('--vocabulary', type=int, default=50_000)
+        parser.add_argument('--exponent', type=float, default=1.1)
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--depth', type=int, default=4)
+        parser.add_argument('--widths', default='512,2048,8192')
+
+    def handle(self, *args, **options):
+        stream = _zipf_stream(options['events'], options['vocabulary'], options['exponent'], seed=1)
+        n = options['top']
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        exact = Counter(stream)
+        exact_seconds = time.perf_counter() - start
+        exact_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        truth = [tag for tag, _ in exact.most_common(n)]
+        self.stdout.write(f'{options["events"]} events, {len(exact)} distinct tags, top {n}')
+        self.stdout.write(f'{"method":<18}{"memory":>10}{"us/event":>10}{"recall":>8}{"mean rel err":>14}')
+        self.stdout.write(f'{"exact Counter":<18}{exact_bytes:>10}'
+                          f'{exact_seconds / len(stream) * 1e6:>10.2f}{1:>8.2f}{0:>14.4f}')
+
+        for width in map(int, options['widths'].split(',')):
+            sketch = CountMinSketch(width, options['depth'])
+            top = TopK(50)
+            start = time.perf_counter()
+            for tag in stream:
+                top.offer(tag, sketch.add(tag))
+            seconds = time.perf_counter() - start
+            found = sorted(top.counts, key=top.counts.get, reverse=True)[:n]
+            recall = len(set(found) & set(truth)) / n
+            error = sum((sketch.estimate(tag) - exact[tag]) / exact[tag] for tag in truth) / n
+            memory = sketch.nbytes() + sys.getsizeof(top.counts) + sys.getsizeof(top.heap)
+            self.stdout.write(f'{f"sketch w={width}":<18}{memory:>10}'
+                              f'{seconds / len(stream) * 1e6:>10.2f}{recall:>8.2f}{error:>14.4f}')
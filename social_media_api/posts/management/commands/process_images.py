@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.images import reset_pool, submit
+from posts.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Render post images left pending by a process that stopped before it got to them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=300,
+                            help='Only images uploaded at least this many seconds ago.')
+        parser.add_argument('--failed', action='store_true', help='Retry failed images as well.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        if options['failed']:
+            Image.objects.filter(status=Image.FAILED, created_at__lt=cutoff).update(status=Image.PENDING)
+        ids = list(Image.objects.filter(status=Image.PENDING, created_at__lt=cutoff).values_list('pk', flat=True))
+        futures = [submit(image_id) for image_id in ids]
+        for future in futures:
+            if future is not None:
+                future.result()
+        reset_pool()
+        counts = dict.fromkeys([Image.READY, Image.FAILED], 0)
+        for status in Image.objects.filter(pk__in=ids).values_list('status', flat=True):
+            counts[status] = counts.get(status, 0) + 1
+        self.stdout.write(f'Processed {len(ids)} images: {counts[Image.READY]} ready, {counts[Image.FAILED]} failed')
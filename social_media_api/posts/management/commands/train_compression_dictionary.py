@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.compression import compress, get_config, reset_dictionaries, train_dictionary
+from posts.models import Comment, CompressionDictionary, Post
+
+# zlib can only refer back 32KB; zstd's own default is 110KB.
+DEFAULT_SIZES = {'zlib': 32 * 1024, 'zstd': 110 * 1024}
+
+
+class Command(BaseCommand):
+    help = 'Train a shared compression dictionary on recent posts and comments and use it for new writes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=5000)
+        parser.add_argument('--size', type=int, help='Dictionary size in bytes.')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        algorithm = config['ALGORITHM']
+        half = options['samples'] // 2
+        samples = [
+            *Post.objects.order_by('-pk').values_list('content', flat=True)[:half],
+            *Comment.objects.order_by('-pk').values_list('content', flat=True)[:half],
+        ]
+        samples = [text for text in samples if len(text.encode()) >= config['MIN_SIZE']]
+        if len(samples) < 10:
+            raise CommandError(f'Only {len(samples)} texts of at least {config["MIN_SIZE"]} bytes to train on.')
+        before = sum(len(compress(text)) for text in samples)
+        data = train_dictionary(samples, options['size'] or DEFAULT_SIZES[algorithm], algorithm)
+        dictionary = CompressionDictionary.objects.create(algorithm=algorithm, data=data, samples=len(samples))
+        reset_dictionaries()
+        after = sum(len(compress(text)) for text in samples)
+        raw = sum(len(text.encode()) for text in samples)
+        self.stdout.write(
+            f'{dictionary}: {len(data)} bytes from {len(samples)} texts; compressed they took '
+            f'{before / raw:.1%} of their size and now take {after / raw:.1%}. '
+            'Other processes pick it up when restarted.')
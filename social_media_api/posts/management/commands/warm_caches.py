@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from social_media_api.warmup import aliases, report_lines, warm
+
+
+class Command(BaseCommand):
+    help = ('Fill the follow, token, hidden-author and feed caches of the most active users and '
+            'the post lists of the most followed authors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, help='How many active users to warm (CACHE_WARMUP USERS).')
+        parser.add_argument('--authors', type=int, help='How many popular authors to warm (POPULAR_AUTHORS).')
+        parser.add_argument('--batch-size', type=int, help='Users per batch (BATCH_SIZE).')
+        parser.add_argument('--concurrency', type=int, help='Batches run at once; 0 runs them inline (CONCURRENCY).')
+
+    def handle(self, *args, **options):
+        if not aliases():
+            raise CommandError(
+                'Every cache this command fills is local to each process, so those are read from the '
+                'database instead and there is nothing to warm. Configure a shared cache first.')
+        names = {'users': 'USERS', 'authors': 'POPULAR_AUTHORS', 'batch_size': 'BATCH_SIZE',
+                 'concurrency': 'CONCURRENCY'}
+        overrides = {setting: options[option] for option, setting in names.items() if options[option] is not None}
+        for line in report_lines(warm(**overrides)):
+            self.stdout.write(line)
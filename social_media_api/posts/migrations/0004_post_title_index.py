@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='title',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:49
+
+import posts.compression
+from django.db import migrations, models
+
+
+def compress_existing(apps, schema_editor):
+    # Rewrites every row so its content is stored in the compressed format;
+    # rows not yet rewritten are still read as text.
+    db = schema_editor.connection.alias
+    for name in ('Post', 'Comment', 'ArchivedPost', 'ArchivedComment'):
+        model = apps.get_model('posts', name)
+        fields = ['content', 'content_search'] if name == 'Post' else ['content']
+        batch = []
+        for row in model.objects.using(db).only('content').iterator(chunk_size=2000):
+            if name == 'Post':
+                row.content_search = posts.compression.search_text(row.content)
+            batch.append(row)
+            if len(batch) == 2000:
+                model.objects.using(db).bulk_update(batch, fields)
+                batch = []
+        model.objects.using(db).bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_author_timeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('algorithm', models.CharField(max_length=8)),
+                ('data', models.BinaryField()),
+                ('samples', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='content_search',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AlterField(
+            model_name='archivedcomment',
+            name='content',
+            field=posts.compression.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='archivedpost',
+            name='content',
+            field=posts.compression.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='content',
+            field=posts.compression.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='content',
+            field=posts.compression.CompressedTextField(),
+        ),
+        # Irreversible: turning the columns back into text would leave the
+        # compressed bytes in them, and every post and comment unreadable.
+        migrations.RunPython(compress_existing),
+    ]
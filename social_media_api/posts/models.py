@@ -1,23 +1,228 @@
 from django.db import models
 from django.conf import settings
 
+from .compression import CompressedTextField, search_text
+
+class PostQuerySet(models.QuerySet):
+    def visible(self):
+        """Posts that are neither soft-deleted nor written by a soft-deleted user."""
+        return self.filter(deleted_at__isnull=True, author__deleted_at__isnull=True)
+
+    def get_with_archive(self, **lookup):
+        """
+        Look a post up in the hot table first and fall back to ``ArchivedPost``,
+        which has the same fields and a ``comments`` relation.
+        """
+        try:
+            return self.get(**lookup)
+        except self.model.DoesNotExist:
+            archived = ArchivedPost.objects.visible().prefetch_related(
+                models.Prefetch('comments', queryset=ArchivedComment.objects.visible()))
+            return archived.get(**lookup)
+
+
+class ArchivedPostQuerySet(models.QuerySet):
+    def visible(self):
+        return self.filter(author__deleted_at__isnull=True)
+
+
+class ArchivedCommentQuerySet(models.QuerySet):
+    def visible(self):
+        return self.filter(author__deleted_at__isnull=True, post__author__deleted_at__isnull=True)
+
+
+class CommentQuerySet(models.QuerySet):
+    def visible(self):
+        """Comments whose author, post and post author are not soft-deleted."""
+        return self.filter(
+            author__deleted_at__isnull=True,
+            post__deleted_at__isnull=True,
+            post__author__deleted_at__isnull=True,
+        )
+
+
 # Create your models here.
 class Post(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    title = models.CharField(max_length=255)
-    content = models.TextField()
+    # Indexed for the admin's prefix search.
+    title = models.CharField(max_length=255, db_index=True)
+    content = CompressedTextField()
+    # The content's distinct words, uncompressed, for search; set in save().
+    content_search = models.TextField(editable=False, default='')
+    # Kept by posts.images.attach_images, so pages without images skip that query.
+    image_count = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set when the post is deleted; the row is purged in the background.
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # One author's posts newest first, for their timeline.
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_timeline'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.content_search = search_text(self.content)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'content_search'}
+        super().save(*args, **kwargs)
+
+def path_segment(comment_id):
+    """Fixed-width base 36, so paths sort like the ids they are made of."""
+    digits = ''
+    while comment_id:
+        comment_id, digit = divmod(comment_id, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[digit] + digits
+    return digits.rjust(8, '0') + '/'
+
+
 class Comment(models.Model):
+    MAX_DEPTH = 20
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    content = models.TextField()
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Materialized path of the ancestors: one path_segment() per ancestor,
+    # root first, so a subtree is a range scan on (post, path).
+    path = models.CharField(max_length=MAX_DEPTH * 9, default='', blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    content = CompressedTextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['post', 'path'])]
+
     def __str__(self):
         return f'Comment by {self.author.username} on {self.post.title}'
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.place_in_thread()
+        super().save(*args, **kwargs)
+
+    def place_in_thread(self):
+        """Set ``path`` and ``depth`` from the parent; ``bulk_create`` does not call ``save()``."""
+        if self.parent_id is not None:
+            self.path, self.depth = self.parent.subtree_path, self.parent.depth + 1
+
+    @property
+    def subtree_path(self):
+        """The ``path`` of this comment's replies."""
+        return self.path + path_segment(self.pk)
+
+
+class PostRevision(models.Model):
+    """
+    What a post looked like before an edit. ``delta`` holds either the full
+    content (``snapshot``) or a reverse diff against the next newer version;
+    see ``posts.revisions``.
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    editor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    title = models.CharField(max_length=255)
+    delta = models.BinaryField()
+    snapshot = models.BooleanField(default=False)
+    compressed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['post', 'number'], name='unique_post_revision')]
+
+    def __str__(self):
+        return f'{self.post_id} r{self.number}'
+
+
+# Cold storage for old posts, filled by "manage.py archive_posts". Rows keep
+# the ids they had in the hot tables.
+class ArchivedPost(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    title = models.CharField(max_length=255)
+    content = CompressedTextField()
+    image_count = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ArchivedPostQuerySet.as_manager()
+
+    def __str__(self):
+        return self.title
+
+class ArchivedComment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE, related_name='comments')
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    # Whole threads are archived together, so parent_id and path stay valid.
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True,
+                               db_constraint=False, related_name='+')
+    path = models.CharField(max_length=Comment.MAX_DEPTH * 9, default='', blank=True)
+    depth = models.PositiveSmallIntegerField(default=0)
+    content = CompressedTextField()
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    objects = ArchivedCommentQuerySet.as_manager()
+
+
+class CompressionDictionary(models.Model):
+    """A shared dictionary for ``CompressedTextField``; see ``posts.compression``."""
+    algorithm = models.CharField(max_length=8)
+    data = models.BinaryField()
+    samples = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.algorithm} dictionary {self.pk}'
+
+
+def _image_path(image, filename):
+    return f'post_images/{image.sha256[:2]}/{image.sha256}/{filename}'
+
+
+class Image(models.Model):
+    """An uploaded image, stored and processed once per distinct content; see ``posts.images``."""
+
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    original = models.FileField(upload_to=_image_path)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    blurhash = models.CharField(max_length=64, blank=True)
+    # [[width, height], ...] of the re-encoded variants, smallest first.
+    variants = models.JSONField(default=list)
+    uploaders = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='uploaded_images')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.sha256[:12]} ({self.width}x{self.height}, {self.status})'
+
+
+class Attachment(models.Model):
+    # Archived posts keep their ids, so attachments stay with a post when it
+    # is archived; purging removes them.
+    post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    image = models.ForeignKey(Image, on_delete=models.PROTECT, related_name='attachments')
+    position = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'position'], name='attachment_post_position'),
+        ]
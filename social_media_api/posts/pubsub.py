@@ -0,0 +1,133 @@
+"""
+In-process publish/subscribe used to push new feed items to open streams.
+
+Channels are author ids and event ids are post ids, so a client that
+reconnects with ``Last-Event-ID`` can always be caught up from the posts
+table. Post ids are not published in order, though: events are published
+after commit, and a post with a lower id can commit after one with a higher
+id. The backend therefore numbers events itself, and subscribers track that
+sequence number rather than post ids.
+
+Subscribers do not own a queue. They keep a cursor into the shared history
+and an ``asyncio.Event`` that the backend sets when one of their channels
+gets a new event, so an idle connection costs the same no matter how much
+traffic flows through the process.
+"""
+import asyncio
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'posts.pubsub.LocalBackend'
+DEFAULT_HISTORY = 1000
+DEFAULT_HEARTBEAT = 15
+
+
+class Subscription:
+    __slots__ = ('channels', 'cursor', '_loop', '_event')
+
+    def __init__(self, channels, cursor=0):
+        self.channels = frozenset(channels)
+        self.cursor = cursor
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def notify(self):
+        # Publishers usually run in a sync worker thread, not on our loop.
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self, timeout):
+        await asyncio.wait_for(self._event.wait(), timeout)
+
+
+class LocalBackend:
+    """
+    Keeps the most recent events in a bounded ring buffer and wakes the
+    subscribers of this process only.
+    """
+
+    def __init__(self, history=DEFAULT_HISTORY):
+        self._events = deque(maxlen=history)
+        self._sequence = 0
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event_id, data):
+        with self._lock:
+            self._sequence += 1
+            self._events.append((self._sequence, event_id, channel, data))
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.notify()
+
+    def subscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def last_sequence(self):
+        with self._lock:
+            return self._sequence
+
+    def since(self, sequence, channels):
+        """
+        Return ``[(sequence, event_id, data), ...]`` published after
+        ``sequence`` on the given channels, or ``None`` when some of those
+        events were evicted and the caller has to catch up from the
+        database instead.
+        """
+        with self._lock:
+            if self._events and self._events[0][0] > sequence + 1:
+                return None
+            missed = []
+            for entry in reversed(self._events):
+                if entry[0] <= sequence:
+                    break
+                if entry[2] in channels:
+                    missed.append((entry[0], entry[1], entry[3]))
+        missed.reverse()
+        return missed
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subs in self._subscribers.values() for s in subs})
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(
+                    getattr(settings, 'FEED_STREAM_BACKEND', DEFAULT_BACKEND))
+                _backend = backend_class(
+                    history=getattr(settings, 'FEED_STREAM_HISTORY', DEFAULT_HISTORY))
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    with _backend_lock:
+        _backend = None
@@ -0,0 +1,80 @@
+"""
+Soft deletion and chunked background purging of posts.
+
+Deleting a post with ``Post.delete()`` collects every comment in Python and
+removes everything in one transaction, holding SQLite's write lock for as
+long as that takes. Instead the post is hidden straight away by setting
+``deleted_at`` and its rows are removed later in small, separately
+committed chunks.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .feeds import forget_post
+from .models import Attachment, Comment, Post, PostRevision
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 200
+
+
+def delete_in_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE, pause=0, progress=None):
+    """
+    Delete the rows of ``queryset`` ``chunk_size`` at a time in id order,
+    committing after each chunk. ``progress(model_name, deleted)`` is called
+    after every chunk. Returns the number of deleted rows.
+    """
+    label = queryset.model._meta.label
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            count, _ = queryset.filter(pk__gte=ids[0], pk__lte=ids[-1]).delete()
+        deleted += count
+        if progress is not None:
+            progress(label, deleted)
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Run ``func`` on a daemon thread, or inline when
+    ``PURGE_IN_BACKGROUND`` is off (as in tests).
+    """
+    if not getattr(settings, 'PURGE_IN_BACKGROUND', True):
+        return func(*args, **kwargs)
+
+    def target():
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception('Background purge %s failed; run "manage.py purge_deleted" to resume.',
+                             func.__name__)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target, name=f'purge-{func.__name__}', daemon=True)
+    thread.start()
+    return thread
+
+
+def soft_delete_post(post):
+    Post.objects.filter(pk=post.pk).update(deleted_at=timezone.now())
+    forget_post(post.pk, post.author_id)
+
+
+def purge_post(post_id, chunk_size=DEFAULT_CHUNK_SIZE, pause=0, progress=None):
+    """Remove a soft-deleted post, its comments, revisions and attachments."""
+    delete_in_chunks(Comment.objects.filter(post_id=post_id), chunk_size, pause, progress)
+    delete_in_chunks(Attachment.objects.filter(post_id=post_id), chunk_size, pause, progress)
+    delete_in_chunks(PostRevision.objects.filter(post_id=post_id), chunk_size, pause, progress)
+    delete_in_chunks(Post.objects.filter(pk=post_id, deleted_at__isnull=False), chunk_size, pause, progress)
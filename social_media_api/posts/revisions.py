@@ -0,0 +1,93 @@
+"""
+Post revision history stored as reverse diffs.
+
+The post row keeps the current title and content. Each edit adds a
+``PostRevision`` with what the post looked like before it: the old title,
+and the old content as the edits that turn the newer content back into it
+(``difflib`` opcodes over word tokens), zlib-compressed when that is
+smaller. Every ``SNAPSHOT_EVERY``-th revision stores the full content
+instead, so rebuilding any revision reads one short range of rows and
+applies fewer than ``SNAPSHOT_EVERY`` diffs.
+"""
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+from django.db.models import Max
+
+from .models import PostRevision
+
+SNAPSHOT_EVERY = 16
+TOKEN_RE = re.compile(r'\S+\s*|\s+')
+
+
+def _tokens(text):
+    return TOKEN_RE.findall(text)
+
+
+def reverse_delta(new, old):
+    """``[[start, end, text], ...]``: replace ``new``'s tokens ``start:end`` with ``text`` to get ``old``."""
+    a, b = _tokens(new), _tokens(old)
+    return [
+        [i1, i2, ''.join(b[j1:j2])]
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b).get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+def apply_delta(new, ops):
+    tokens = _tokens(new)
+    parts, position = [], 0
+    for start, end, text in ops:
+        parts.extend(tokens[position:start])
+        parts.append(text)
+        position = end
+    parts.extend(tokens[position:])
+    return ''.join(parts)
+
+
+def pack(text):
+    """``(bytes, compressed)``, compressing only when it saves space."""
+    raw = text.encode()
+    packed = zlib.compress(raw)
+    return (packed, True) if len(packed) < len(raw) else (raw, False)
+
+
+def unpack(data, compressed):
+    data = bytes(data)
+    return (zlib.decompress(data) if compressed else data).decode()
+
+
+def record_revision(post, old_title, old_content, editor=None):
+    """
+    Store the version of ``post`` before its current title and content.
+    Call it inside the transaction that saved the edit.
+    """
+    number = (post.revisions.aggregate(last=Max('number'))['last'] or 0) + 1
+    snapshot = number % SNAPSHOT_EVERY == 0
+    if snapshot:
+        text = old_content
+    else:
+        text = json.dumps(reverse_delta(post.content, old_content), ensure_ascii=False, separators=(',', ':'))
+    delta, compressed = pack(text)
+    return PostRevision.objects.create(
+        post=post, number=number, editor=editor, title=old_title,
+        delta=delta, snapshot=snapshot, compressed=compressed)
+
+
+def reconstruct(post, number):
+    """``(revision, content)`` for revision ``number`` of ``post``; raises ``PostRevision.DoesNotExist``."""
+    # The nearest snapshot at or after ``number`` is inside this window; if
+    # there is none, the window runs up to the newest revision.
+    rows = list(post.revisions.filter(number__gte=number, number__lt=number + SNAPSHOT_EVERY).order_by('number'))
+    if not rows or rows[0].number != number:
+        raise PostRevision.DoesNotExist(f'Post {post.pk} has no revision {number}.')
+    snapshot = next((index for index, row in enumerate(rows) if row.snapshot), None)
+    if snapshot is None:
+        content, chain = post.content, rows
+    else:
+        content, chain = unpack(rows[snapshot].delta, rows[snapshot].compressed), rows[:snapshot]
+    for row in reversed(chain):
+        content = apply_delta(content, json.loads(unpack(row.delta, row.compressed)))
+    return rows[0], content
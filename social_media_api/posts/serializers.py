@@ -1,17 +1,202 @@
+from django.contrib.auth import get_user_model
+from django.db import models
 from rest_framework import serializers
-from .models import Post, Comment
+from accounts.blocking import get_hidden_authors
+from .images import attach_images, attached_images
+from .images import get_config as get_image_config
+from .models import Image, Post, Comment, PostRevision
+
+
+class SparseSpec:
+    """
+    Field selection parsed from ``?fields=`` and ``?expand=``.
+
+    Both take comma separated names; dotted names such as ``comments.id``
+    or ``comments.author`` address the serializer nested under ``comments``.
+    ``fields`` is ``None`` when the client did not ask for a subset.
+    """
+
+    def __init__(self, fields=None, expand=()):
+        self.fields = None if fields is None else set(fields)
+        self.expand = set(expand)
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return cls()
+        spec = getattr(request, '_sparse_spec', None)
+        if spec is None:
+            params = request.query_params
+            fields = params.get('fields')
+            spec = cls(
+                fields=None if fields is None else _split(fields),
+                expand=_split(params.get('expand', '')),
+            )
+            request._sparse_spec = spec
+        return spec
+
+    def wants(self, name):
+        return self.fields is None or name in self.fields or any(
+            field.startswith(name + '.') for field in self.fields)
+
+    def expands(self, name):
+        return name in self.expand
+
+    def child(self, name):
+        prefix = name + '.'
+        fields = None
+        if self.fields is not None:
+            fields = {field[len(prefix):] for field in self.fields if field.startswith(prefix)} or None
+        return SparseSpec(
+            fields=fields,
+            expand={field[len(prefix):] for field in self.expand if field.startswith(prefix)},
+        )
+
+
+def _split(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = get_user_model()
+        fields = ['id', 'username']
+
+
+class SparseFieldsMixin:
+    """
+    Drops the fields a GET request did not ask for and swaps ``author`` for
+    a nested object when it is expanded.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = SparseSpec.from_request(self.context.get('request'))
+        for name in self._sparse_path():
+            spec = spec.child(name)
+        if spec.fields is not None:
+            for name in list(fields):
+                if not spec.wants(name):
+                    del fields[name]
+        if 'author' in fields and spec.expands('author'):
+            fields['author'] = AuthorSerializer(read_only=True)
+        return fields
+
+    def _sparse_path(self):
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        return reversed(path)
+
+
+def hidden_authors_for(context):
+    """The requesting user's ``HiddenAuthors``, looked up once per serializer tree."""
+    if 'hidden_authors' not in context:
+        request = context.get('request')
+        context['hidden_authors'] = get_hidden_authors(getattr(request, 'user', None))
+    return context['hidden_authors']
+
+
+class CommentListSerializer(serializers.ListSerializer):
+    """Leaves out comments (and so their replies) by authors hidden from the viewer."""
+
+    def to_representation(self, data):
+        comments = data.all() if isinstance(data, models.manager.BaseManager) else data
+        hidden = hidden_authors_for(self.context)
+        if hidden:
+            comments = hidden.exclude(comments, author_id=lambda comment: comment.author_id)
+        return super().to_representation(comments)
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=Comment.objects.visible(), required=False, allow_null=True)
 
-class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = ['id', 'post', 'author', 'content', 'created_at', 'updated_at']
-        read_only_fields = ['author']
+        fields = ['id', 'post', 'parent', 'depth', 'author', 'content', 'created_at', 'updated_at']
+        read_only_fields = ['author', 'depth']
+        list_serializer_class = CommentListSerializer
+
+    def validate(self, attrs):
+        instance = self.instance
+        if instance is not None:
+            # Moving a comment would invalidate the paths of its replies.
+            moved = 'parent' in attrs and getattr(attrs['parent'], 'pk', None) != instance.parent_id
+            if 'post' in attrs and attrs['post'].pk != instance.post_id:
+                moved = moved or instance.parent_id is not None or instance.replies.exists()
+            if moved:
+                raise serializers.ValidationError('Comments cannot be moved to another thread.')
+            return attrs
+        parent = attrs.get('parent')
+        if parent is not None:
+            if parent.post_id != attrs['post'].pk:
+                raise serializers.ValidationError({'parent': 'The parent comment is on another post.'})
+            if parent.depth + 1 >= Comment.MAX_DEPTH:
+                raise serializers.ValidationError(
+                    {'parent': f'Replies can be nested at most {Comment.MAX_DEPTH} levels deep.'})
+        return attrs
+
+
+class ThreadCommentSerializer(CommentSerializer):
+    """A comment with the replies loaded by ``posts.threads.load_replies``."""
 
-class PostSerializer(serializers.ModelSerializer):
+    reply_count = serializers.IntegerField(read_only=True)
+    replies = serializers.SerializerMethodField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['reply_count', 'replies']
+
+    def get_replies(self, comment):
+        return ThreadCommentSerializer(comment.thread_replies, many=True, context=self.context).data
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     comments = CommentSerializer(many=True, read_only=True)
+    images = serializers.SerializerMethodField()
+    # Ids from POST /api/images/, in display order; replaces the post's images.
+    image_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True, required=False)
 
     class Meta:
         model = Post
-        fields = ['id', 'author', 'title', 'content', 'comments', 'created_at', 'updated_at']
+        fields = ['id', 'author', 'title', 'content', 'images', 'image_ids', 'comments', 'created_at', 'updated_at']
         read_only_fields = ['author']
 
+    def get_images(self, post):
+        if not post.image_count:
+            return []
+        return attached_images([post.pk]).get(post.pk, [])
+
+    def validate_image_ids(self, image_ids):
+        limit = get_image_config()['PER_POST']
+        if len(image_ids) > limit:
+            raise serializers.ValidationError(f'Posts can have at most {limit} images.')
+        if len(set(image_ids)) != len(image_ids):
+            raise serializers.ValidationError('An image can only be attached once.')
+        user = self.context['request'].user
+        usable = set(Image.objects.filter(pk__in=image_ids, uploaders=user).values_list('pk', flat=True))
+        unknown = [image_id for image_id in image_ids if image_id not in usable]
+        if unknown:
+            raise serializers.ValidationError(f'Unknown images: {unknown}.')
+        return image_ids
+
+    def create(self, validated_data):
+        image_ids = validated_data.pop('image_ids', [])
+        post = super().create(validated_data)
+        attach_images(post, image_ids)
+        return post
+
+    def update(self, instance, validated_data):
+        image_ids = validated_data.pop('image_ids', None)
+        post = super().update(instance, validated_data)
+        if image_ids is not None:
+            attach_images(post, image_ids)
+        return post
+
+
+class PostRevisionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PostRevision
+        fields = ['number', 'title', 'editor', 'created_at']
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from outbox.relay import publish
+from .models import Post
+
+
+@receiver(post_save, sender=Post)
+def record_new_post(sender, instance, created, using, **kwargs):
+    # Fan-out and hashtag counting run from the outbox; see posts.consumers.
+    if created:
+        publish('post.created', {'id': instance.pk, 'author': instance.author_id}, using=using)
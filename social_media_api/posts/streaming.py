@@ -0,0 +1,108 @@
+"""
+Streamed JSON list responses for ``?stream=1``.
+
+A regular list response builds every item, then the whole JSON document,
+before sending a byte; with ``page_size=100`` and busy comment threads that
+is megabytes per request. A streamed response sends the same bytes from a
+generator: the pagination envelope is written around items that are read,
+serialized and encoded a few at a time (see ``FastPostSerializer.stream``),
+and output is handed to the server in chunks of ``BUFFER_SIZE`` bytes, so
+peak memory does not depend on the page size or the number of comments.
+
+Errors raised after the first chunk has been sent cannot change the status
+code any more; the connection is closed with a truncated body instead.
+"""
+from django.core.paginator import InvalidPage
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+
+BUFFER_SIZE = 64 * 1024
+
+_RESULTS = object()
+
+
+def wants_stream(request):
+    """``?stream=1`` on a request whose negotiated renderer writes JSON."""
+    return (request.query_params.get('stream') in ('1', 'true')
+            and isinstance(getattr(request, 'accepted_renderer', None), JSONRenderer))
+
+
+def can_stream(paginator):
+    # Page-number pagination knows its links before the page is read;
+    # cursor pagination needs the page's rows first.
+    return paginator is None or isinstance(paginator, PageNumberPagination)
+
+
+def lazy_page(paginator, queryset, request):
+    """
+    ``PageNumberPagination.paginate_queryset`` without evaluating the page:
+    returns the sliced queryset, or ``None`` when pagination is off.
+    """
+    page_size = paginator.get_page_size(request)
+    if not page_size:
+        return None
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        paginator.page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginator.request = request
+    return paginator.page.object_list
+
+
+def _encoder(request, view):
+    renderer = request.accepted_renderer
+    media_type = request.accepted_media_type
+    context = {'request': request, 'view': view}
+
+    def encode(value):
+        # Renderers turn a bare None into an empty body.
+        return b'null' if value is None else renderer.render(value, media_type, context)
+
+    return encode
+
+
+def _buffered(chunks, size=BUFFER_SIZE):
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _document(envelope, items, encode):
+    if envelope is None:
+        yield b'['
+        yield from items
+        yield b']'
+        return
+    for index, (key, value) in enumerate(envelope.items()):
+        yield (b'{' if index == 0 else b',') + encode(key) + b':'
+        if value is _RESULTS:
+            yield b'['
+            yield from items
+            yield b']'
+        else:
+            yield encode(value)
+    yield b'}'
+
+
+def stream_list(view, request, serializer, rows):
+    """
+    Stream ``rows`` through ``serializer`` inside ``view``'s pagination
+    envelope, e.g. ``{"count":..,"next":..,"previous":..,"results":[...]}``.
+    """
+    envelope = None
+    page = lazy_page(view.paginator, rows, request) if view.paginator is not None else None
+    if page is not None:
+        rows = page
+        envelope = view.get_paginated_response(_RESULTS).data
+    encode = _encoder(request, view)
+    content = _buffered(_document(envelope, serializer.stream(rows, encode), encode))
+    return StreamingHttpResponse(content, content_type=request.accepted_renderer.media_type)
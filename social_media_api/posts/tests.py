@@ -1,3 +1,1216 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import ExifTags
+from PIL import Image as PILImage
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from accounts import authentication, graph
+from accounts.blocking import build, filter_key
+from accounts.purge import soft_delete_user
+from social_media_api import warmup
+from social_media_api.throttling import reset_store
+from . import comment_writes, compression, feeds, images
+from .archive import archive_old_posts
+from .fast_serializers import FastPostSerializer
+from .compression import reset_dictionaries
+from .models import (ArchivedComment, ArchivedPost, Attachment, CompressionDictionary, Image, Post, Comment,
+                     PostRevision)
+from .purge import purge_post, soft_delete_post
+from .revisions import SNAPSHOT_EVERY, apply_delta, reconstruct, reverse_delta
+from .pubsub import LocalBackend, Subscription, get_backend, reset_backend
+from .serializers import PostSerializer, SparseSpec
+from .trending import CountMinSketch, TopK, extract_hashtags, get_tracker, reset_tracker
+from .views import feed_stream, sparse_posts
+
+User = get_user_model()
+
+# A cache every process sees, as the token, follow and feed caches require.
+SHARED_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'social-media-api-test-cache'),
+    'OPTIONS': {'MAX_ENTRIES': 100_000},
+}}
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class LocalBackendTests(TestCase):
+    def test_since_returns_only_subscribed_channels(self):
+        backend = LocalBackend(history=10)
+        backend.publish(1, 5, 'a')
+        backend.publish(2, 6, 'b')
+        backend.publish(1, 7, 'c')
+        self.assertEqual(backend.since(1, {1}), [(3, 7, 'c')])
+        self.assertEqual(backend.since(0, {1, 2}), [(1, 5, 'a'), (2, 6, 'b'), (3, 7, 'c')])
+        self.assertEqual(backend.last_sequence(), 3)
+
+    def test_since_follows_publish_order_not_event_ids(self):
+        # Post 8 committed after post 9: a subscriber that saw 9 still gets 8.
+        backend = LocalBackend(history=10)
+        backend.publish(1, 9, 'late id')
+        backend.publish(1, 8, 'early id')
+        self.assertEqual(backend.since(1, {1}), [(2, 8, 'early id')])
+
+    def test_since_reports_gap_after_eviction(self):
+        backend = LocalBackend(history=2)
+        for event_id in (1, 2, 3):
+            backend.publish(1, event_id, event_id)
+        self.assertIsNone(backend.since(0, {1}))
+        self.assertEqual(backend.since(1, {1}), [(2, 2, 2), (3, 3, 3)])
+
+    async def test_publish_wakes_only_matching_subscribers(self):
+        backend = LocalBackend()
+        interested = Subscription({1})
+        other = Subscription({2})
+        backend.subscribe(interested)
+        backend.subscribe(other)
+        backend.publish(1, 1, 'x')
+        await interested.wait(1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await other.wait(0.01)
+        backend.unsubscribe(interested)
+        backend.unsubscribe(other)
+        self.assertEqual(backend.subscriber_count(), 0)
+
+
+@override_settings(FEED_STREAM_HISTORY=2, FEED_STREAM_HEARTBEAT=0.05)
+class FeedStreamTests(TestCase):
+    def setUp(self):
+        reset_backend()
+        self.addCleanup(reset_backend)
+        self.reader = User.objects.create_user('reader', password='pw')
+        self.author = User.objects.create_user('author', password='pw')
+        self.stranger = User.objects.create_user('stranger', password='pw')
+        self.reader.following.add(self.author)
+        self.token = Token.objects.create(user=self.reader)
+        self.factory = RequestFactory()
+
+    async def _open(self, **headers):
+        request = self.factory.get('/api/feed/stream/', headers=headers)
+        response = await feed_stream(request)
+        return response, aiter(response.streaming_content)
+
+    async def test_requires_token(self):
+        request = self.factory.get('/api/feed/stream/', {'token': 'nope'})
+        response = await feed_stream(request)
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(OUTBOX={'RELAY': 'inline'})
+    async def test_pushes_posts_from_followed_authors(self):
+        response, events = await self._open(authorization=f'Token {self.token.key}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(await anext(events), b'retry: 5000\n\n')
+        self.assertEqual(await anext(events), b': heartbeat\n\n')
+
+        def create_posts():
+            with self.captureOnCommitCallbacks(execute=True):
+                Post.objects.create(author=self.stranger, title='no', content='no')
+                return Post.objects.create(author=self.author, title='yes', content='yes')
+
+        post = await sync_to_async(create_posts)()
+        chunk = await asyncio.wait_for(anext(events), 1)
+        while chunk == b': heartbeat\n\n':
+            chunk = await asyncio.wait_for(anext(events), 1)
+        self.assertTrue(chunk.startswith(f'id: {post.pk}\nevent: post\n'.encode()))
+        await events.aclose()
+
+    async def test_pushes_posts_published_out_of_id_order(self):
+        response, events = await self._open(authorization=f'Token {self.token.key}')
+        await anext(events)
+        first, second = [await Post.objects.acreate(author=self.author, title=str(i), content='x')
+                         for i in range(2)]
+
+        async def next_id():
+            chunk = await asyncio.wait_for(anext(events), 1)
+            while chunk == b': heartbeat\n\n':
+                chunk = await asyncio.wait_for(anext(events), 1)
+            return int(chunk.split(b'\n')[0][4:])
+
+        get_backend().publish(self.author.pk, second.pk, {'id': second.pk})
+        self.assertEqual(await next_id(), second.pk)
+        # The lower id committed later; the stream has already passed it.
+        get_backend().publish(self.author.pk, first.pk, {'id': first.pk})
+        self.assertEqual(await next_id(), first.pk)
+        await events.aclose()
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.post = Post.objects.create(author=self.author, title='Hello', content='x' * 500)
+        Comment.objects.create(post=self.post, author=self.author, content='first')
+        self.client = APIClient()
+
+    def test_default_response_is_unchanged(self):
+        response = self.client.get('/api/posts/')
+        post = response.data['results'][0]
+        self.assertEqual(list(post), ['id', 'author', 'title', 'content', 'images', 'comments', 'created_at', 'updated_at'])
+        self.assertEqual(post['author'], self.author.pk)
+
+    def test_fields_prune_output_and_skip_unused_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/', {'fields': 'id,title'})
+        self.assertEqual(response.data['results'], [{'id': self.post.pk, 'title': 'Hello'}])
+        post_query = queries.captured_queries[-1]['sql']
+        self.assertNotIn('"content"', post_query)
+        self.assertFalse(any('posts_comment' in q['sql'] for q in queries.captured_queries))
+
+    def test_nested_fields_and_expand(self):
+        response = self.client.get('/api/posts/', {
+            'fields': 'id,author,comments.content,comments.author',
+            'expand': 'author,comments.author',
+        })
+        post = response.data['results'][0]
+        self.assertEqual(post['author'], {'id': self.author.pk, 'username': 'author'})
+        self.assertEqual(post['comments'], [
+            {'author': {'id': self.author.pk, 'username': 'author'}, 'content': 'first'}])
+
+    def test_fields_apply_to_comment_list(self):
+        response = self.client.get('/api/comments/', {'fields': 'id,content'})
+        self.assertEqual(list(response.data[0]), ['id', 'content'])
+
+    def test_fields_are_ignored_on_write(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.post('/api/posts/?fields=id', {'title': 'New', 'content': 'body'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['content'], 'body')
+
+
+class FastSerializerParityTests(TestCase):
+    SELECTIONS = [
+        {},
+        {'fields': 'id,title'},
+        {'fields': 'id,author,comments', 'expand': 'author'},
+        {'fields': 'title,comments.content,comments.author', 'expand': 'comments.author'},
+        {'fields': 'comments.id,created_at'},
+        {'fields': 'unknown'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        alice = User.objects.create_user('alice', password='pw')
+        bob = User.objects.create_user('bób', password='pw')
+        for i in range(5):
+            post = Post.objects.create(author=alice if i % 2 else bob, title=f'Post {i}',
+                                       content='línea ' * i)
+            for j in range(i):
+                Comment.objects.create(post=post, author=bob if j % 2 else alice, content=f'c{j}')
+
+    def assertParity(self, params):
+        request = Request(APIRequestFactory().get('/api/posts/', params))
+        spec = SparseSpec.from_request(request)
+        queryset = Post.objects.order_by('-id')
+        expected = PostSerializer(sparse_posts(queryset, spec), many=True, context={'request': request}).data
+        fast = FastPostSerializer(spec)
+        self.assertEqual(json.dumps(fast.serialize(fast.rows(queryset))), json.dumps(expected))
+
+    def test_matches_post_serializer(self):
+        for params in self.SELECTIONS:
+            with self.subTest(**params):
+                self.assertParity(params)
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_matches_post_serializer_in_other_timezone(self):
+        self.assertParity({})
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_list_and_feed_use_single_comment_query(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='bób'))
+        User.objects.get(username='bób').following.add(User.objects.get(username='alice'))
+        # The viewer's hidden-author filter is cached after its first build.
+        build(User.objects.get(username='bób').pk)
+        with self.assertNumQueries(3):
+            list_response = client.get('/api/posts/')
+        self.assertEqual(list_response.data['count'], 5)
+        feed_response = client.get('/api/feed/')
+        self.assertEqual([post['title'] for post in feed_response.data], ['Post 3', 'Post 1'])
+
+
+class StreamingListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='pw')
+        bob = User.objects.create_user('bob', password='pw')
+        cls.alice.following.add(bob)
+        posts = Post.objects.bulk_create(
+            Post(author=bob if i % 2 else cls.alice, title=f'Post {i}', content='x' * 500) for i in range(100))
+        Comment.objects.bulk_create(
+            Comment(post=post, author=cls.alice, content=f'{j}\u2028' + 'y' * 2000)
+            for post in posts for j in range(10))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def peak_memory(self, params):
+        """Peak traced bytes while fetching and reading one post list page."""
+        tracemalloc.start()
+        try:
+            response = self.client.get('/api/posts/', params)
+            for chunk in response.streaming_content if response.streaming else [response.content]:
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_streamed_body_matches_regular_response(self):
+        for url, params in [
+            ('/api/posts/', {'page_size': 100}),
+            ('/api/posts/', {'page': 3, 'page_size': 7, 'search': 'Post'}),
+            ('/api/posts/', {'fields': 'id,comments.content', 'expand': 'comments.author'}),
+            ('/api/posts/', {'fields': 'unknown'}),
+            ('/api/feed/', {}),
+        ]:
+            with self.subTest(url=url, **params):
+                regular = self.client.get(url, params)
+                streamed = self.client.get(url, {**params, 'stream': 1})
+                self.assertTrue(streamed.streaming)
+                # Page links keep the stream parameter.
+                body = b''.join(streamed.streaming_content).replace(b'&stream=1', b'')
+                self.assertEqual(body, regular.content)
+
+    def test_streamed_response_parses_with_envelope(self):
+        response = self.client.get('/api/posts/', {'page_size': 5, 'page': 2, 'stream': 1})
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(list(body), ['count', 'next', 'previous', 'results'])
+        self.assertEqual(body['count'], 100)
+        self.assertEqual(len(body['results']), 5)
+        self.assertEqual(len(body['results'][0]['comments']), 10)
+
+    def test_invalid_page_is_not_found(self):
+        response = self.client.get('/api/posts/', {'page': 999, 'stream': 1})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.streaming)
+
+    def test_peak_memory_does_not_grow_with_page_size(self):
+        self.peak_memory({'page_size': 100})
+        self.peak_memory({'page_size': 100, 'stream': 1})
+        regular = self.peak_memory({'page_size': 100})
+        small = self.peak_memory({'page_size': 20, 'stream': 1})
+        large = self.peak_memory({'page_size': 100, 'stream': 1})
+        # A page of 100 posts with 1000 comments is about 2.5MB of JSON.
+        self.assertLess(large, regular / 5)
+        self.assertLess(large, small * 1.5)
+
+
+@override_settings(COMMENT_WRITES={'MAX_DELAY': 0.05}, OUTBOX={'RELAY': 'inline'})
+class CommentWriteCombiningTests(TransactionTestCase):
+    def setUp(self):
+        comment_writes.reset_comment_queues()
+        self.addCleanup(comment_writes.reset_comment_queues)
+        self.author = User.objects.create(username='author')
+        self.post = Post.objects.create(author=self.author, title='Viral', content='x')
+
+    def create_concurrently(self, count, **fields):
+        results = [None] * count
+        start = threading.Barrier(count)
+
+        def create(index):
+            start.wait()
+            try:
+                results[index] = comment_writes.create_comment(
+                    post=self.post, author=self.author, content=f'c{index}', **fields)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_comments_share_bulk_inserts(self):
+        with mock.patch.object(comment_writes, 'insert_comments', wraps=comment_writes.insert_comments) as insert:
+            comments = self.create_concurrently(20)
+        self.assertLess(insert.call_count, 20)
+        self.assertEqual(len({comment.pk for comment in comments}), 20)
+        stored = dict(Comment.objects.values_list('pk', 'content'))
+        self.assertEqual({comment.pk: comment.content for comment in comments}, stored)
+
+    def test_replies_get_their_thread_position(self):
+        parent = Comment.objects.create(post=self.post, author=self.author, content='parent')
+        replies = self.create_concurrently(3, parent=parent)
+        for reply in Comment.objects.filter(pk__in=[reply.pk for reply in replies]):
+            self.assertEqual((reply.path, reply.depth), (parent.subtree_path, 1))
+
+    def test_a_bad_comment_fails_alone(self):
+        queue = comment_writes.get_comment_queue()
+        good = queue.submit(Comment(post=self.post, author=self.author, content='good'))
+        bad = queue.submit(Comment(post_id=self.post.pk + 1000, author=self.author, content='bad'))
+        self.assertEqual(good.result(5).content, 'good')
+        with self.assertRaises(IntegrityError):
+            bad.result(5)
+        self.assertEqual(list(Comment.objects.values_list('content', flat=True)), ['good'])
+
+    @override_settings(COMMENT_WRITES={'MAX_DELAY': 0, 'TIMEOUT': 0.05})
+    def test_comments_still_queued_at_the_timeout_are_withdrawn(self):
+        taken, release = threading.Event(), threading.Event()
+
+        def slow_insert(comments, using='default'):
+            taken.set()
+            release.wait(5)
+            return Comment.objects.db_manager(using).bulk_create(comments)
+
+        def create_first():
+            try:
+                results.append(comment_writes.create_comment(post=self.post, author=self.author, content='first'))
+            finally:
+                connection.close()
+
+        results = []
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with mock.patch.object(comment_writes, 'insert_comments', slow_insert):
+            first = threading.Thread(target=create_first)
+            first.start()
+            taken.wait(5)
+            # The writer is busy with the first comment, so the second one is still queued.
+            response = client.post('/api/comments/', {'post': self.post.pk, 'content': 'second'})
+            # The first outlives its timeout but is in a batch, so it waits for it.
+            time.sleep(0.1)
+            release.set()
+            first.join()
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+        self.assertEqual([comment.content for comment in results], ['first'])
+        self.assertEqual(list(Comment.objects.values_list('content', flat=True)), ['first'])
+
+    def test_writes_directly_inside_a_transaction(self):
+        with mock.patch.object(comment_writes, 'get_comment_queue') as get_queue, transaction.atomic():
+            comment = comment_writes.create_comment(post=self.post, author=self.author, content='direct')
+        get_queue.assert_not_called()
+        self.assertTrue(Comment.objects.filter(pk=comment.pk).exists())
+
+    def test_api_create_returns_the_new_comment(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.post('/api/comments/', {'post': self.post.pk, 'content': 'hello'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Comment.objects.get(pk=response.data['id']).content, 'hello')
+
+
+class PostBatchTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user('author', password='pw')
+        self.posts = [Post.objects.create(author=author, title=f'Post {i}', content='x') for i in range(3)]
+        Comment.objects.create(post=self.posts[2], author=author, content='hi')
+        self.client = APIClient()
+
+    def test_returns_posts_in_requested_order_in_two_queries(self):
+        ids = [self.posts[2].pk, 12345, self.posts[0].pk, self.posts[2].pk]
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/posts/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['title'] for post in response.data['results']], ['Post 2', 'Post 0'])
+        self.assertEqual(response.data['results'][0]['comments'][0]['content'], 'hi')
+        self.assertEqual(response.data['missing'], [12345])
+
+    def test_honours_sparse_fields(self):
+        response = self.client.get('/api/posts/', {'ids': str(self.posts[1].pk), 'fields': 'title'})
+        self.assertEqual(response.data['results'], [{'title': 'Post 1'}])
+
+    def test_rejects_oversized_batches(self):
+        too_many = ','.join(str(i) for i in range(1, 102))
+        self.assertEqual(self.client.get('/api/posts/', {'ids': too_many}).status_code, 400)
+
+    def test_rejects_ids_outside_the_integer_range(self):
+        response = self.client.get('/api/posts/', {'ids': '99999999999999999999'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ids', response.data)
+
+
+class PostDeletionTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.post = Post.objects.create(author=self.author, title='bye', content='x')
+        for i in range(5):
+            Comment.objects.create(post=self.post, author=self.author, content=str(i))
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    @override_settings(PURGE_IN_BACKGROUND=False)
+    def test_destroy_hides_then_purges(self):
+        self.assertEqual(self.client.delete(f'/api/posts/{self.post.pk}/').status_code, 204)
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_soft_deleted_post_is_hidden_before_purge(self):
+        soft_delete_post(self.post)
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.pk}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/posts/').data['count'], 0)
+        self.assertEqual(self.client.get('/api/comments/').data, [])
+        purge_post(self.post.pk, chunk_size=2)
+        self.assertFalse(Comment.objects.exists())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.old = [Post.objects.create(author=self.author, title=f'old {i}', content='x') for i in range(3)]
+        self.new = Post.objects.create(author=self.author, title='new', content='x')
+        Post.objects.filter(pk__in=[post.pk for post in self.old]).update(
+            created_at=timezone.now() - timedelta(days=400))
+        Comment.objects.create(post=self.old[0], author=self.author, content='old comment')
+        self.client = APIClient()
+
+    def test_archives_old_posts_in_batches(self):
+        batches = []
+        moved = archive_old_posts(days=365, batch_size=2, progress=batches.append)
+        self.assertEqual((moved, batches), (3, [2, 3]))
+        self.assertEqual(list(Post.objects.all()), [self.new])
+        self.assertEqual(ArchivedPost.objects.count(), 3)
+        self.assertEqual(ArchivedComment.objects.get().post_id, self.old[0].pk)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(archive_old_posts(days=365), 0)
+
+    def test_batches_stop_at_comment_limit(self):
+        Comment.objects.bulk_create(Comment(post=self.old[1], author=self.author, content=str(i))
+                                    for i in range(2))
+        batches = []
+        archive_old_posts(days=365, max_comments=2, progress=batches.append)
+        # old[0] and old[1] have 3 comments together; old[1] starts a new batch.
+        self.assertEqual(batches, [1, 3])
+        self.assertEqual(ArchivedComment.objects.count(), 3)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_detail_falls_back_to_archive(self):
+        call_command('archive_posts', days=365, stdout=StringIO())
+        response = self.client.get(f'/api/posts/{self.old[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'old 0')
+        self.assertEqual(response.data['comments'][0]['content'], 'old comment')
+        self.assertEqual(response.data['comments'][0]['post'], self.old[0].pk)
+        self.assertEqual(self.client.get('/api/posts/').data['count'], 1)
+        self.assertEqual(self.client.get('/api/posts/999999/').status_code, 404)
+
+    def test_archived_posts_are_read_only(self):
+        archive_old_posts(days=365)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(f'/api/posts/{self.old[0].pk}/', {'title': 'edit'})
+        self.assertEqual(response.status_code, 404)
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_tracker()
+        self.addCleanup(reset_tracker)
+
+    def test_extract_hashtags(self):
+        self.assertEqual(extract_hashtags('#Django and #python', 'more #django, not a#tag or ##x'),
+                         ['django', 'python'])
+
+    def test_count_min_sketch_never_undercounts(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        exact = {}
+        for i in range(2000):
+            tag = f'tag{i % 97 if i % 3 else 1}'
+            exact[tag] = exact.get(tag, 0) + 1
+            sketch.add(tag)
+        for tag, count in exact.items():
+            self.assertGreaterEqual(sketch.estimate(tag), count)
+        self.assertEqual(sketch.estimate('tag1'), max(exact.values()))
+
+    def test_top_k_keeps_heaviest(self):
+        top = TopK(2)
+        for item, count in [('a', 1), ('b', 5), ('c', 3), ('a', 2), ('a', 9)]:
+            top.offer(item, count)
+        self.assertEqual(top.counts, {'b': 5, 'a': 9})
+
+    @override_settings(TRENDING={'BUCKET_SECONDS': 60, 'BUCKETS': 3, 'DECAY': 0.5, 'TOP_K': 5})
+    def test_older_buckets_decay_and_expire(self):
+        tracker = get_tracker()
+        for _ in range(5):
+            tracker.record(['old'], now=0)
+        for _ in range(3):
+            tracker.record(['new'], now=60)
+        self.assertEqual(tracker.top(now=60), [('new', 3.0), ('old', 2.5)])
+        self.assertEqual(tracker.top(now=180), [('new', 0.75)])
+
+    @override_settings(OUTBOX={'RELAY': 'inline'})
+    def test_posts_feed_the_trending_endpoint(self):
+        author = User.objects.create_user('author', password='pw')
+        with self.captureOnCommitCallbacks(execute=True):
+            for content in ['#django rocks', '#Django #python', '#python', '#django']:
+                Post.objects.create(author=author, title='t', content=content)
+        with self.assertNumQueries(0):
+            response = APIClient().get('/api/trending/', {'limit': 1})
+        self.assertEqual(response.data['results'], [{'tag': 'django', 'score': 3}])
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {'post_create': '2/min', 'search': '1/min'},
+})
+class PostThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_store()
+        self.addCleanup(reset_store)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('author', password='pw'))
+
+    def test_post_create_is_throttled(self):
+        codes = [self.client.post('/api/posts/', {'title': 't', 'content': 'c'}).status_code
+                 for _ in range(3)]
+        self.assertEqual(codes, [201, 201, 429])
+        self.assertEqual(self.client.get('/api/posts/').status_code, 200)
+
+    def test_search_is_throttled(self):
+        self.assertEqual(self.client.get('/api/posts/', {'search': 'a'}).status_code, 200)
+        self.assertEqual(self.client.get('/api/posts/', {'search': 'b'}).status_code, 429)
+        self.assertEqual(self.client.get('/api/posts/').status_code, 200)
+
+
+class PostAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='pw')
+        self.client.force_login(self.admin)
+        self.author = User.objects.create_user('author', password='pw')
+        posts = Post.objects.bulk_create(
+            Post(author=self.author, title=f'{word} {i}', content='c')
+            for i, word in enumerate(['Hello', 'Help', 'hello', 'World'] * 5))
+        Comment.objects.bulk_create(Comment(post=post, author=self.author, content='c') for post in posts)
+
+    def test_changelists_do_not_query_per_row(self):
+        for url in ['/admin/posts/post/', '/admin/posts/comment/', '/admin/accounts/user/']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLess(len(queries), 10, url)
+            self.assertFalse(any('COUNT(*)' in q['sql'] and 'LIMIT' not in q['sql'] for q in queries), url)
+
+    def test_prefix_search_uses_index(self):
+        response = self.client.get('/admin/posts/post/', {'q': 'Hel'})
+        titles = [post.title for post in response.context['cl'].result_list]
+        self.assertEqual(len(titles), 10)
+        self.assertTrue(all(title.startswith('Hel') for title in titles))
+        plan = response.context['cl'].queryset.explain()
+        self.assertIn('title', plan)
+        self.assertIn('INDEX', plan)
+
+    def test_autocomplete(self):
+        response = self.client.get('/admin/autocomplete/', {
+            'term': 'aut', 'app_label': 'posts', 'model_name': 'post', 'field_name': 'author'})
+        self.assertEqual([item['text'] for item in response.json()['results']], ['author'])
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.post = Post.objects.create(author=self.author, title='t', content='c')
+        self.other_post = Post.objects.create(author=self.author, title='other', content='c')
+        self.a = self.reply(None, 'a')
+        self.b = self.reply(None, 'b')
+        self.a1, self.a2, self.a3 = (self.reply(self.a, name) for name in ['a1', 'a2', 'a3'])
+        self.a1x, self.a1y = self.reply(self.a1, 'a1x'), self.reply(self.a1, 'a1y')
+        self.a1x1 = self.reply(self.a1x, 'a1x1')
+
+    def reply(self, parent, content, author=None):
+        return Comment.objects.create(post=self.post, parent=parent, author=author or self.author, content=content)
+
+    def tree(self, results):
+        return [(item['content'], item['reply_count'], self.tree(item['replies'])) for item in results]
+
+    def test_paths_and_depths(self):
+        self.assertEqual((self.a.path, self.a.depth), ('', 0))
+        self.assertEqual(self.a1x1.depth, 3)
+        self.assertTrue(self.a1x1.path.startswith(self.a1x.path))
+        self.assertEqual(self.a1x1.path, self.a1x.subtree_path)
+
+    def test_post_threads_are_bounded(self):
+        # Four for the thread, one for the viewer's hidden authors (not cached per process).
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/posts/{self.post.pk}/comments/', {'depth': 1, 'limit': 2})
+        self.assertEqual(self.tree(response.data['results']), [
+            ('a', 3, [('a1', 2, []), ('a2', 0, [])]),
+            ('b', 0, []),
+        ])
+        self.assertIsNone(response.data['next'])
+
+    def test_levels_are_paginated(self):
+        response = self.client.get(f'/api/posts/{self.post.pk}/comments/', {'limit': 1, 'depth': 0})
+        self.assertEqual([item['content'] for item in response.data['results']], ['a'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['content'] for item in response.data['results']], ['b'])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(f'/api/comments/{self.a.pk}/replies/', {'limit': 2, 'after': self.a1.pk})
+        self.assertEqual(self.tree(response.data['results']), [('a2', 0, []), ('a3', 0, [])])
+
+    def test_comment_replies(self):
+        response = self.client.get(f'/api/comments/{self.a1.pk}/replies/', {'depth': 5})
+        self.assertEqual(self.tree(response.data['results']), [
+            ('a1x', 1, [('a1x1', 0, [])]),
+            ('a1y', 0, []),
+        ])
+
+    def test_subtree_is_one_index_range(self):
+        plan = Comment.objects.filter(
+            post=self.post, path__gte=self.a.subtree_path, path__lt=self.a.subtree_path + '~').explain()
+        self.assertIn('posts_comme_post_id_abd11d_idx', plan)
+
+    def test_hidden_comments_hide_their_replies(self):
+        troll = User.objects.create_user('troll', password='pw')
+        hidden = self.reply(self.a, 'hidden', author=troll)
+        self.reply(hidden, 'under hidden')
+        troll.deleted_at = timezone.now()
+        troll.save()
+        response = self.client.get(f'/api/posts/{self.post.pk}/comments/', {'depth': 1})
+        self.assertEqual(self.tree(response.data['results'])[0][:2], ('a', 3))
+
+    def test_create_reply(self):
+        response = self.client.post('/api/comments/', {'post': self.post.pk, 'parent': self.a1y.pk, 'content': 'new'})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['depth'], 3)
+        self.assertEqual(Comment.objects.get(pk=response.data['id']).path, self.a1y.subtree_path)
+
+    def test_invalid_replies(self):
+        response = self.client.post('/api/comments/', {'post': self.other_post.pk, 'parent': self.a.pk, 'content': 'x'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f'/api/comments/{self.a1.pk}/', {'parent': self.b.pk})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f'/api/comments/{self.a1.pk}/', {'content': 'edited'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.pk}/comments/', {'depth': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/posts/999/comments/').status_code, 404)
+
+    def test_archived_threads(self):
+        archive_old_posts(days=-1)
+        response = self.client.get(f'/api/posts/{self.post.pk}/comments/', {'depth': 1, 'limit': 2})
+        self.assertEqual(self.tree(response.data['results']), [
+            ('a', 3, [('a1', 2, []), ('a2', 0, [])]),
+            ('b', 0, []),
+        ])
+
+
+class PostRevisionTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.post = Post.objects.create(author=self.author, title='v0', content='The first draft.\n\nIt has two lines.')
+
+    def edit(self, **data):
+        response = self.client.patch(f'/api/posts/{self.post.pk}/', data)
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_delta_round_trip(self):
+        rng = random.Random(3)
+        words = ['a', 'b', 'cc', ' ', '\n', 'dd ', '  e']
+        for _ in range(200):
+            old = ''.join(rng.choices(words, k=rng.randint(0, 40)))
+            new = ''.join(rng.choices(words, k=rng.randint(0, 40)))
+            self.assertEqual(apply_delta(new, reverse_delta(new, old)), old)
+
+    def test_every_revision_can_be_rebuilt(self):
+        versions = [('v0', self.post.content)]
+        for i in range(1, SNAPSHOT_EVERY + 5):
+            title = f'v{i}' if i % 3 else versions[-1][0]
+            content = versions[-1][1].replace('draft', f'draft {i}', 1) + f' Added {i}.'
+            self.edit(title=title, content=content)
+            versions.append((title, content))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.revisions.count(), len(versions) - 1)
+        self.assertTrue(self.post.revisions.get(number=SNAPSHOT_EVERY).snapshot)
+        for number, (title, content) in enumerate(versions[:-1], start=1):
+            with self.assertNumQueries(1):
+                revision, rebuilt = reconstruct(self.post, number)
+            self.assertEqual((revision.title, rebuilt), (title, content))
+
+        response = self.client.get(f'/api/posts/{self.post.pk}/revisions/')
+        self.assertEqual(response.data['count'], len(versions) - 1)
+        self.assertEqual(response.data['results'][0]['number'], len(versions) - 1)
+        response = self.client.get(f'/api/posts/{self.post.pk}/revisions/1/')
+        self.assertEqual((response.data['title'], response.data['content']), versions[0])
+        self.assertEqual(response.data['editor'], self.author.pk)
+
+    def test_long_content_is_stored_compactly(self):
+        content = ' '.join(f'Sentence number {i} of a long post.' for i in range(500))
+        self.edit(content=content)
+        self.edit(content=content.replace('number 250 ', 'number two hundred and fifty '))
+        self.post.refresh_from_db()
+        latest = self.post.revisions.get(number=2)
+        self.assertLess(len(latest.delta), 100)
+        self.assertEqual(reconstruct(self.post, 2)[1], content)
+
+    def test_unchanged_updates_add_no_revision(self):
+        self.edit(title='v0')
+        self.assertFalse(self.post.revisions.exists())
+
+    def test_revision_is_written_with_the_update(self):
+        with mock.patch('posts.views.record_revision', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.patch(f'/api/posts/{self.post.pk}/', {'title': 'lost'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.title, 'v0')
+
+    def test_missing_revision(self):
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.pk}/revisions/1/').status_code, 404)
+
+    def test_purge_removes_revisions(self):
+        self.edit(title='v1')
+        soft_delete_post(self.post)
+        purge_post(self.post.pk)
+        self.assertFalse(PostRevision.objects.exists())
+
+
+@override_settings(CACHES=SHARED_CACHES, FEED={'ENGINE': 'merge', 'AUTHOR_LIST_SIZE': 3, 'INBOX_SIZE': 4},
+                   OUTBOX={'RELAY': 'inline'})
+class MergedFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user('reader', password='pw')
+        self.authors = [User.objects.create_user(f'author{i}', password='pw') for i in range(3)]
+        stranger = User.objects.create_user('stranger', password='pw')
+        self.reader.following.add(*self.authors)
+        for i in range(12):
+            Post.objects.create(author=self.authors[i % 3] if i % 4 else stranger, title=f'Post {i}', content='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def expected(self):
+        return list(Post.objects.filter(author__in=self.reader.following.all()).order_by('-created_at', '-id')
+                    .values_list('id', flat=True))
+
+    def read_feed(self, limit):
+        ids, url = [], '/api/feed/'
+        params = {'limit': limit, 'fields': 'id'}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids += [post['id'] for post in response.data['results']]
+            url, params = response.data['next'], None
+        return ids
+
+    def test_pages_match_the_sql_feed_past_the_cached_lists(self):
+        for limit in (1, 2, 5, 100):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.read_feed(limit), self.expected())
+
+    def test_warm_page_reads_posts_without_joining_follows(self):
+        self.read_feed(100)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/feed/', {'limit': 2})
+        self.assertEqual([post['id'] for post in response.data['results']], self.expected()[:2])
+        post_queries = [query['sql'] for query in queries if 'posts_post' in query['sql']]
+        self.assertEqual(len(post_queries), 2)
+        self.assertFalse(any('accounts_user_following' in sql for sql in post_queries))
+
+    def test_new_and_deleted_posts_update_the_cached_lists(self):
+        self.read_feed(100)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.authors[0], title='New', content='x')
+        self.assertEqual(self.read_feed(2)[0], post.pk)
+        soft_delete_post(post)
+        self.assertEqual(self.read_feed(2), self.expected()[1:])
+
+    def test_deleted_posts_are_skipped_without_shortening_the_page(self):
+        self.read_feed(100)
+        newest = self.expected()[0]
+        Post.objects.filter(pk=newest).update(deleted_at=timezone.now())
+        response = self.client.get('/api/feed/', {'limit': 2, 'fields': 'id'})
+        self.assertEqual([post['id'] for post in response.data['results']], self.expected()[1:3])
+
+    def test_rejects_malformed_cursor(self):
+        for cursor in ('x', '-99999999999999999.1', f'0.{2 ** 63}', '1.-1'):
+            self.assertEqual(self.client.get('/api/feed/', {'cursor': cursor}).status_code, 400, cursor)
+
+    def test_hybrid_feed_pushes_to_inboxes_and_pulls_popular_authors(self):
+        for i in range(3):
+            User.objects.create_user(f'fan{i}', password='pw').following.add(self.authors[2])
+        with self.settings(FEED={'ENGINE': 'merge', 'AUTHOR_LIST_SIZE': 3, 'INBOX_SIZE': 4, 'PUSH_BELOW': 2}):
+            self.assertEqual(self.read_feed(2), self.expected())
+            inbox = cache.get(feeds.inbox_key(self.reader.pk))
+            self.assertEqual(inbox['authors'], {self.authors[0].pk, self.authors[1].pk})
+            with self.captureOnCommitCallbacks(execute=True):
+                pushed = Post.objects.create(author=self.authors[1], title='Pushed', content='x')
+                pulled = Post.objects.create(author=self.authors[2], title='Pulled', content='x')
+            inbox = feeds.Source(cache.get(feeds.inbox_key(self.reader.pk))['entries']).entries()
+            self.assertEqual(inbox[0][1], pushed.pk)
+            self.assertNotIn(pulled.pk, [entry[1] for entry in inbox])
+            self.assertEqual(self.read_feed(3), self.expected())
+            self.reader.following.remove(self.authors[1])
+            self.assertEqual(self.read_feed(3), self.expected())
+
+    def test_follow_events_update_the_inbox(self):
+        newcomer = User.objects.create_user('newcomer', password='pw')
+        post = Post.objects.create(author=newcomer, title='Newcomer', content='x')
+        with self.settings(FEED={'ENGINE': 'merge', 'AUTHOR_LIST_SIZE': 3, 'INBOX_SIZE': 4, 'PUSH_BELOW': 5}):
+            self.read_feed(2)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/accounts/follow/{newcomer.pk}/')
+            inbox = cache.get(feeds.inbox_key(self.reader.pk))
+            self.assertIn(newcomer.pk, inbox['authors'])
+            self.assertIn(post.pk, [entry[1] for entry in feeds.Source(inbox['entries']).entries()])
+            self.assertEqual(self.read_feed(3), self.expected())
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/accounts/unfollow/{newcomer.pk}/')
+            inbox = cache.get(feeds.inbox_key(self.reader.pk))
+            self.assertNotIn(newcomer.pk, inbox['authors'])
+            self.assertNotIn(newcomer.pk, [entry[2] for entry in feeds.Source(inbox['entries']).entries()])
+            self.assertEqual(self.read_feed(3), self.expected())
+
+
+@override_settings(CACHES=SHARED_CACHES, FEED={'AUTHOR_LIST_SIZE': 4}, OUTBOX={'RELAY': 'inline'})
+class AuthorPostsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        for i in range(10):
+            Post.objects.create(author=self.author if i % 3 else other, title=f'Post {i}', content='x')
+        self.client = APIClient()
+        self.url = f'/api/accounts/{self.author.pk}/posts/'
+
+    def expected(self):
+        return list(Post.objects.visible().filter(author=self.author).order_by('-created_at', '-id')
+                    .values_list('id', flat=True))
+
+    def read_all(self, limit):
+        ids, url, params = [], self.url, {'limit': limit, 'fields': 'id'}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids += [post['id'] for post in response.data['results']]
+            url, params = response.data['next'], None
+        return ids
+
+    def test_walks_the_cached_list_then_the_index(self):
+        for limit in (1, 3, 100):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.read_all(limit), self.expected())
+
+    def test_rejects_cursors_out_of_range(self):
+        for cursor in ('-99999999999999999.1', '999999999999999999.1', f'0.{2 ** 63}'):
+            self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 400, cursor)
+
+    def test_warm_first_page_is_one_post_query(self):
+        self.read_all(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'limit': 2, 'fields': 'id,title'})
+        self.assertEqual([post['id'] for post in response.data['results']], self.expected()[:2])
+        post_queries = [query['sql'] for query in queries if 'posts_post' in query['sql']]
+        self.assertEqual(len(post_queries), 1)
+        self.assertIn('IN', post_queries[0])
+
+    def test_kept_current_on_create_and_delete(self):
+        self.read_all(100)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.author, title='New', content='x')
+        self.assertEqual(self.read_all(2)[0], post.pk)
+        soft_delete_post(post)
+        self.assertEqual(self.read_all(2), self.expected())
+        self.assertNotIn(post.pk, [entry[1] for entry in feeds.author_lists([self.author.pk])[self.author.pk].entries()])
+
+    def test_archived_posts_leave_the_list(self):
+        self.read_all(100)
+        Post.objects.filter(pk=self.expected()[-1]).update(created_at=timezone.now() - timedelta(days=400))
+        archive_old_posts(days=365)
+        self.assertEqual(self.read_all(100), self.expected())
+
+    def test_per_process_cache_reads_the_index(self):
+        with override_settings(CACHES=LOCAL_CACHES, OUTBOX={'RELAY': 'external'}):
+            self.read_all(100)
+            post = Post.objects.create(author=self.author, title='New', content='x')
+            self.assertEqual(self.read_all(100), self.expected())
+            self.assertEqual(self.expected()[0], post.pk)
+            self.assertIsNone(cache.get(feeds.author_key(self.author.pk)))
+            feeds.check_configuration()
+            with self.settings(FEED={'ENGINE': 'merge'}), self.assertRaises(ImproperlyConfigured):
+                feeds.check_configuration()
+
+    def test_unknown_and_deleted_users_are_404(self):
+        self.assertEqual(self.client.get('/api/accounts/999/posts/').status_code, 404)
+        soft_delete_user(self.author)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(COMPRESSED_TEXT={'ALGORITHM': 'zlib', 'MIN_SIZE': 64})
+class CompressedTextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_store()
+        self.addCleanup(reset_store)
+        reset_dictionaries()
+        self.addCleanup(reset_dictionaries)
+        self.author = User.objects.create_user('author', password='pw')
+        self.long = 'Héllo, wörld! The quick brown fox jumps over the lazy dog. ' * 20
+
+    def stored(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT content FROM posts_post WHERE id = %s', [post.pk])
+            return bytes(cursor.fetchone()[0])
+
+    def test_round_trip(self):
+        for text in ('', 'short', self.long):
+            with self.subTest(length=len(text)):
+                post = Post.objects.create(author=self.author, title='t', content=text)
+                self.assertEqual(Post.objects.get(pk=post.pk).content, text)
+
+    def test_long_text_is_stored_compressed(self):
+        short = Post.objects.create(author=self.author, title='t', content='short')
+        long = Post.objects.create(author=self.author, title='t', content=self.long)
+        self.assertEqual(self.stored(short), b'\x00short')
+        self.assertEqual(self.stored(long)[:1], compression.ZLIB)
+        self.assertLess(len(self.stored(long)), len(self.long.encode()) // 4)
+
+    def test_dictionary_round_trip(self):
+        samples = [f'{self.long} sample {i}' for i in range(20)]
+        CompressionDictionary.objects.create(
+            algorithm='zlib', samples=len(samples), data=compression.train_dictionary(samples, 4096, 'zlib'))
+        reset_dictionaries()
+        text = 'The quick brown fox jumps over the lazy dog, once more. ' * 3
+        post = Post.objects.create(author=self.author, title='t', content=text)
+        self.assertEqual(self.stored(post)[:1], compression.ZLIB_DICT)
+        reset_dictionaries()
+        self.assertEqual(Post.objects.get(pk=post.pk).content, text)
+        with override_settings(COMPRESSED_TEXT={'ALGORITHM': 'zlib', 'MIN_SIZE': 64, 'USE_DICTIONARY': False}):
+            without = compression.compress(text)
+        self.assertLess(len(self.stored(post)), len(without))
+
+    def test_rows_written_as_text_are_read(self):
+        post = Post.objects.create(author=self.author, title='t', content='x')
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE posts_post SET content = %s WHERE id = %s', ['legacy text', post.pk])
+        self.assertEqual(Post.objects.get(pk=post.pk).content, 'legacy text')
+
+    def test_search_uses_the_derived_column(self):
+        match = Post.objects.create(author=self.author, title='t', content=self.long)
+        Post.objects.create(author=self.author, title='t', content='nothing to see here')
+        self.assertEqual(match.content_search.split()[:3], ['héllo', 'wörld', 'the'])
+        client = APIClient()
+        for term in ('WÖRLD', 'lazy dog.', 'quick,brown', 'umps'):
+            with self.subTest(term=term):
+                response = client.get('/api/posts/', {'search': term})
+                self.assertEqual([post['id'] for post in response.data['results']], [match.pk])
+
+    def test_update_fields_keeps_the_search_column_current(self):
+        post = Post.objects.create(author=self.author, title='t', content='first words')
+        post.content = 'second words'
+        post.save(update_fields=['content'])
+        self.assertEqual(Post.objects.get(pk=post.pk).content_search, 'second words')
+        self.assertEqual(Post.objects.filter(content_search__contains='first').count(), 0)
+
+
+def image_file(size=(1000, 600), color=(200, 30, 40), format_='JPEG', exif=None, name='photo.jpg'):
+    buffer = io.BytesIO()
+    picture = PILImage.new('RGB', size, color)
+    if exif is None:
+        picture.save(buffer, format_)
+    else:
+        picture.save(buffer, format_, exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageAttachmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, IMAGES={'WORKERS': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+        self.user = User.objects.create_user('photographer', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, file=None, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = (client or self.client).post('/api/images/', {'image': file or image_file()},
+                                                    format='multipart')
+        self.assertIn(response.status_code, (200, 202), response.data)
+        return response
+
+    def test_upload_is_processed_into_variants(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertIsNone(response.data['src'])
+        data = self.client.get(f'/api/images/{response.data["id"]}/').data
+        self.assertEqual(data['status'], 'ready')
+        self.assertEqual((data['width'], data['height']), (1000, 600))
+        widths = [int(part.split()[1][:-1]) for part in data['srcset'].split(', ')]
+        self.assertEqual(widths, [320, 640, 1000])
+        self.assertTrue(data['src'].endswith('/640.webp'))
+        image = Image.objects.get(pk=data['id'])
+        self.assertEqual(image.variants, [[320, 192], [640, 384], [1000, 600]])
+        with PILImage.open(os.path.join(self.media, images.variant_name(image, 320))) as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (320, 192)))
+
+    def test_duplicates_are_stored_once(self):
+        first = self.upload(image_file(name='a.jpg'))
+        other = User.objects.create_user('other', password='pw')
+        client = APIClient()
+        client.force_authenticate(other)
+        second = self.upload(image_file(name='b.jpg'), client)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(Image.objects.count(), 1)
+        self.assertEqual(set(Image.objects.get().uploaders.all()), {self.user, other})
+        response = client.post('/api/posts/', {'title': 't', 'content': 'c', 'image_ids': [second.data['id']]},
+                               format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_exif_orientation_is_applied(self):
+        exif = PILImage.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        data = self.upload(image_file(size=(400, 200), exif=exif)).data
+        self.assertEqual((data['width'], data['height']), (200, 400))
+        self.assertEqual(Image.objects.get().variants, [[200, 400]])
+
+    def test_not_an_image(self):
+        response = self.client.post('/api/images/', {'image': SimpleUploadedFile('a.jpg', b'not an image')},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Image.objects.exists())
+
+    def test_posts_show_attached_images_in_order(self):
+        ids = [self.upload(image_file(color=(80 * i, 0, 0))).data['id'] for i in range(3)]
+        ids.reverse()
+        response = self.client.post('/api/posts/', {'title': 't', 'content': 'c', 'image_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        post_id = response.data['id']
+        self.assertEqual([image['id'] for image in response.data['images']], ids)
+        detail = self.client.get(f'/api/posts/{post_id}/').data
+        listed = self.client.get('/api/posts/').data['results'][0]
+        streamed = json.loads(b''.join(self.client.get('/api/posts/', {'stream': 1}).streaming_content))
+        self.assertEqual(listed['images'], detail['images'])
+        self.assertEqual(streamed['results'][0]['images'], detail['images'])
+        self.assertNotIn('image_ids', detail)
+        response = self.client.patch(f'/api/posts/{post_id}/', {'image_ids': ids[:1]}, format='json')
+        self.assertEqual([image['id'] for image in response.data['images']], ids[:1])
+
+    def test_only_your_own_uploads_can_be_attached(self):
+        image_id = self.upload().data['id']
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('other', password='pw'))
+        response = other.post('/api/posts/', {'title': 't', 'content': 'c', 'image_ids': [image_id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(other.get(f'/api/images/{image_id}/').status_code, 404)
+        with override_settings(IMAGES={'WORKERS': 0, 'PER_POST': 1}):
+            second = self.upload(image_file(color=(0, 0, 0))).data['id']
+            response = self.client.post('/api/posts/', {'title': 't', 'content': 'c', 'image_ids': [image_id, second]},
+                                        format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_archived_posts_keep_and_purged_posts_lose_images(self):
+        image_id = self.upload().data['id']
+        kept, purged = (self.client.post('/api/posts/', {'title': 't', 'content': 'c', 'image_ids': [image_id]},
+                                         format='json').data['id'] for _ in range(2))
+        Post.objects.filter(pk=kept).update(created_at=timezone.now() - timedelta(days=400))
+        archive_old_posts(days=365)
+        self.assertEqual([image['id'] for image in self.client.get(f'/api/posts/{kept}/').data['images']],
+                         [image_id])
+        soft_delete_post(Post.objects.get(pk=purged))
+        purge_post(purged)
+        self.assertEqual(list(Attachment.objects.values_list('post_id', flat=True)), [kept])
+
+    def test_blurhash_of_a_plain_image(self):
+        value = images.blurhash(PILImage.new('RGB', (64, 48), (200, 30, 40)))
+        self.assertEqual(len(value), 6 + 2 * 11)
+        dc = 0
+        for char in value[2:6]:
+            dc = dc * 83 + images._BASE83.index(char)
+        self.assertEqual((dc >> 16, dc >> 8 & 255, dc & 255), (200, 30, 40))
+
+
+@override_settings(CACHE_WARMUP={'CONCURRENCY': 0, 'BATCH_SIZE': 2}, FEED={'ENGINE': 'merge'},
+                   CACHES=SHARED_CACHES, REST_FRAMEWORK={
+                       **settings.REST_FRAMEWORK,
+                       'DEFAULT_AUTHENTICATION_CLASSES': ['accounts.authentication.CachedTokenAuthentication']})
+class CacheWarmupTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.users = [User.objects.create_user(f'user{i}', password='pw') for i in range(4)]
+        for user in self.users:
+            user.following.set(other for other in self.users if other != user)
+            Post.objects.create(author=user, title=user.username, content='x')
+        User.objects.filter(pk__in=[user.pk for user in self.users[:3]]).update(last_login=now)
+        User.objects.filter(pk=self.users[3].pk).update(last_login=now - timedelta(days=30))
+        self.tokens = [Token.objects.get_or_create(user=user)[0] for user in self.users]
+        cache.clear()
+
+    def test_warm_up_fills_the_caches_of_active_users(self):
+        result = warmup.warm()
+        self.assertEqual((result['users'], result['authors']), (3, 4))
+        artifacts = result['artifacts']
+        self.assertEqual(set(artifacts), {'follow sets', 'tokens', 'hidden filters', 'feeds', 'popular authors'})
+        self.assertTrue(all(stats['hit_ratio'] == 1.0 for stats in artifacts.values()))
+        self.assertEqual(artifacts['tokens']['entries'], 6)
+        self.assertIsNotNone(cache.get(graph.following_key(self.users[0].pk)))
+        self.assertIsNotNone(cache.get(filter_key(self.users[0].pk)))
+        self.assertIsNone(cache.get(graph.following_key(self.users[3].pk)))
+        self.assertIsNone(cache.get(authentication.token_key(self.tokens[3].key)))
+        with self.assertNumQueries(0):
+            authentication.CachedTokenAuthentication().authenticate_credentials(self.tokens[0].key)
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        with self.assertNumQueries(1):
+            response = client.get('/api/feed/', {'limit': 3, 'fields': 'id,title'})
+        self.assertEqual([post['title'] for post in response.data['results']], ['user3', 'user2', 'user1'])
+
+    def test_per_process_caches_are_not_warmed(self):
+        with override_settings(CACHES=LOCAL_CACHES, FEED={'ENGINE': 'sql'}, REST_FRAMEWORK={
+                **settings.REST_FRAMEWORK,
+                'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.TokenAuthentication']}):
+            result = warmup.warm()
+        self.assertEqual(result['artifacts'], {})
+        self.assertEqual(result['authors'], 0)
+
+    def test_hit_ratio_counts_entries_evicted_during_the_warm_up(self):
+        real_get_many = cache.get_many
+        with mock.patch.object(cache, 'get_many', lambda keys: dict(list(real_get_many(keys).items())[1:])):
+            result = warmup.warm()
+        self.assertLess(result['artifacts']['follow sets']['hit_ratio'], 1.0)
+
+    def test_startup_hook_only_runs_when_enabled(self):
+        self.assertIsNone(warmup.warm_on_startup())
+        with override_settings(CACHE_WARMUP={'ON_STARTUP': True, 'CONCURRENCY': 0}), \
+                mock.patch.object(warmup, 'warm', return_value={'seconds': 0, 'users': 0, 'authors': 0,
+                                                                'artifacts': {}}) as warm:
+            warmup.warm_on_startup().join()
+        warm.assert_called_once_with()
+
+    def test_command_reports_duration_and_hit_ratios(self):
+        out = StringIO()
+        call_command('warm_caches', users=2, concurrency=0, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertRegex(lines[0], r'^Warmed 2 active users and 4 popular authors in [0-9.]+s$')
+        self.assertTrue(all(line.endswith('100.0%') for line in lines[2:]))
+        self.assertEqual(len(lines), 7)
+
+    def test_command_refuses_a_per_process_cache(self):
+        with override_settings(CACHES=LOCAL_CACHES, REST_FRAMEWORK={
+                **settings.REST_FRAMEWORK,
+                'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.TokenAuthentication']}), \
+                self.assertRaisesMessage(CommandError, 'shared cache'):
+            call_command('warm_caches', concurrency=0, stdout=StringIO())
@@ -0,0 +1,77 @@
+"""
+Comment threads with bounded depth and per-level pagination.
+
+A page is up to ``limit`` replies to one parent (a comment, or the post for
+top-level comments), in id order. Their subtrees share the parent's path
+prefix and, because path segments are fixed width, lie in one contiguous
+range of the ``(post, path)`` index: from ``prefix + segment(first)`` to
+``prefix + segment(last) + '~'``. A single query over that range, cut off
+``depth`` levels down and ranked per parent with ``ROW_NUMBER()``, loads the
+first ``limit`` replies of every comment in those subtrees. Clients page
+through the rest of any level with ``after``.
+
+Replies under a comment hidden by ``visible()`` are left out with it.
+"""
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from .models import path_segment
+
+DEFAULT_DEPTH = 2
+MAX_DEPTH = 5
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Upper bound on comments returned in one response, whatever depth and limit.
+MAX_NODES = 500
+# Sorts after every character used in a path.
+PATH_END = '~'
+
+
+def subtree_path(comment):
+    return comment.path + path_segment(comment.pk)
+
+
+def load_replies(comments, parent=None, after=None, depth=DEFAULT_DEPTH, limit=DEFAULT_LIMIT):
+    """
+    Return ``(page, has_more)`` for the replies to ``parent`` (top-level
+    comments when ``None``) among ``comments``, a queryset already narrowed
+    to one post. Every returned comment gets ``thread_replies``, its first
+    ``limit`` replies down to ``depth`` levels below the page, and
+    ``reply_count``, how many visible replies it has in all.
+    """
+    prefix = '' if parent is None else subtree_path(parent)
+    page = comments.filter(path=prefix)
+    if after is not None:
+        page = page.filter(pk__gt=after)
+    page = list(page.order_by('pk')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    if not page:
+        return [], False
+    nodes = {}
+    for comment in page:
+        comment.thread_replies, comment.reply_count = [], 0
+        nodes[comment.pk] = comment
+    if depth > 0:
+        descendants = comments.filter(
+            path__gte=prefix + path_segment(page[0].pk),
+            path__lt=prefix + path_segment(page[-1].pk) + PATH_END,
+            depth__lte=page[0].depth + depth,
+        ).annotate(
+            rank=Window(RowNumber(), partition_by=F('parent_id'), order_by=F('pk').asc()),
+            siblings=Window(Count('pk'), partition_by=F('parent_id')),
+        ).filter(rank__lte=limit).order_by('depth', 'pk')
+        for comment in descendants[:MAX_NODES - len(page)]:
+            parent_node = nodes.get(comment.parent_id)
+            if parent_node is None:
+                continue
+            comment.thread_replies, comment.reply_count = [], 0
+            parent_node.thread_replies.append(comment)
+            parent_node.reply_count = comment.siblings
+            nodes[comment.pk] = comment
+    # Comments whose replies were not loaded (too deep, or past MAX_NODES).
+    unexpanded = [pk for pk, comment in nodes.items() if not comment.thread_replies]
+    counts = comments.filter(parent_id__in=unexpanded).values('parent_id').annotate(total=Count('pk'))
+    for row in counts:
+        nodes[row['parent_id']].reply_count = row['total']
+    return page, has_more
@@ -0,0 +1,184 @@
+"""
+Trending hashtags from a time-bucketed count-min sketch.
+
+Every new post's hashtags are added to the sketch of the current time
+bucket, and a bounded min-heap per bucket remembers the heaviest tags seen
+in it. ``top()`` only looks at those candidates across the window, weighting
+older buckets by ``DECAY ** age``, so answering never touches the posts
+table and costs the same however many posts there are.
+
+Bucket state lives in the ``CACHE`` alias, and a post is counted by the
+process whose outbox relay delivers its ``post.created`` event. With a
+per-process cache such as ``LocMemCache`` (the default) each process
+therefore ranks only the posts its own relay counted, and with
+``OUTBOX['RELAY'] = 'external'`` the web processes see no counts at all;
+site-wide trends need a shared cache. Updates are serialized with a
+process-local lock, so on a shared cache concurrent writers in other
+processes can lose an occasional increment, which the sketch's error bound
+already tolerates.
+"""
+import hashlib
+import heapq
+import re
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import caches
+
+HASHTAG_RE = re.compile(r'(?<![\w#])#(\w{1,100})')
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'WIDTH': 2048,
+    'DEPTH': 4,
+    'TOP_K': 50,
+    'BUCKET_SECONDS': 300,
+    'BUCKETS': 12,
+    'DECAY': 0.8,
+}
+
+
+def extract_hashtags(*texts):
+    """Lowercased, de-duplicated hashtags in the order they first appear."""
+    tags = {}
+    for text in texts:
+        for tag in HASHTAG_RE.findall(text or ''):
+            tags.setdefault(tag.lower(), None)
+    return list(tags)
+
+
+class CountMinSketch:
+    """Count-min sketch with conservative update over a flat ``array('I')``."""
+
+    def __init__(self, width, depth, counters=None):
+        self.width = width
+        self.depth = depth
+        self.counters = counters if counters is not None else array('I', bytes(4 * width * depth))
+
+    def _cells(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, item, count=1):
+        """Add ``count`` occurrences and return the new estimate."""
+        cells = self._cells(item)
+        counters = self.counters
+        estimate = min(counters[cell] for cell in cells) + count
+        for cell in cells:
+            if counters[cell] < estimate:
+                counters[cell] = estimate
+        return estimate
+
+    def estimate(self, item):
+        counters = self.counters
+        return min(counters[cell] for cell in self._cells(item))
+
+    def nbytes(self):
+        return self.counters.itemsize * len(self.counters)
+
+
+class TopK:
+    """The ``k`` heaviest items, kept in a min-heap with lazy invalidation."""
+
+    def __init__(self, k, counts=None):
+        self.k = k
+        self.counts = dict(counts or {})
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def offer(self, item, count):
+        counts = self.counts
+        if item in counts:
+            counts[item] = count
+            heapq.heappush(self.heap, (count, item))
+        elif len(counts) < self.k:
+            counts[item] = count
+            heapq.heappush(self.heap, (count, item))
+        else:
+            smallest, weakest = self._min()
+            if count <= smallest:
+                return
+            heapq.heappop(self.heap)
+            del counts[weakest]
+            counts[item] = count
+            heapq.heappush(self.heap, (count, item))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(count, item) for item, count in counts.items()]
+            heapq.heapify(self.heap)
+
+    def _min(self):
+        heap, counts = self.heap, self.counts
+        # Drop entries superseded by a later offer() for the same item.
+        while counts.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+
+class TrendingTracker:
+    def __init__(self, **config):
+        self.config = {**DEFAULTS, **config}
+        self.cache = caches[self.config['CACHE']]
+        self.lock = threading.Lock()
+
+    def _bucket(self, now):
+        return int(now // self.config['BUCKET_SECONDS'])
+
+    def _key(self, bucket):
+        return f'trending:{bucket}'
+
+    def _load(self, state):
+        config = self.config
+        if state is None:
+            return CountMinSketch(config['WIDTH'], config['DEPTH']), TopK(config['TOP_K'])
+        counters = array('I')
+        counters.frombytes(state['sketch'])
+        return CountMinSketch(config['WIDTH'], config['DEPTH'], counters), TopK(config['TOP_K'], state['top'])
+
+    def record(self, tags, now=None):
+        if not tags:
+            return
+        bucket = self._bucket(time.time() if now is None else now)
+        key = self._key(bucket)
+        with self.lock:
+            sketch, top = self._load(self.cache.get(key))
+            for tag in tags:
+                top.offer(tag, sketch.add(tag))
+            timeout = self.config['BUCKET_SECONDS'] * (self.config['BUCKETS'] + 1)
+            self.cache.set(key, {'sketch': sketch.counters.tobytes(), 'top': top.counts}, timeout)
+
+    def top(self, limit=10, now=None):
+        """``[(tag, score), ...]`` for the window ending at ``now``, best first."""
+        current = self._bucket(time.time() if now is None else now)
+        buckets = [current - age for age in range(self.config['BUCKETS'])]
+        states = self.cache.get_many([self._key(bucket) for bucket in buckets])
+        loaded = []
+        for age, bucket in enumerate(buckets):
+            state = states.get(self._key(bucket))
+            if state is not None:
+                loaded.append((self.config['DECAY'] ** age, *self._load(state)))
+        candidates = {tag for _, _, top in loaded for tag in top.counts}
+        scores = {
+            tag: sum(weight * sketch.estimate(tag) for weight, sketch, _ in loaded)
+            for tag in candidates
+        }
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+_tracker = None
+
+
+def get_tracker():
+    global _tracker
+    if _tracker is None:
+        _tracker = TrendingTracker(**getattr(settings, 'TRENDING', {}))
+    return _tracker
+
+
+def reset_tracker():
+    global _tracker
+    _tracker = None
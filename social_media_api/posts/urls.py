@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import PostViewSet, CommentViewSet
-from .views import FeedView
+from .views import FeedView, ImageDetailView, ImageUploadView, TrendingView, feed_stream
 
 router = DefaultRouter()
 router.register('posts', PostViewSet)
@@ -10,4 +10,8 @@ router.register('comments', CommentViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('feed/', FeedView.as_view(), name='feed'),
+    path('feed/stream/', feed_stream, name='feed-stream'),
+    path('images/', ImageUploadView.as_view(), name='image-upload'),
+    path('images/<int:image_id>/', ImageDetailView.as_view(), name='image-detail'),
+    path('trending/', TrendingView.as_view(), name='trending'),
 ]
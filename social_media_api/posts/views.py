@@ -1,16 +1,160 @@
-from django.shortcuts import render
+import asyncio
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Max, Prefetch
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from rest_framework.authtoken.models import Token
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
-from .models import Post, Comment
-from .serializers import PostSerializer, CommentSerializer
+from .models import ArchivedComment, ArchivedPost, Image, Post, Comment, PostRevision
+from .serializers import PostSerializer, CommentSerializer, SparseSpec, ThreadCommentSerializer
+from .serializers import PostRevisionSerializer
 from rest_framework.pagination import PageNumberPagination
 from rest_framework import filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import generics
 from rest_framework import permissions
+from accounts.blocking import get_hidden_authors
+from accounts.graph import following_ids
+from . import feeds
+from .comment_writes import create_comment
+from .compression import search_words
+from .fast_serializers import FastPostSerializer
+from .images import accept_upload, image_data
+from social_media_api.batch import in_requested_order, parse_ids
+from social_media_api.throttling import PostCreateThrottle, SearchThrottle
+from rest_framework.settings import api_settings
+from .purge import purge_post, run_in_background, soft_delete_post
+from .revisions import reconstruct, record_revision
+from .streaming import can_stream, stream_list, wants_stream
+from .threads import DEFAULT_DEPTH, DEFAULT_LIMIT, MAX_DEPTH, MAX_LIMIT, load_replies
+from .trending import get_tracker
+from .pubsub import DEFAULT_HEARTBEAT, Subscription, get_backend
+
+User = get_user_model()
+
+# Model columns behind the serializer fields, for narrowing querysets with .only()
+POST_COLUMNS = ('author', 'title', 'content', 'created_at', 'updated_at')
+COMMENT_COLUMNS = ('post', 'parent', 'depth', 'author', 'content', 'created_at', 'updated_at')
+
+
+def _narrow(queryset, spec, columns, required=()):
+    expand_author = spec.expands('author') and spec.wants('author')
+    if expand_author:
+        queryset = queryset.select_related('author')
+    if spec.fields is None:
+        return queryset
+    only = ['id', *required, *(name for name in columns if name in spec.fields)]
+    if expand_author:
+        only += ['author__id', 'author__username']
+    return queryset.only(*only)
+
+
+def sparse_comments(queryset, spec, required=()):
+    # The author is always needed to leave out hidden authors' comments.
+    return _narrow(queryset, spec, COMMENT_COLUMNS, ('author', *required))
+
+
+def sparse_posts(queryset, spec):
+    """
+    Fetch only the columns and relations a ``?fields=``/``?expand=`` request
+    will serialize; comments are prefetched only when they are wanted.
+    """
+    queryset = _narrow(queryset, spec, POST_COLUMNS, ('image_count',) if spec.wants('images') else ())
+    if spec.wants('comments'):
+        comments = sparse_comments(Comment.objects.visible(), spec.child('comments'), required=('post',))
+        queryset = queryset.prefetch_related(Prefetch('comments', queryset=comments))
+    return queryset
+
 
 # Create your views here.
+class FastListMixin:
+    """
+    Renders list responses with ``FastPostSerializer`` instead of building a
+    ``PostSerializer`` per row; output is identical. ``?stream=1`` sends the
+    same bytes as a streamed response.
+    """
+
+    def list(self, request, *args, **kwargs):
+        serializer = FastPostSerializer.for_request(request)
+        rows = serializer.rows(self.filter_queryset(self.get_queryset()))
+        if wants_stream(request) and can_stream(self.paginator):
+            return stream_list(self, request, serializer, rows)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(rows))
+
+def _bounded_int(params, name, default, low, high):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ValidationError({name: 'A valid integer is required.'})
+    if not low <= value <= high:
+        raise ValidationError({name: f'Must be between {low} and {high}.'})
+    return value
+
+
+def thread_response(request, comments, parent=None):
+    """
+    One page of replies to ``parent`` (top-level comments when ``None``) as
+    threads, for ``?depth=``, ``?limit=`` and the ``?after=`` cursor.
+    """
+    params = request.query_params
+    depth = _bounded_int(params, 'depth', DEFAULT_DEPTH, 0, MAX_DEPTH)
+    limit = _bounded_int(params, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+    after = _bounded_int(params, 'after', 0, 0, 2 ** 63 - 1) or None
+    page, has_more = load_replies(comments, parent, after, depth, limit)
+    next_url = None
+    if has_more:
+        next_url = replace_query_param(request.build_absolute_uri(), 'after', page[-1].pk)
+    serializer = ThreadCommentSerializer(page, many=True, context={'request': request})
+    return Response({'next': next_url, 'results': serializer.data})
+
+def _feed_page_params(request):
+    params = request.query_params
+    limit = _bounded_int(params, 'limit', PostPagination.page_size, 1, PostPagination.max_page_size)
+    try:
+        cursor = feeds.decode_cursor(params['cursor']) if params.get('cursor') else None
+    except ValueError:
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    return limit, cursor
+
+
+def entry_page(request, entries, serializer, limit):
+    """
+    The first ``limit`` posts of ``entries`` (``posts.feeds`` entries),
+    hydrated with one ``id__in`` query per batch, with a ``next`` link
+    holding the cursor.
+    """
+    rows, last = [], None
+    # Posts deleted since they were listed drop out when hydrated, so keep
+    # reading entries until the page is full.
+    while len(rows) < limit:
+        batch = list(islice(entries, limit - len(rows)))
+        if not batch:
+            break
+        ids = [entry[1] for entry in batch]
+        found, _ = in_requested_order(
+            serializer.rows(Post.objects.visible().filter(id__in=ids)), ids, key=lambda row: row['id'])
+        rows += found
+        last = batch[-1][:2]
+    next_url = None
+    if len(rows) == limit:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', feeds.encode_cursor(last))
+    return Response({'next': next_url, 'results': serializer.serialize(rows)})
+
 class IsAuthorOrReadOnly(IsAuthenticatedOrReadOnly):
     def has_object_permission(self, request, view, obj):
         if request.method in ['GET', 'HEAD', 'OPTIONS']:
@@ -22,29 +166,306 @@ class PostPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all()
+class WordSearchFilter(filters.SearchFilter):
+    """Searches for the words of each term, as ``content_search`` holds words only."""
+
+    def get_search_terms(self, request):
+        return search_words(' '.join(super().get_search_terms(request)))
+
+class PostViewSet(FastListMixin, viewsets.ModelViewSet):
+    queryset = Post.objects.visible()
     serializer_class = PostSerializer
     permission_classes = [IsAuthorOrReadOnly]
     pagination_class = PostPagination
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['title', 'content']
+    filter_backends = [WordSearchFilter]
+    # content is stored compressed; content_search holds its words in plain text.
+    search_fields = ['title', 'content_search']
+
+    def get_throttles(self):
+        throttles = super().get_throttles()
+        if self.action == 'create':
+            throttles.append(PostCreateThrottle())
+        elif self.action == 'list' and self.request.query_params.get(api_settings.SEARCH_PARAM):
+            throttles.append(SearchThrottle())
+        return throttles
+
+    def list(self, request, *args, **kwargs):
+        if 'ids' in request.query_params:
+            return self.batch(request)
+        return super().list(request, *args, **kwargs)
+
+    def batch(self, request):
+        """
+        ``GET /api/posts/?ids=3,1,2``: the requested posts in the requested
+        order, hydrated with one post query and one comment query, plus the
+        ids that do not exist.
+        """
+        ids = parse_ids(request.query_params['ids'])
+        serializer = FastPostSerializer.for_request(request)
+        rows = serializer.rows(self.get_queryset().filter(id__in=ids))
+        rows, missing = in_requested_order(rows, ids, key=lambda row: row['id'])
+        return Response({'results': serializer.serialize(rows), 'missing': missing})
+
+    def get_queryset(self):
+        return sparse_posts(super().get_queryset(), SparseSpec.from_request(self.request))
+
+    def get_object(self):
+        if self.request.method not in permissions.SAFE_METHODS:
+            return super().get_object()
+        # Archived posts are read-only and only reachable by id.
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            post = self.get_queryset().get_with_archive(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (ObjectDoesNotExist, ValueError):
+            raise Http404
+        self.check_object_permissions(self.request, post)
+        return post
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        # The post and its outbox event (see posts.signals) commit together.
+        with transaction.atomic():
+            serializer.save(author=self.request.user)
+
+    def perform_update(self, serializer):
+        # Read the stored version under the write lock so concurrent edits
+        # each diff against the version they replace.
+        with transaction.atomic():
+            old_title, old_content = Post.objects.select_for_update().values_list(
+                'title', 'content').get(pk=serializer.instance.pk)
+            post = serializer.save()
+            if (post.title, post.content) != (old_title, old_content):
+                record_revision(post, old_title, old_content, self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def revisions(self, request, pk=None):
+        """``GET /api/posts/<id>/revisions/``: earlier versions, newest first."""
+        post = get_object_or_404(Post.objects.visible(), pk=pk)
+        revisions = post.revisions.defer('delta').order_by('-number')
+        page = self.paginate_queryset(revisions)
+        return self.get_paginated_response(PostRevisionSerializer(page, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path=r'revisions/(?P<number>[0-9]+)')
+    def revision(self, request, pk=None, number=None):
+        """``GET /api/posts/<id>/revisions/<number>/``: the post as it was at that revision."""
+        post = get_object_or_404(Post.objects.visible(), pk=pk)
+        try:
+            revision, content = reconstruct(post, int(number))
+        except PostRevision.DoesNotExist:
+            raise Http404
+        return Response({**PostRevisionSerializer(revision).data, 'content': content})
+
+    @action(detail=True, methods=['get'])
+    def comments(self, request, pk=None):
+        """``GET /api/posts/<id>/comments/``: top-level comments with their reply threads."""
+        try:
+            if Post.objects.visible().filter(pk=pk).exists():
+                comments = Comment.objects.visible()
+            elif ArchivedPost.objects.visible().filter(pk=pk).exists():
+                comments = ArchivedComment.objects.visible()
+            else:
+                raise Http404
+        except ValueError:
+            raise Http404
+        return thread_response(request, comments.filter(post_id=pk))
+
+    def perform_destroy(self, instance):
+        soft_delete_post(instance)
+        run_in_background(purge_post, instance.pk)
 
 class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all()
+    queryset = Comment.objects.visible()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthorOrReadOnly]
 
+    def get_queryset(self):
+        return sparse_comments(super().get_queryset(), SparseSpec.from_request(self.request))
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        # Concurrent creates share one INSERT; see posts.comment_writes.
+        serializer.instance = create_comment(author=self.request.user, **serializer.validated_data)
+
+    @action(detail=True, methods=['get'])
+    def replies(self, request, pk=None):
+        """``GET /api/comments/<id>/replies/``: replies to a comment with their threads."""
+        comment = self.get_object()
+        return thread_response(request, Comment.objects.visible().filter(post_id=comment.post_id), comment)
 
-class FeedView(generics.ListAPIView):
+class FeedView(FastListMixin, generics.ListAPIView):
+    """
+    Posts by the users you follow, newest first. With ``FEED['ENGINE'] =
+    'merge'`` the feed is merged from cached per-author lists (see
+    ``posts.feeds``) and paged with ``?limit=`` and a ``?cursor=``.
+    """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = PostSerializer
 
+    def list(self, request, *args, **kwargs):
+        if feeds.get_config()['ENGINE'] != 'merge':
+            return super().list(request, *args, **kwargs)
+        limit, cursor = _feed_page_params(request)
+        serializer = FastPostSerializer.for_request(request)
+        return entry_page(request, feeds.feed_entries(request.user, cursor, serializer.hidden), serializer, limit)
+
     def get_queryset(self):
-        following_users = self.request.user.following.all()
-        return Post.objects.filter(author__in=following_users).order_by('-created_at')
+        user = self.request.user
+        following_users = user.following.all()
+        queryset = Post.objects.visible().filter(author__in=following_users).order_by('-created_at')
+        # Blocks end follows, so only muted followees can be hidden here; the
+        # Bloom filter rules out the rest without touching the feed query.
+        hidden = get_hidden_authors(user)
+        if hidden:
+            muted = hidden.hidden(following_ids(user.pk))
+            if muted:
+                queryset = queryset.exclude(author__in=muted)
+        return sparse_posts(queryset, SparseSpec.from_request(self.request))
+
+class AuthorPostsView(APIView):
+    """
+    ``GET /api/accounts/<id>/posts/``: one user's posts, newest first, read
+    from their cached list of recent posts (see ``posts.feeds``) and from
+    the ``(author, created_at, id)`` index past its end. Paged with
+    ``?limit=`` and a ``?cursor=``.
+    """
+
+    def get(self, request, user_id):
+        if not User.objects.filter(pk=user_id, deleted_at__isnull=True).exists():
+            raise Http404
+        limit, cursor = _feed_page_params(request)
+        serializer = FastPostSerializer.for_request(request)
+        return entry_page(request, feeds.author_entries(user_id, cursor), serializer, limit)
+
+class ImageUploadView(APIView):
+    """
+    ``POST /api/images/`` with an ``image`` file: 202 with the pending image,
+    or 200 with the existing one when the same file was uploaded before.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        upload = request.FILES.get('image')
+        if upload is None:
+            raise ValidationError({'image': 'An image file is required.'})
+        image, created = accept_upload(request.user, upload)
+        return Response(image_data(image), status=202 if created else 200)
+
+class ImageDetailView(APIView):
+    """``GET /api/images/<id>/``: an image the user uploaded, to poll until it is ready."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, image_id):
+        return Response(image_data(get_object_or_404(Image, pk=image_id, uploaders=request.user)))
+
+class TrendingView(APIView):
+    """
+    Top hashtags over the last ``BUCKETS * BUCKET_SECONDS`` seconds, read
+    from the count-min sketch in the cache rather than the posts table.
+    """
+
+    def get(self, request):
+        tracker = get_tracker()
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 10
+        limit = max(1, min(limit, tracker.config['TOP_K']))
+        return Response({
+            'window_seconds': tracker.config['BUCKETS'] * tracker.config['BUCKET_SECONDS'],
+            'results': [{'tag': tag, 'score': round(score, 2)} for tag, score in tracker.top(limit)],
+        })
+
+
+async def _stream_user(request):
+    header = request.headers.get('Authorization', '').split()
+    if len(header) == 2 and header[0].lower() == 'token':
+        key = header[1]
+    else:
+        # EventSource cannot set headers, so browsers pass the token in the URL.
+        key = request.GET.get('token')
+    if key:
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            return None
+        return token.user if token.user.is_active else None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def _sse(event_id, data):
+    return f'id: {event_id}\nevent: post\ndata: {json.dumps(data)}\n\n'
+
+
+async def _missed_posts(following, cursor, limit):
+    rows = Post.objects.visible().filter(author_id__in=following, id__gt=cursor).order_by('id')
+    return [(post_id, {'id': post_id, 'author': author_id})
+            async for post_id, author_id in rows.values_list('id', 'author_id')[:limit]]
+
+
+async def _feed_events(following, cursor):
+    backend = get_backend()
+    heartbeat = getattr(settings, 'FEED_STREAM_HEARTBEAT', DEFAULT_HEARTBEAT)
+    subscription = Subscription(following, backend.last_sequence())
+    backend.subscribe(subscription)
+    # ``resume`` is the post id to catch up after from the database: the
+    # client's Last-Event-ID, or the newest post sent when the history
+    # overflowed. The history can repeat the posts of the last catch-up.
+    resume, newest, caught_up = cursor, cursor, set()
+    try:
+        yield 'retry: 5000\n\n'
+        if newest is None:
+            newest = (await Post.objects.aaggregate(newest=Max('id')))['newest'] or 0
+        while True:
+            subscription.clear()
+            if resume is not None:
+                subscription.cursor = backend.last_sequence()
+                rows = await _missed_posts(following, resume, 100)
+                caught_up = {post_id for post_id, _ in rows}
+                for post_id, data in rows:
+                    newest = max(newest, post_id)
+                    yield _sse(post_id, data)
+                resume = rows[-1][0] if len(rows) == 100 else None
+                continue
+            events = backend.since(subscription.cursor, subscription.channels)
+            if events is None:
+                resume = newest
+                continue
+            for sequence, post_id, data in events:
+                subscription.cursor = sequence
+                if post_id in caught_up:
+                    continue
+                newest = max(newest, post_id)
+                yield _sse(post_id, data)
+            if events:
+                continue
+            try:
+                await subscription.wait(heartbeat)
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+    finally:
+        backend.unsubscribe(subscription)
+
+
+async def feed_stream(request):
+    """
+    Server-Sent Events stream of new post ids from the authors the user follows.
+
+    Send ``Last-Event-ID`` (or ``?last_event_id=``) to resume after a
+    disconnect. Comment lines are sent as heartbeats while idle.
+    """
+    user = await _stream_user(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    following = set(await sync_to_async(following_ids)(user.pk))
+    hidden = await sync_to_async(get_hidden_authors)(user)
+    if hidden:
+        following -= await sync_to_async(hidden.hidden)(following)
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        cursor = int(cursor) if cursor is not None else None
+    except ValueError:
+        cursor = None
+    response = StreamingHttpResponse(_feed_events(following, cursor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,69 @@
+"""
+Admin changelist settings for tables too big to count or scan.
+
+* ``EstimatedCountPaginator`` takes the row count of an unfiltered changelist
+  from the database's own estimate and counts at most ``max_count`` rows of
+  a filtered one.
+* ``LargeTableAdminMixin`` uses it, turns off the second "N total" count and
+  runs ``^field`` search fields as a range on the column
+  (``field >= term AND field < term || U+10FFFF``), which an ordinary index
+  can answer. ``LIKE 'term%'`` cannot use one on SQLite.
+
+Prefix search is therefore case-sensitive.
+"""
+from django.contrib.admin.utils import lookup_spawns_duplicates
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+def estimate_rows(model, using='default'):
+    """The database's idea of how many rows ``model``'s table has, or ``None``."""
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # The rowid b-tree answers MAX() from its last page.
+            cursor.execute(f'SELECT MAX(_rowid_) FROM {table}')
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.max_count:
+                return estimate
+        return queryset.order_by()[:self.max_count].count()
+
+
+class LargeTableAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        fields = self.get_search_fields(request)
+        if not term or not fields or not all(field.startswith('^') for field in fields):
+            return super().get_search_results(request, queryset, search_term)
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field[1:]}__gte': term, f'{field[1:]}__lt': term + PREFIX_UPPER_BOUND})
+        may_have_duplicates = any(lookup_spawns_duplicates(self.opts, field[1:]) for field in fields)
+        return queryset.filter(condition), may_have_duplicates
@@ -0,0 +1,37 @@
+"""Helpers for ``?ids=1,2,3`` multi-get endpoints."""
+from rest_framework.exceptions import ValidationError
+
+MAX_BATCH_SIZE = 100
+# Ids are 64-bit signed integers in the database.
+MAX_ID = 2 ** 63 - 1
+
+
+def parse_ids(raw, limit=MAX_BATCH_SIZE):
+    """
+    Parse a comma separated id list, dropping duplicates but keeping the
+    order the client asked for.
+    """
+    ids = []
+    for part in raw.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            value = int(part)
+        except ValueError:
+            raise ValidationError({'ids': f'"{part}" is not a valid id.'})
+        if not 0 < value <= MAX_ID:
+            raise ValidationError({'ids': f'"{part}" is not a valid id.'})
+        ids.append(value)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValidationError({'ids': 'At least one id is required.'})
+    if len(ids) > limit:
+        raise ValidationError({'ids': f'At most {limit} ids can be requested at once.'})
+    return ids
+
+
+def in_requested_order(items, ids, key):
+    """Return ``(items ordered like ids, ids that were not found)``."""
+    found = {key(item): item for item in items}
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
@@ -0,0 +1,16 @@
+"""
+Helpers for caches that must be shared between processes.
+
+An entry deleted in one process of a ``LocMemCache`` stays in every other
+process's copy. Caches that are only correct while the signal handlers that
+invalidate them reach every process (token lookups, follow lists, author
+post lists, hidden-author filters) check ``is_process_local()`` and read the
+database instead, or refuse to start when they are configured explicitly.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_process_local(alias):
+    """Whether each process holds its own copy of cache ``alias``."""
+    return isinstance(caches[alias], LocMemCache)
@@ -0,0 +1,216 @@
+"""
+Opt-in per-request profiling.
+
+``ProfilerMiddleware`` profiles a request when
+
+* it carries ``X-Profile: <token>`` with a token from ``sign()``, which works
+  for any client until the token expires (``TOKEN_MAX_AGE``),
+* it carries ``X-Profile: sample`` or ``X-Profile: cprofile`` and comes from
+  a staff user, by session or by DRF token, or
+* it is picked at random, for a ``SAMPLE_RATE`` fraction of all traffic.
+
+Everything else pays for one header lookup and one ``random()`` call.
+
+Two profilers are available. ``sample`` runs a thread that records the
+request thread's stack every ``INTERVAL`` seconds and writes the counts as
+collapsed stacks (``<id>.folded``, one ``frame;frame;frame count`` line per
+stack), which flamegraph.pl and speedscope read directly. It costs little
+enough to use on sampled traffic. ``cprofile`` runs the request under
+``cProfile`` and writes ``<id>.prof`` for ``pstats`` or snakeviz; it is
+exact but slows the request down several times.
+
+Either way ``<id>.sql.json`` lists every query with its start offset and
+duration, so time spent in the database can be told apart from the
+serializer or auth. Files go to ``DIRECTORY``; explicitly requested profiles
+return their id in the ``X-Profile-Id`` response header. Only the view is
+profiled: the body of a streamed response is produced after the middleware
+returns.
+"""
+import cProfile
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+DEFAULTS = {
+    'DIRECTORY': None,
+    'SAMPLE_RATE': 0.0,
+    'SAMPLED_MODE': 'sample',
+    'INTERVAL': 0.005,
+    'TOKEN_MAX_AGE': 3600,
+}
+
+HEADER = 'HTTP_X_PROFILE'
+MODES = ('sample', 'cprofile')
+SALT = 'social_media_api.profiling'
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'PROFILER', {})}
+    if config['DIRECTORY'] is None:
+        config['DIRECTORY'] = Path(settings.BASE_DIR) / 'profiles'
+    return config
+
+
+def sign(mode='sample'):
+    """A value for the ``X-Profile`` header that enables ``mode`` for anyone holding it."""
+    return signing.TimestampSigner(salt=SALT).sign(mode)
+
+
+def unsign(value, max_age):
+    try:
+        mode = signing.TimestampSigner(salt=SALT).unsign(value, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    return mode if mode in MODES else None
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    # API clients authenticate in the view, after middleware, so look at
+    # their token here. Only requests asking to be profiled get this far.
+    try:
+        result = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return result is not None and result[0].is_staff
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.counts[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+
+class QueryTimeline:
+    """``execute_wrapper`` recording when each query started and how long it took."""
+
+    def __init__(self, alias, started):
+        self.alias = alias
+        self.started = started
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            end = time.perf_counter()
+            self.queries.append({
+                'alias': self.alias,
+                'start_ms': round((start - self.started) * 1000, 3),
+                'duration_ms': round((end - start) * 1000, 3),
+                'many': many,
+                'sql': sql,
+            })
+
+
+class ProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        mode, explicit = self.mode_for(request, config)
+        if mode is None:
+            return self.get_response(request)
+        return self.profile(request, mode, explicit, config)
+
+    def mode_for(self, request, config):
+        """``(mode, explicit)``; ``mode`` is ``None`` when the request is not profiled."""
+        value = request.META.get(HEADER)
+        if value:
+            if value in MODES:
+                if _is_staff(request):
+                    return value, True
+            else:
+                mode = unsign(value, config['TOKEN_MAX_AGE'])
+                if mode is not None:
+                    return mode, True
+        if config['SAMPLE_RATE'] and random.random() < config['SAMPLE_RATE']:
+            return config['SAMPLED_MODE'], False
+        return None, False
+
+    def profile(self, request, mode, explicit, config):
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        started = time.perf_counter()
+        timelines = [QueryTimeline(alias, started) for alias in connections]
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+        else:
+            profiler = StackSampler(threading.get_ident(), config['INTERVAL'])
+        with ExitStack() as stack:
+            for timeline in timelines:
+                stack.enter_context(connections[timeline.alias].execute_wrapper(timeline))
+            if mode == 'cprofile':
+                profiler.enable()
+                stack.callback(profiler.disable)
+            else:
+                profiler.start()
+                stack.callback(profiler.stop)
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        self.write(profile_id, request, response, mode, profiler, timelines, elapsed, config)
+        if explicit:
+            response['X-Profile-Id'] = profile_id
+        return response
+
+    def write(self, profile_id, request, response, mode, profiler, timelines, elapsed, config):
+        directory = Path(config['DIRECTORY'])
+        directory.mkdir(parents=True, exist_ok=True)
+        if mode == 'cprofile':
+            profiler.dump_stats(directory / f'{profile_id}.prof')
+        else:
+            (directory / f'{profile_id}.folded').write_text(profiler.collapsed())
+        queries = sorted((q for t in timelines for q in t.queries), key=lambda q: q['start_ms'])
+        timeline = {
+            'id': profile_id,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'mode': mode,
+            'total_ms': round(elapsed * 1000, 3),
+            'sql_ms': round(sum(q['duration_ms'] for q in queries), 3),
+            'queries': queries,
+        }
+        (directory / f'{profile_id}.sql.json').write_text(json.dumps(timeline, indent=2))
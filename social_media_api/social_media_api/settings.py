@@ -38,14 +38,63 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework.authtoken',
     'accounts',
     'posts',
+    'uploads',
+    'outbox',
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'social_media_api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'social_media_api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Used by the token-bucket throttles in social_media_api.throttling
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '10/min',
+        'register': '5/hour',
+        'post_create': '30/min',
+        'search': '60/min',
+    },
+}
+
+# Where token buckets are kept. For limits shared by all worker processes use
+# {'BACKEND': 'social_media_api.throttling.MmapBucketStore',
+#  'OPTIONS': {'path': BASE_DIR / 'throttle.buckets', 'slots': 65536}}
+TOKEN_BUCKET_STORE = {
+    'BACKEND': 'social_media_api.throttling.CacheBucketStore',
+    'OPTIONS': {},
+}
+
+# Server-Sent Events feed stream (posts.views.feed_stream)
+FEED_STREAM_BACKEND = 'posts.pubsub.LocalBackend'
+FEED_STREAM_HISTORY = 1000
+FEED_STREAM_HEARTBEAT = 15
+
+# Purge soft-deleted users and posts on a background thread (posts.purge)
+PURGE_IN_BACKGROUND = True
+
+# Posts older than this are moved to the archive tables by "manage.py archive_posts"
+POST_ARCHIVE_AFTER_DAYS = 365
+
+# Trending hashtags (posts.trending): count-min sketch per time bucket, kept
+# in the cache; with the LocMemCache in CACHES, counts are per process
+TRENDING = {
+    'WIDTH': 2048,
+    'DEPTH': 4,
+    'TOP_K': 50,
+    'BUCKET_SECONDS': 300,
+    'BUCKETS': 12,
+    'DECAY': 0.8,
 }
 
 
@@ -55,6 +104,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'social_media_api.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -89,9 +139,118 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets readers run alongside the single writer; IMMEDIATE takes
+            # the write lock at BEGIN so transactions queue on busy_timeout
+            # instead of failing with "database is locked" when they upgrade.
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=134217728;'
+            ),
+        },
+    }
+}
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'social-media-api',
+        # Feeds and hidden-author filters keep an entry per user and author;
+        # the default of 300 would evict them on every request.
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
     }
 }
 
+# posts.comment_writes: comments created within MAX_DELAY seconds of each
+# other are inserted together, up to MAX_BATCH at a time; one still queued
+# after TIMEOUT seconds is answered with 503
+COMMENT_WRITES = {
+    'COMBINE': True,
+    'MAX_BATCH': 200,
+    'MAX_DELAY': 0.003,
+    'TIMEOUT': 10,
+}
+
+# outbox.relay: who drains the outbox ('thread', 'inline' or 'external'),
+# how many events per batch and how long a claimed batch is leased
+OUTBOX = {
+    'RELAY': 'thread',
+    'BATCH_SIZE': 100,
+    'LEASE': 30,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 10,
+}
+
+# social_media_api.profiling: where profiles are written and which fraction
+# of ordinary requests gets the sampling profiler
+PROFILER = {
+    'DIRECTORY': BASE_DIR / 'profiles',
+    'SAMPLE_RATE': 0.0,
+    'INTERVAL': 0.005,
+    'TOKEN_MAX_AGE': 3600,
+}
+
+# posts.feeds: 'sql' or 'merge' (feeds merged from cached per-author lists,
+# which needs a cache shared by every process), how many recent posts each
+# list keeps and, for the hybrid feed, below how many followers authors push
+# new posts into their followers' inboxes
+FEED = {
+    'ENGINE': 'sql',
+    'AUTHOR_LIST_SIZE': 200,
+    'INBOX_SIZE': 800,
+    'PUSH_BELOW': None,
+}
+
+# accounts.blocking: target false positive rate of the per-user Bloom filters
+# of blocked and muted authors, and how long a cached filter lives; filters
+# are only cached in a cache shared by every process
+HIDDEN_AUTHORS = {
+    'ERROR_RATE': 0.01,
+    'MIN_CAPACITY': 64,
+    'TIMEOUT': 3600,
+}
+
+# posts.compression: post and comment bodies of at least MIN_SIZE bytes are
+# stored compressed, with zstd when the zstandard package is installed
+# (ALGORITHM None) and otherwise zlib, using the newest trained dictionary
+COMPRESSED_TEXT = {
+    'ALGORITHM': None,
+    'MIN_SIZE': 256,
+    'USE_DICTIONARY': True,
+}
+
+# accounts.authentication: how long token -> user lookups stay cached once
+# DEFAULT_AUTHENTICATION_CLASSES uses CachedTokenAuthentication, which
+# needs CACHE to be shared by every process (not LocMemCache)
+TOKEN_CACHE = {
+    'TIMEOUT': 300,
+}
+
+# accounts.graph: how long each user's cached list of follows lives; only
+# cached when CACHE is shared by every process
+FOLLOW_GRAPH = {
+    'TIMEOUT': 3600,
+}
+
+# social_media_api.warmup: which caches "manage.py warm_caches" (and, with
+# ON_STARTUP, every web process as it starts) fills: the feeds, follows,
+# tokens and hidden-author filters of the USERS most recently active users,
+# and the recent post lists of the POPULAR_AUTHORS most followed authors,
+# BATCH_SIZE users per task with at most CONCURRENCY tasks at a time
+CACHE_WARMUP = {
+    'ON_STARTUP': False,
+    'USERS': 1000,
+    'ACTIVE_DAYS': 7,
+    'POPULAR_AUTHORS': 500,
+    'BATCH_SIZE': 100,
+    'CONCURRENCY': 4,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,6 +288,30 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Resumable uploads (uploads app). Partial files live in TEMP_DIR, which must
+# be on the same filesystem as MEDIA_ROOT so completing an upload is a rename.
+UPLOADS = {
+    'MAX_SIZE': 20 * 1024 * 1024,
+    'MAX_CHUNK_SIZE': 4 * 1024 * 1024,
+    'TEMP_DIR': MEDIA_ROOT / 'uploads' / 'partial',
+    'EXPIRE_AFTER': 24 * 60 * 60,
+}
+
+# posts.images: threads that resize and re-encode uploaded post images (0
+# processes them on the request, after its commit), the widths of the WebP
+# variants, the one used as "src", and how many images a post can have
+IMAGES = {
+    'WORKERS': 2,
+    'WIDTHS': (320, 640, 1080, 1920),
+    'DEFAULT_WIDTH': 640,
+    'QUALITY': 80,
+    'MAX_SIZE': 20 * 1024 * 1024,
+    'PER_POST': 4,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
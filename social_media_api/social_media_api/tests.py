@@ -0,0 +1,277 @@
+import datetime
+import decimal
+import io
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+
+from .admin_tools import EstimatedCountPaginator
+from .batch import in_requested_order, parse_ids
+from .parsers import ORJSONParser
+from .profiling import StackSampler, sign
+from .renderers import ORJSONRenderer
+from .throttling import CacheBucketStore, MmapBucketStore, refill
+from .write_queue import BulkWriteQueue
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    PAYLOADS = [
+        None,
+        [],
+        {'count': 0, 'next': None, 'previous': None, 'results': []},
+        {
+            'aware': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'offset': datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+            'naive': datetime.datetime(2024, 5, 1, 12, 30),
+            'date': datetime.date(2024, 5, 1),
+            'time': datetime.time(8, 15, 0, 500),
+            'delta': datetime.timedelta(minutes=90),
+            'decimal': decimal.Decimal('12.50'),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'lazy': gettext_lazy('Not found.'),
+            'bytes': b'raw',
+            'tuple': (1, 2),
+        },
+        {'text': 'línea separada  "quoted" \\ \n é\U0001f600', 1: 'int key', None: 'none'},
+        ReturnDict({'id': 1, 'title': 'Hello', 'nested': [{'a': 1.5, 'b': True}]}, serializer=None),
+    ]
+
+    def test_output_matches_drf_json_renderer(self):
+        for payload in self.PAYLOADS:
+            with self.subTest(payload=payload):
+                self.assertEqual(ORJSONRenderer().render(payload), JSONRenderer().render(payload))
+
+    def test_indented_output_falls_back_to_stdlib(self):
+        payload = {'a': [1, 2]}
+        context = {'indent': 4}
+        self.assertEqual(ORJSONRenderer().render(payload, 'application/json', context),
+                         JSONRenderer().render(payload, 'application/json', context))
+
+
+class ORJSONParserTests(SimpleTestCase):
+    def parse(self, parser, body, encoding='utf-8'):
+        return parser.parse(io.BytesIO(body), 'application/json', {'encoding': encoding})
+
+    def test_results_match_drf_json_parser(self):
+        for body in [b'{"a": [1, 2.5, null, true], "b": "\\u00e9"}', '"é"'.encode(),
+                     b'123456789012345678901234567890']:
+            with self.subTest(body=body):
+                self.assertEqual(self.parse(ORJSONParser(), body), self.parse(JSONParser(), body))
+
+    def test_non_utf8_bodies_use_stdlib(self):
+        body = '{"name": "café"}'.encode('latin-1')
+        self.assertEqual(self.parse(ORJSONParser(), body, 'latin-1'), {'name': 'café'})
+
+    def test_errors_match_drf_json_parser(self):
+        for body in [b'{"a": ', b'{"a": NaN}']:
+            with self.subTest(body=body):
+                with self.assertRaises(ParseError) as expected:
+                    self.parse(JSONParser(), body)
+                with self.assertRaises(ParseError) as actual:
+                    self.parse(ORJSONParser(), body)
+                self.assertEqual(str(actual.exception), str(expected.exception))
+
+
+class BatchHelperTests(SimpleTestCase):
+    def test_parse_ids_keeps_order_and_drops_duplicates(self):
+        self.assertEqual(parse_ids('3, 1,,3,2'), [3, 1, 2])
+
+    def test_parse_ids_rejects_bad_input(self):
+        for raw in ['', 'a', '1,-2', ','.join(['1', '2', '3'])]:
+            with self.subTest(raw=raw), self.assertRaises(ValidationError):
+                parse_ids(raw, limit=2)
+
+    def test_in_requested_order(self):
+        items = [{'id': 1}, {'id': 3}]
+        self.assertEqual(in_requested_order(items, [3, 2, 1], key=lambda item: item['id']),
+                         ([{'id': 3}, {'id': 1}], [2]))
+
+
+class TokenBucketStoreTests(SimpleTestCase):
+    def test_refill(self):
+        self.assertEqual(refill(0, 0, capacity=5, rate=1, now=2), (True, 1, 0))
+        self.assertEqual(refill(0.5, 10, capacity=5, rate=0.5, now=10), (False, 0.5, 1))
+        self.assertEqual(refill(4, 0, capacity=5, rate=1, now=100)[1], 4)
+
+    def assertBucketBehaviour(self, store):
+        results = [store.consume('k', 3, 1.0, now=100)[0] for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        self.assertEqual(store.consume('k', 3, 1.0, now=100), (False, 1.0))
+        self.assertEqual(store.consume('k', 3, 1.0, now=101.5)[0], True)
+        self.assertEqual(store.consume('other', 3, 1.0, now=100)[0], True)
+
+    def test_cache_store(self):
+        cache.clear()
+        self.assertBucketBehaviour(CacheBucketStore())
+
+    def test_mmap_store_is_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'buckets')
+            self.assertBucketBehaviour(MmapBucketStore(path, slots=64))
+            other_process = MmapBucketStore(path, slots=64)
+            self.assertEqual(other_process.consume('k', 3, 1.0, now=101.5), (False, 0.5))
+            self.assertEqual(os.path.getsize(path), 64 * MmapBucketStore.RECORD.size)
+
+    def test_mmap_store_reuses_stalest_slot_when_full(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = MmapBucketStore(os.path.join(directory, 'buckets'), slots=1)
+            self.assertTrue(store.consume('a', 1, 0.001, now=1)[0])
+            self.assertFalse(store.consume('a', 1, 0.001, now=2)[0])
+            self.assertTrue(store.consume('b', 1, 0.001, now=3)[0])
+            self.assertTrue(store.consume('a', 1, 0.001, now=4)[0])
+
+
+class BulkWriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.batches = []
+        self.queue = BulkWriteQueue(self.write, max_batch=50, max_delay=0.05)
+        self.addCleanup(self.queue.close)
+
+    def write(self, usernames):
+        self.batches.append(list(usernames))
+        users = get_user_model().objects.bulk_create(get_user_model()(username=name) for name in usernames)
+        return [user.pk for user in users]
+
+    def test_concurrent_writes_share_one_write(self):
+        futures = [self.queue.submit(f'user{i}') for i in range(20)]
+        pks = [future.result(5) for future in futures]
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(dict(get_user_model().objects.values_list('pk', 'username')),
+                         {pk: f'user{i}' for i, pk in enumerate(pks)})
+
+    def test_failed_write_does_not_undo_the_batch(self):
+        get_user_model().objects.create(username='taken')
+        futures = [self.queue.submit(name) for name in ('first', 'taken', 'last')]
+        self.assertTrue(futures[0].result(5))
+        with self.assertRaises(IntegrityError):
+            futures[1].result(5)
+        self.assertTrue(futures[2].result(5))
+        self.assertEqual(
+            set(get_user_model().objects.values_list('username', flat=True)), {'taken', 'first', 'last'})
+
+    def test_result_is_set_after_commit(self):
+        committed = threading.Event()
+
+        def write(usernames):
+            transaction.on_commit(committed.set)
+            return self.write(usernames)
+
+        self.queue.write_batch = write
+        self.queue.run('someone', timeout=5)
+        self.assertTrue(committed.is_set())
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        User.objects.bulk_create(User(username=f'user{i}', is_staff=i % 2 == 0) for i in range(12))
+        self.users = User.objects.order_by('pk')
+
+    def paginator(self, queryset, max_count):
+        paginator = EstimatedCountPaginator(queryset, 5)
+        paginator.max_count = max_count
+        return paginator
+
+    def test_unfiltered_count_is_estimated(self):
+        get_user_model().objects.filter(username='user3').delete()
+        with self.assertNumQueries(1) as queries:
+            self.assertEqual(self.paginator(self.users, 5).count, 12)
+        self.assertNotIn('COUNT', queries.captured_queries[0]['sql'])
+
+    def test_small_tables_are_counted_exactly(self):
+        get_user_model().objects.filter(username='user3').delete()
+        self.assertEqual(self.paginator(self.users, 100).count, 11)
+
+    def test_filtered_count_is_capped(self):
+        staff = self.users.filter(is_staff=True)
+        self.assertEqual(self.paginator(staff, 100).count, 6)
+        self.assertEqual(self.paginator(staff, 4).count, 4)
+
+
+class ProfilerMiddlewareTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        User = get_user_model()
+        self.staff_token = Token.objects.create(user=User.objects.create(username='staff', is_staff=True))
+        self.user_token = Token.objects.create(user=User.objects.create(username='user'))
+
+    def get(self, token=None, profile=None, **config):
+        headers = {}
+        if token is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+        if profile is not None:
+            headers['HTTP_X_PROFILE'] = profile
+        with override_settings(PROFILER={'DIRECTORY': self.directory, **config}):
+            return self.client.get('/api/posts/', **headers)
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_ordinary_requests_are_not_profiled(self):
+        response = self.get(self.staff_token)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.files(), [])
+
+    def test_staff_request_writes_stacks_and_sql_timeline(self):
+        response = self.get(self.staff_token, 'sample')
+        profile_id = response['X-Profile-Id']
+        self.assertEqual(self.files(), [f'{profile_id}.folded', f'{profile_id}.sql.json'])
+        with open(os.path.join(self.directory, f'{profile_id}.sql.json')) as f:
+            timeline = json.load(f)
+        self.assertEqual((timeline['path'], timeline['status'], timeline['mode']), ('/api/posts/', 200, 'sample'))
+        self.assertTrue(any('posts_post' in query['sql'] for query in timeline['queries']))
+        starts = [query['start_ms'] for query in timeline['queries']]
+        self.assertEqual(starts, sorted(starts))
+        self.assertLessEqual(timeline['sql_ms'], timeline['total_ms'])
+
+    def test_other_users_need_a_signed_header(self):
+        response = self.get(self.user_token, 'cprofile')
+        self.assertNotIn('X-Profile-Id', response)
+        response = self.get(None, sign('cprofile'))
+        profile_id = response['X-Profile-Id']
+        stats = pstats.Stats(os.path.join(self.directory, f'{profile_id}.prof'))
+        self.assertTrue(stats.total_calls)
+
+    def test_forged_and_expired_tokens_are_ignored(self):
+        self.get(None, sign('cprofile') + 'x')
+        self.get(None, sign('cprofile'), TOKEN_MAX_AGE=-1)
+        self.assertEqual(self.files(), [])
+
+    def test_sampled_traffic_is_profiled_silently(self):
+        response = self.get(None, SAMPLE_RATE=1.0)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(len(self.files()), 2)
+
+
+class StackSamplerTests(SimpleTestCase):
+    def test_counts_the_sampled_threads_stacks(self):
+        def busy_loop(until):
+            while time.perf_counter() < until:
+                pass
+
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_loop(time.perf_counter() + 0.1)
+        sampler.stop()
+        lines = sampler.collapsed().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertIn('busy_loop', stack.split(';')[-1])
+        self.assertGreater(int(count), 5)
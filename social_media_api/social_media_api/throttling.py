@@ -0,0 +1,193 @@
+"""
+Token-bucket throttling with a fixed-size state per client.
+
+DRF's ``SimpleRateThrottle`` keeps a list with one timestamp per request in
+the window, so its cache entries grow with the request rate. A token bucket
+only needs ``(tokens, updated_at)``: tokens refill continuously at
+``num_requests / duration`` up to ``num_requests``, and each request spends
+one. Rates come from ``DEFAULT_THROTTLE_RATES`` as usual.
+
+Two stores are provided, selected with ``TOKEN_BUCKET_STORE``:
+
+* ``CacheBucketStore`` keeps buckets in a Django cache. With the default
+  local-memory cache that is per process.
+* ``MmapBucketStore`` keeps buckets in a fixed-size table in a memory-mapped
+  file guarded by ``fcntl.lockf``, so every worker process on the host shares
+  the same limits.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+DEFAULT_STORE = {'BACKEND': 'social_media_api.throttling.CacheBucketStore', 'OPTIONS': {}}
+
+
+def refill(tokens, updated_at, capacity, rate, now):
+    """Spend one token if possible; return ``(allowed, tokens, wait_seconds)``."""
+    tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+class CacheBucketStore:
+    def __init__(self, cache='default'):
+        self.cache = caches[cache]
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, now):
+        with self.lock:
+            tokens, updated_at = self.cache.get(key, (capacity, now))
+            allowed, tokens, wait = refill(tokens, updated_at, capacity, rate, now)
+            # Once the bucket has had time to refill completely the entry
+            # carries no information, so let the cache expire it.
+            self.cache.set(key, (tokens, now), timeout=int(capacity / rate) + 1)
+        return allowed, wait
+
+
+class MmapBucketStore:
+    """
+    Open-addressing hash table of ``slots`` 24-byte records
+    ``(key hash, tokens, updated_at)`` in a shared file. A key is looked
+    for in ``PROBES`` consecutive slots; when all of them belong to other
+    keys, the one updated longest ago is reused.
+    """
+
+    RECORD = struct.Struct('<Qdd')
+    PROBES = 8
+
+    def __init__(self, path, slots=65536):
+        self.slots = slots
+        size = slots * self.RECORD.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        # lockf serializes processes; the thread lock serializes threads,
+        # which share the process's lock.
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def _hash(self, key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def consume(self, key, capacity, rate, now):
+        record, mapping = self.RECORD, self.map
+        key_hash = self._hash(key)
+        start = key_hash % self.slots
+        with self._locked():
+            target, oldest = None, None
+            tokens, updated_at = capacity, now
+            for probe in range(self.PROBES):
+                offset = (start + probe) % self.slots * record.size
+                slot_hash, slot_tokens, slot_updated = record.unpack_from(mapping, offset)
+                if slot_hash == key_hash:
+                    target, tokens, updated_at = offset, slot_tokens, slot_updated
+                    break
+                if slot_hash == 0:
+                    target = offset
+                    break
+                if oldest is None or slot_updated < oldest[1]:
+                    oldest = (offset, slot_updated)
+            if target is None:
+                target = oldest[0]
+            allowed, tokens, wait = refill(tokens, updated_at, capacity, rate, now)
+            record.pack_into(mapping, target, key_hash, tokens, now)
+        return allowed, wait
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = getattr(settings, 'TOKEN_BUCKET_STORE', DEFAULT_STORE)
+                _store = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _store
+
+
+def reset_store():
+    global _store
+    with _store_lock:
+        _store = None
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Drop-in replacement for ``SimpleRateThrottle`` subclasses: same
+    ``scope``/rate configuration and cache keys, O(1) state per key.
+    """
+
+    timer = time.time
+
+    def get_rate(self):
+        # Read the rates on each instantiation rather than once at import.
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope) if self.scope else None
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        capacity = self.num_requests
+        allowed, self._wait = get_store().consume(
+            self.key, capacity, capacity / self.duration, self.timer())
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class AnonTokenBucketThrottle(TokenBucketThrottle):
+    """Keyed by client IP, for endpoints used before logging in."""
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Keyed by user id, or by IP for anonymous requests."""
+
+    def get_cache_key(self, request, view):
+        ident = request.user.pk if request.user and request.user.is_authenticated else self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class LoginThrottle(AnonTokenBucketThrottle):
+    scope = 'login'
+
+
+class RegisterThrottle(AnonTokenBucketThrottle):
+    scope = 'register'
+
+
+class PostCreateThrottle(UserTokenBucketThrottle):
+    scope = 'post_create'
+
+
+class SearchThrottle(UserTokenBucketThrottle):
+    scope = 'search'
@@ -20,5 +20,7 @@ from django.urls import path, include
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/accounts/', include('accounts.urls')),
+    path('api/uploads/', include('uploads.urls')),
+    path('api/outbox/', include('outbox.urls')),
     path('api/', include('posts.urls')),
 ]
@@ -0,0 +1,200 @@
+"""
+Cache warm-up after a deploy or restart.
+
+A new process starts with empty caches, so the first requests after a
+restart all miss and the database takes the full load at once. ``warm()``
+fills what the busiest requests read before the traffic does:
+
+* for the ``USERS`` users who logged in most recently (within
+  ``ACTIVE_DAYS``): their follows (``accounts.graph``), token -> user
+  lookups (``accounts.authentication``) and hidden-author filters
+  (``accounts.blocking``), and with ``FEED['ENGINE'] = 'merge'`` the author
+  lists and inboxes their feeds merge (``posts.feeds``);
+* the recent post lists of the ``POPULAR_AUTHORS`` most followed authors,
+  which their timelines and most feeds read.
+
+Users are loaded ``BATCH_SIZE`` at a time, a few queries per batch and
+artifact, and up to ``CONCURRENCY`` batches run at once on a thread pool.
+The result lists, per artifact, the entries written, the time batches
+spent on them and the share of those entries still cached at the end; a
+cache too small for the working set shows up as a low hit ratio.
+
+Token lookups are only warmed when ``CachedTokenAuthentication`` is
+enabled, and follows, hidden-author filters and author lists only when
+their caches are shared (see ``social_media_api.caching``): with a
+per-process cache they are read from the database on every request, so
+there is nothing to warm. ``ON_STARTUP`` runs the warm-up on a background
+thread as each WSGI/ASGI application loads.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts import authentication, blocking, graph
+from posts import feeds
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ON_STARTUP': False,
+    'USERS': 1000,
+    'ACTIVE_DAYS': 7,
+    'POPULAR_AUTHORS': 500,
+    'BATCH_SIZE': 100,
+    'CONCURRENCY': 4,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CACHE_WARMUP', {})}
+
+
+def aliases():
+    """The caches ``warm()`` fills."""
+    used = set()
+    if blocking.is_cached():
+        used.add(blocking.get_config()['CACHE'])
+    if feeds.is_cached():
+        used.add(feeds.get_config()['CACHE'])
+    if graph.is_cached():
+        used.add(graph.get_config()['CACHE'])
+    if authentication.enabled():
+        used.add(authentication.get_config()['CACHE'])
+    return sorted(used)
+
+
+def active_user_ids(config):
+    since = timezone.now() - timedelta(days=config['ACTIVE_DAYS'])
+    users = get_user_model().objects.filter(is_active=True, deleted_at__isnull=True, last_login__gte=since)
+    return list(users.order_by('-last_login').values_list('pk', flat=True)[:config['USERS']])
+
+
+def popular_author_ids(config):
+    users = get_user_model().objects.filter(is_active=True, deleted_at__isnull=True)
+    return list(users.order_by('-follower_count', '-pk').values_list('pk', flat=True)[:config['POPULAR_AUTHORS']])
+
+
+class _Batch:
+    """``{artifact: (cache alias, keys written, seconds)}`` for one batch."""
+
+    def __init__(self):
+        self.done = {}
+
+    def run(self, artifact, alias, func):
+        start = time.perf_counter()
+        result = func()
+        self.done[artifact] = (alias, list(result), time.perf_counter() - start)
+        return result
+
+
+def _warm_users(user_ids):
+    batch = _Batch()
+
+    def follow_sets():
+        following.update(graph.load_following(user_ids))
+        return [graph.following_key(user_id) for user_id in following]
+
+    def hidden_filters():
+        for user_id in user_ids:
+            blocking.build(user_id)
+        return [blocking.filter_key(user_id) for user_id in user_ids]
+
+    following = {}
+    if graph.is_cached():
+        batch.run('follow sets', graph.get_config()['CACHE'], follow_sets)
+    else:
+        following.update(graph.load_following(user_ids))
+    if authentication.enabled():
+        batch.run('tokens', authentication.get_config()['CACHE'], lambda: authentication.cache_tokens(
+            Token.objects.filter(user_id__in=user_ids).select_related('user')))
+    if blocking.is_cached():
+        batch.run('hidden filters', blocking.get_config()['CACHE'], hidden_filters)
+    if feeds.get_config()['ENGINE'] == 'merge' and feeds.is_cached():
+        batch.run('feeds', feeds.get_config()['CACHE'], lambda: feeds.load_feeds(following))
+    return batch.done
+
+
+def _warm_authors(author_ids):
+    batch = _Batch()
+    batch.run('popular authors', feeds.get_config()['CACHE'], lambda: [
+        feeds.author_key(author_id) for author_id in feeds.author_lists(author_ids)])
+    return batch.done
+
+
+def _in_worker(func, ids):
+    try:
+        return func(ids)
+    finally:
+        connection.close()
+
+
+def warm(**overrides):
+    """
+    Fill the caches; ``overrides`` replace ``CACHE_WARMUP`` settings.
+    Returns ``{'seconds', 'users', 'authors', 'artifacts': {artifact:
+    {'entries', 'seconds', 'hit_ratio'}}}``.
+    """
+    config = {**get_config(), **overrides}
+    started = time.perf_counter()
+    users = active_user_ids(config)
+    authors = popular_author_ids(config) if feeds.is_cached() else []
+    size = config['BATCH_SIZE']
+    tasks = [(_warm_users, users[start:start + size]) for start in range(0, len(users), size)]
+    tasks += [(_warm_authors, authors[start:start + size]) for start in range(0, len(authors), size)]
+    if config['CONCURRENCY']:
+        with ThreadPoolExecutor(config['CONCURRENCY'], thread_name_prefix='cache-warmup') as pool:
+            outcomes = list(pool.map(lambda task: _in_worker(*task), tasks))
+    else:
+        outcomes = [func(ids) for func, ids in tasks]
+    seconds = time.perf_counter() - started
+    totals = {}
+    for outcome in outcomes:
+        for artifact, (alias, keys, spent) in outcome.items():
+            total = totals.setdefault(artifact, {'alias': alias, 'keys': {}, 'seconds': 0.0})
+            total['keys'].update(dict.fromkeys(keys))
+            total['seconds'] += spent
+    artifacts = {}
+    for artifact, total in totals.items():
+        keys = list(total['keys'])
+        cached = sum(len(caches[total['alias']].get_many(keys[start:start + 1000]))
+                     for start in range(0, len(keys), 1000))
+        artifacts[artifact] = {'entries': len(keys), 'seconds': total['seconds'],
+                               'hit_ratio': cached / len(keys) if keys else 1.0}
+    return {'seconds': seconds, 'users': len(users), 'authors': len(authors), 'artifacts': artifacts}
+
+
+def report_lines(result):
+    lines = [f'Warmed {result["users"]} active users and {result["authors"]} popular authors '
+             f'in {result["seconds"]:.2f}s',
+             f'{"artifact":<18}{"entries":>9}{"batch s":>9}{"hit ratio":>11}']
+    for artifact, stats in result['artifacts'].items():
+        lines.append(f'{artifact:<18}{stats["entries"]:>9}{stats["seconds"]:>9.2f}{stats["hit_ratio"]:>11.1%}')
+    return lines
+
+
+def warm_on_startup():
+    """Warm this process's caches on a background thread when ``ON_STARTUP`` is set."""
+    if not get_config()['ON_STARTUP']:
+        return None
+
+    def run():
+        try:
+            for line in report_lines(warm()):
+                logger.info(line)
+        except Exception:
+            logger.exception('Cache warm-up failed.')
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name='cache-warmup', daemon=True)
+    thread.start()
+    return thread
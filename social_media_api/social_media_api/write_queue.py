@@ -0,0 +1,113 @@
+"""
+In-process write queue that commits many small writes in one transaction.
+
+SQLite allows one writer at a time, and each commit costs an fsync (or a
+WAL append). When many requests each want to insert a row of the same
+shape, handing the rows to a single thread that groups whatever arrives
+within ``max_delay`` seconds (up to ``max_batch`` items) and writes them
+with one call, e.g. one ``bulk_create``, in one transaction removes the
+lock contention and amortizes both the statements and the commit. Callers
+only see a result once the batch has committed.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.db import connections, transaction
+
+_STOP = object()
+
+
+class BulkWriteQueue:
+    """
+    Collects items and writes each batch with ``write_batch(items)``, which
+    must return one result per item, in order. If the combined write fails,
+    the batch is retried one item per transaction so that only the bad
+    items fail. (Savepoints would not do: SQLite checks foreign keys at
+    commit.)
+    """
+
+    def __init__(self, write_batch, max_batch=100, max_delay=0.005, using='default'):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.using = using
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue ``item`` and return a ``Future`` for its result."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((future, item))
+        return future
+
+    def run(self, item, timeout=None):
+        """Queue ``item`` and block until its batch has committed."""
+        return self.submit(item).result(timeout)
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._work, name='write-queue', daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self):
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    return
+                self._commit(batch)
+        finally:
+            connections[self.using].close()
+
+    def _commit(self, batch):
+        batch = [(future, item) for future, item in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            with transaction.atomic(using=self.using):
+                results = self.write_batch([item for _, item in batch])
+        except Exception:
+            for future, item in batch:
+                try:
+                    with transaction.atomic(using=self.using):
+                        result, = self.write_batch([item])
+                except Exception as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+            return
+        for (future, _), result in zip(batch, results):
+            future.set_result(result)
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_media_api.settings')
 
 application = get_wsgi_application()
+
+# Imported once the app registry is ready; warms this process's caches
+# when CACHE_WARMUP['ON_STARTUP'] is set.
+from social_media_api.warmup import warm_on_startup  # noqa: E402
+
+warm_on_startup()
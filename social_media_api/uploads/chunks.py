@@ -0,0 +1,201 @@
+"""
+Resumable uploads written straight to disk.
+
+An upload is created with its final size and then sent as chunks with
+``PUT /api/uploads/<id>/`` and an ``Upload-Offset`` header. Each request
+streams its body into the partial file with ``os.pwrite`` at that offset,
+``PIECE_SIZE`` bytes at a time, so neither Django nor the view holds a whole
+chunk in memory and a worker is never tied up for longer than one chunk. The
+offset stored in the database only moves once the whole chunk (and its
+``Upload-Checksum``, if sent) is on disk, so after a dropped connection the
+client asks for the offset and resends from there.
+
+Completing an upload checks its size and SHA-256 and hands the partial file
+to the upload's target: ``User.profile_picture``, or a post image through
+``posts.images.accept_upload``, which queues it like ``POST /api/images/``
+does and reports it in the response. ``FileSystemStorage``
+moves a file that has a ``temporary_file_path()`` into place with a rename
+instead of copying it.
+"""
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from posts.images import accept_upload, image_data
+from .models import Upload
+
+PIECE_SIZE = 64 * 1024
+
+DEFAULTS = {
+    'MAX_SIZE': 20 * 1024 * 1024,
+    'MAX_CHUNK_SIZE': 4 * 1024 * 1024,
+    'TEMP_DIR': None,
+    'EXPIRE_AFTER': 24 * 60 * 60,
+}
+
+
+class UploadConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The upload is not at that offset.'
+    default_code = 'conflict'
+
+
+class LengthRequired(APIException):
+    status_code = status.HTTP_411_LENGTH_REQUIRED
+    default_detail = 'Chunks must be sent with a Content-Length.'
+    default_code = 'length_required'
+
+
+class ChunkTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'The chunk is too large.'
+    default_code = 'too_large'
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'UPLOADS', {})}
+    if config['TEMP_DIR'] is None:
+        config['TEMP_DIR'] = Path(settings.MEDIA_ROOT) / 'uploads' / 'partial'
+    return config
+
+
+def partial_path(upload):
+    return Path(get_config()['TEMP_DIR']) / f'{upload.pk}.part'
+
+
+class PartialFile(File):
+    """A finished partial file; storages that can will move it rather than copy it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def attach_profile_picture(upload, path):
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError):
+        raise ValidationError({'detail': 'The upload is not an image.'})
+    user = upload.owner
+    with PartialFile(open(path, 'rb'), name=upload.filename) as content:
+        user.profile_picture.save(upload.filename, content, save=False)
+    user.save(update_fields=['profile_picture'])
+    return {}
+
+
+def attach_post_image(upload, path):
+    with PartialFile(open(path, 'rb'), name=upload.filename) as content:
+        image, _ = accept_upload(upload.owner, content)
+    return {'image': image_data(image)}
+
+
+# Where a completed upload can go: target name -> attach(upload, path), which
+# returns the fields to add to the completion response.
+TARGETS = {
+    'profile_picture': attach_profile_picture,
+    'post_image': attach_post_image,
+}
+
+
+def create_upload(owner, target, filename, size, sha256=''):
+    if size > get_config()['MAX_SIZE']:
+        raise ValidationError({'size': f'Uploads are limited to {get_config()["MAX_SIZE"]} bytes.'})
+    upload = Upload.objects.create(owner=owner, target=target, filename=filename, size=size, sha256=sha256)
+    path = partial_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return upload
+
+
+@contextmanager
+def _locked(upload):
+    # One writer per upload across threads and processes; closing the
+    # descriptor releases the lock.
+    try:
+        fd = os.open(partial_path(upload), os.O_RDWR)
+    except FileNotFoundError:
+        raise UploadConflict('The upload has expired.')
+    try:
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise UploadConflict('Another chunk of this upload is being written.')
+        upload.refresh_from_db(fields=['received', 'status'])
+        if upload.status != Upload.PENDING:
+            raise UploadConflict('The upload is already complete.')
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def write_chunk(upload, offset, stream, length, checksum=''):
+    """Append ``length`` bytes from ``stream`` at ``offset``; return the new offset."""
+    if upload.status != Upload.PENDING:
+        raise UploadConflict('The upload is already complete.')
+    if length is None:
+        raise LengthRequired()
+    if length > get_config()['MAX_CHUNK_SIZE']:
+        raise ChunkTooLarge(f'Chunks are limited to {get_config()["MAX_CHUNK_SIZE"]} bytes.')
+    if offset + length > upload.size:
+        raise ValidationError({'detail': 'The chunk ends past the size of the upload.'})
+    digest = hashlib.sha256()
+    with _locked(upload) as fd:
+        if offset != upload.received:
+            raise UploadConflict(f'The upload is at offset {upload.received}.')
+        position, end = offset, offset + length
+        while position < end:
+            piece = stream.read(min(PIECE_SIZE, end - position))
+            if not piece:
+                raise ValidationError({'detail': 'The chunk is shorter than its Content-Length.'})
+            digest.update(piece)
+            view = memoryview(piece)
+            while view:
+                written = os.pwrite(fd, view, position)
+                view, position = view[written:], position + written
+        if checksum and digest.hexdigest() != checksum.lower():
+            raise ValidationError({'detail': 'The chunk does not match its checksum.'})
+        Upload.objects.filter(pk=upload.pk, received=offset).update(received=end)
+        upload.received = end
+    return end
+
+
+def _file_sha256(fd, size):
+    digest = hashlib.sha256()
+    position = 0
+    while position < size:
+        piece = os.pread(fd, min(PIECE_SIZE * 16, size - position), position)
+        if not piece:
+            break
+        digest.update(piece)
+        position += len(piece)
+    return digest.hexdigest()
+
+
+def complete_upload(upload):
+    """Verify and attach a fully received upload; returns ``(upload, attached)``."""
+    with _locked(upload) as fd:
+        if upload.received != upload.size:
+            raise ValidationError({'detail': f'Only {upload.received} of {upload.size} bytes were received.'})
+        # Bytes past ``received`` are left over from interrupted chunks.
+        os.ftruncate(fd, upload.size)
+        if upload.sha256 and _file_sha256(fd, upload.size) != upload.sha256:
+            raise ValidationError({'detail': 'The file does not match its SHA-256.'})
+        attached = TARGETS[upload.target](upload, partial_path(upload))
+        upload.status, upload.completed_at = Upload.COMPLETE, timezone.now()
+        upload.save(update_fields=['status', 'completed_at'])
+    partial_path(upload).unlink(missing_ok=True)
+    return upload, attached
+
+
+def discard_upload(upload):
+    partial_path(upload).unlink(missing_ok=True)
+    upload.delete()
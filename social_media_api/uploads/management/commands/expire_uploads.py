@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from uploads.chunks import discard_upload, get_config
+from uploads.models import Upload
+
+
+class Command(BaseCommand):
+    help = 'Delete pending uploads (and their partial files) older than UPLOADS["EXPIRE_AFTER"] seconds.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=get_config()['EXPIRE_AFTER'])
+        expired = Upload.objects.filter(status=Upload.PENDING, created_at__lt=cutoff)
+        count = 0
+        for upload in list(expired):
+            discard_upload(upload)
+            count += 1
+        self.stdout.write(f'Expired {count} uploads')
@@ -0,0 +1,27 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+class Upload(models.Model):
+    """A resumable upload; ``received`` bytes of ``size`` are in the partial file."""
+
+    PENDING = 'pending'
+    COMPLETE = 'complete'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (COMPLETE, 'Complete')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='uploads')
+    target = models.CharField(max_length=50)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    # Hex SHA-256 of the whole file, checked on completion when given.
+    sha256 = models.CharField(max_length=64, blank=True)
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
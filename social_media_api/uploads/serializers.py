@@ -0,0 +1,16 @@
+from rest_framework import serializers
+
+from .chunks import TARGETS
+from .models import Upload
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    target = serializers.ChoiceField(choices=sorted(TARGETS))
+    size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True)
+    offset = serializers.IntegerField(source='received', read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'target', 'filename', 'size', 'sha256', 'offset', 'status', 'created_at', 'completed_at']
+        read_only_fields = ['status', 'completed_at']
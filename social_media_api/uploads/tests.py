@@ -0,0 +1,159 @@
+import hashlib
+import io
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from posts.models import Image as PostImage
+from .chunks import partial_path
+from .models import Upload
+
+User = get_user_model()
+
+
+def png_bytes(size=(48, 48)):
+    # Noise, so the PNG spans several chunks.
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, UPLOADS={
+            'MAX_SIZE': 100_000, 'MAX_CHUNK_SIZE': 1000, 'TEMP_DIR': os.path.join(media.name, 'partial')})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+        self.user = User.objects.create_user('uploader', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = png_bytes()
+
+    def start(self, data=None, **extra):
+        data = self.data if data is None else data
+        response = self.client.post('/api/uploads/', {
+            'target': 'profile_picture', 'filename': 'me.png', 'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(), **extra}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def put(self, upload_id, offset, chunk, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum is not None:
+            headers['HTTP_UPLOAD_CHECKSUM'] = f'sha256 {checksum}'
+        return self.client.generic('PUT', f'/api/uploads/{upload_id}/', chunk,
+                                   content_type='application/offset+octet-stream', **headers)
+
+    def send_all(self, upload_id, data=None):
+        data = self.data if data is None else data
+        for offset in range(0, len(data), 1000):
+            chunk = data[offset:offset + 1000]
+            response = self.put(upload_id, offset, chunk, hashlib.sha256(chunk).hexdigest())
+            self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_chunks_are_assembled_and_attached(self):
+        upload_id = self.start()
+        response = self.send_all(upload_id)
+        self.assertEqual(response.data['offset'], len(self.data))
+        self.assertEqual(response['Upload-Offset'], str(len(self.data)))
+        response = self.client.post(f'/api/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['status'], 'complete')
+        self.user.refresh_from_db()
+        with self.user.profile_picture.open('rb') as picture:
+            self.assertEqual(picture.read(), self.data)
+        self.assertTrue(self.user.profile_picture.path.startswith(self.media))
+        self.assertFalse(os.listdir(os.path.join(self.media, 'partial')))
+        self.assertEqual(self.put(upload_id, len(self.data), b'x').status_code, 409)
+
+    def test_post_images_are_handed_to_the_image_pipeline(self):
+        upload_id = self.start(target='post_image')
+        self.send_all(upload_id)
+        response = self.client.post(f'/api/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 200, response.data)
+        image = PostImage.objects.get(pk=response.data['image']['id'])
+        self.assertEqual((response.data['image']['status'], image.sha256),
+                         ('pending', hashlib.sha256(self.data).hexdigest()))
+        self.assertEqual(list(image.uploaders.all()), [self.user])
+        with image.original.open('rb') as original:
+            self.assertEqual(original.read(), self.data)
+        self.assertFalse(os.listdir(os.path.join(self.media, 'partial')))
+
+    def test_resume_after_a_bad_chunk(self):
+        upload_id = self.start()
+        first = self.data[:1000]
+        self.assertEqual(self.put(upload_id, 0, first).status_code, 200)
+        conflict = self.put(upload_id, 0, first)
+        self.assertEqual(conflict.status_code, 409)
+        self.assertIn('1000', str(conflict.data['detail']))
+        corrupt = self.put(upload_id, 1000, self.data[1000:2000], hashlib.sha256(b'other').hexdigest())
+        self.assertEqual(corrupt.status_code, 400)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['offset'], 1000)
+        for offset in range(1000, len(self.data), 1000):
+            self.assertEqual(self.put(upload_id, offset, self.data[offset:offset + 1000]).status_code, 200)
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/complete/').status_code, 200)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=500)
+    def test_chunks_are_streamed_not_buffered(self):
+        upload_id = self.start()
+        self.send_all(upload_id)
+        self.assertEqual(partial_path(Upload.objects.get()).read_bytes(), self.data)
+
+    def test_completion_checks_size_checksum_and_content(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.data[:1000])
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/complete/').status_code, 400)
+
+        upload_id = self.start(sha256=hashlib.sha256(b'something else').hexdigest())
+        self.send_all(upload_id)
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/complete/').status_code, 400)
+
+        not_an_image = b'hello' * 300
+        upload_id = self.start(not_an_image)
+        self.send_all(upload_id, not_an_image)
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/complete/').status_code, 400)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.profile_picture)
+
+    def test_limits(self):
+        response = self.client.post('/api/uploads/', {
+            'target': 'profile_picture', 'filename': 'big.png', 'size': 100_001}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/uploads/', {
+            'target': 'elsewhere', 'filename': 'a.png', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, 400)
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.data[:1001]).status_code, 413)
+        self.assertEqual(self.put(upload_id, len(self.data) - 10, b'x' * 20).status_code, 400)
+        response = self.client.generic('PUT', f'/api/uploads/{upload_id}/', b'x')
+        self.assertEqual(response.status_code, 400)
+
+    def test_uploads_are_private(self):
+        upload_id = self.start()
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('other', password='pw'))
+        self.assertEqual(other.get(f'/api/uploads/{upload_id}/').status_code, 404)
+        self.assertEqual(APIClient().get(f'/api/uploads/{upload_id}/').status_code, 401)
+
+    def test_delete_and_expire(self):
+        upload_id = self.start()
+        self.assertEqual(self.client.delete(f'/api/uploads/{upload_id}/').status_code, 204)
+        stale = self.start()
+        Upload.objects.filter(pk=stale).update(created_at=Upload.objects.get().created_at - timedelta(days=2))
+        fresh = self.start()
+        out = StringIO()
+        call_command('expire_uploads', stdout=out)
+        self.assertIn('Expired 1 uploads', out.getvalue())
+        self.assertEqual([str(pk) for pk in Upload.objects.values_list('pk', flat=True)], [fresh])
+        self.assertEqual(os.listdir(os.path.join(self.media, 'partial')), [f'{fresh}.part'])
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .views import UploadCompleteView, UploadCreateView, UploadDetailView
+
+urlpatterns = [
+    path('', UploadCreateView.as_view(), name='upload-create'),
+    path('<uuid:upload_id>/', UploadDetailView.as_view(), name='upload-detail'),
+    path('<uuid:upload_id>/complete/', UploadCompleteView.as_view(), name='upload-complete'),
+]
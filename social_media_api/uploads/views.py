@@ -0,0 +1,72 @@
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .chunks import complete_upload, create_upload, discard_upload, get_config, write_chunk
+from .models import Upload
+from .serializers import UploadSerializer
+
+
+class UploadOwnerMixin:
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, upload_id):
+        return get_object_or_404(Upload, pk=upload_id, owner=self.request.user)
+
+
+class UploadCreateView(APIView):
+    """``POST /api/uploads/``: start an upload of ``size`` bytes for ``target``."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        upload = create_upload(request.user, data['target'], data['filename'], data['size'],
+                               data.get('sha256', '').lower())
+        body = {**UploadSerializer(upload).data, 'max_chunk_size': get_config()['MAX_CHUNK_SIZE']}
+        return Response(body, status=status.HTTP_201_CREATED)
+
+
+class UploadDetailView(UploadOwnerMixin, APIView):
+    """
+    ``GET`` reports the offset to resume from, ``PUT`` writes the request
+    body at the ``Upload-Offset`` header, ``DELETE`` abandons the upload.
+    """
+
+    def get(self, request, upload_id):
+        return Response(UploadSerializer(self.get_upload(upload_id)).data)
+
+    def put(self, request, upload_id):
+        upload = self.get_upload(upload_id)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META['CONTENT_LENGTH']) if request.META.get('CONTENT_LENGTH') else None
+        except (KeyError, ValueError):
+            return Response({'detail': 'A numeric Upload-Offset header is required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        checksum = request.headers.get('Upload-Checksum', '')
+        algorithm, _, checksum = checksum.partition(' ')
+        if algorithm and algorithm.lower() != 'sha256':
+            return Response({'detail': 'Upload-Checksum must be "sha256 <hex digest>".'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # Read the raw stream; request.data would buffer the whole body.
+        offset = write_chunk(upload, offset, request.stream, length, checksum)
+        return Response({'offset': offset}, headers={'Upload-Offset': str(offset)})
+
+    def delete(self, request, upload_id):
+        discard_upload(self.get_upload(upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadCompleteView(UploadOwnerMixin, APIView):
+    """
+    ``POST /api/uploads/<id>/complete/``: verify the file and attach it to
+    its target. A ``post_image`` upload's response includes the ``image``.
+    """
+
+    def post(self, request, upload_id):
+        upload, attached = complete_upload(self.get_upload(upload_id))
+        return Response({**UploadSerializer(upload).data, **attached})